@@ -12,17 +12,21 @@ import time
 import copy
 import logging
 from concurrent.futures import ThreadPoolExecutor, wait
-from flask import Flask, send_from_directory, request, jsonify, session
+from flask import Flask, request, jsonify, session
 from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
-from werkzeug.utils import secure_filename
 from collections import deque
 
 import tomllib
 import requests
 
 import app_state
+import downloads
+import session_resources
+import static_assets
+import uploads
 from utils import ensure_https, get_gateway_host
 from pat_rotator import PATRotator
+from scheduler import DeadlineScheduler
 from telemetry import log_telemetry, set_product_info
 
 # Sanitize DATABRICKS_TOKEN early — the platform sometimes injects trailing
@@ -42,9 +46,25 @@ except Exception:
 
 # Session timeout configuration
 SESSION_TIMEOUT_SECONDS = 86400      # No poll for 24 hours = dead session
-CLEANUP_INTERVAL_SECONDS = 900       # Check for stale sessions every 15 min
+CLEANUP_INTERVAL_SECONDS = 900       # Backstop sweep re-arming any missing idle timer
 GRACEFUL_SHUTDOWN_WAIT = 3          # Seconds to wait after SIGHUP before SIGKILL
 MAX_CONCURRENT_SESSIONS = int(os.environ.get("MAX_CONCURRENT_SESSIONS", "5"))
+OUTPUT_HISTORY_CHARS = 256 * 1024    # Recent output kept per session for delta reattach
+
+# HTTP poll cadence hint (next_poll_ms in /api/output-batch): fast while a
+# session is producing output or receiving input, doubling every
+# POLL_BACKOFF_STEP_SECONDS of quiet up to POLL_INTERVAL_MAX_MS
+POLL_INTERVAL_MIN_MS = 100
+POLL_INTERVAL_MAX_MS = int(os.environ.get("POLL_INTERVAL_MAX_MS", "2000"))
+POLL_BACKOFF_STEP_SECONDS = 2
+
+# Idle hibernation (opt-in via SESSION_HIBERNATE_AFTER_SECONDS, see session_resources)
+HIBERNATE_CHECK_INTERVAL_SECONDS = 60   # CPU re-check delay for idle but busy sessions
+HIBERNATED_WAIT_SECONDS = 30            # Reader liveness check while hibernated
+HIBERNATE_DIR = os.environ.get(
+    "SESSION_HIBERNATE_DIR",
+    os.path.join(os.environ.get("TMPDIR", "/tmp"), "coda-hibernate"),
+)
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
@@ -52,7 +72,8 @@ logger = logging.getLogger(__name__)
 
 # PAT auto-rotation — initialized after sessions dict is defined (see below)
 
-app = Flask(__name__, static_folder='static', static_url_path='/static')
+# Static files are served by static_assets (hashed URLs, precompression, ETags)
+app = Flask(__name__, static_folder=None)
 app.secret_key = os.urandom(24)
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 32 MB — aligned with Claude Code's 30 MB file limit
 
@@ -64,6 +85,34 @@ socketio = SocketIO(app, async_mode='threading', cors_allowed_origins=[], logger
 sessions = {}
 sessions_lock = threading.Lock()
 
+# Focus tracking for priority scheduling — the focused session's process tree
+# runs at foreground priority, every other session at background priority
+focused_session_id = None
+focus_lock = threading.Lock()
+
+# Per-session timers (idle warning/reap, hibernation, SIGKILL escalation),
+# keyed (kind, session_id) and fired in deadline order by one thread
+session_scheduler = DeadlineScheduler(name="session-scheduler")
+
+# Focus priority changes (a /proc scan and renice per session) run one at a
+# time, in the order focus moved, so a quick A->B->A can't finish out of order
+priority_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-priority")
+
+# Scheduler callbacks must not block, so the slow parts of hibernation and
+# reaping (/proc scans, SIGSTOP or cgroup freeze, spill-file I/O) are handed
+# to this worker and the timer callback only enqueues them
+session_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-worker")
+
+
+def _submit_session_work(fn, *args):
+    """Run *fn* on session_worker, logging failures like the scheduler does."""
+    def run():
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"Session work {fn.__name__}{args!r} failed: {e}")
+    session_worker.submit(run)
+
 # PAT auto-rotation (short-lived tokens, background refresh)
 # Only rotates while active sessions exist — stops when all sessions are reaped
 pat_rotator = PATRotator(
@@ -549,6 +598,7 @@ def handle_join_session(data):
     if not session:
         return {'status': 'error', 'message': 'Session not found'}
 
+    _wake_session(session_id, session)
     with session["lock"]:
         session["last_poll_time"] = time.time()
         session["output_buffer"].clear()  # Prevent duplicate output on WS↔HTTP switch
@@ -577,9 +627,12 @@ def handle_terminal_input(data):
     if not session:
         return
 
+    _wake_session(session_id, session)
     with session["lock"]:
         session["last_poll_time"] = time.time()
+        session["last_input_time"] = session["last_poll_time"]
     fd = session["master_fd"]
+    _set_focused_session(session_id)
 
     try:
         os.write(fd, input_data.encode())
@@ -598,6 +651,7 @@ def handle_terminal_resize(data):
     if not session:
         return
 
+    _wake_session(session_id, session)
     with session["lock"]:
         session["last_poll_time"] = time.time()
     fd = session["master_fd"]
@@ -617,8 +671,12 @@ def handle_ws_heartbeat(data):
     for sid in session_ids:
         session = _get_session(sid)
         if session:
+            _wake_session(sid, session)
             with session["lock"]:
                 session["last_poll_time"] = now
+    focused = data.get('focused_session_id')
+    if focused and _get_session(focused):
+        _set_focused_session(focused)
 
 
 @socketio.on('disconnect')
@@ -633,6 +691,240 @@ def _get_session(session_id):
         return sessions.get(session_id)
 
 
+def _set_focused_session(session_id):
+    """Record which session has focus and re-prioritize if focus moved.
+
+    Called from input and heartbeat paths, so it returns immediately when
+    focus is unchanged; the /proc scan and renice run on priority_worker.
+    """
+    global focused_session_id
+    if session_resources.PRIORITY_POLICY != "focus":
+        return
+    with focus_lock:
+        if focused_session_id == session_id:
+            return
+        previous = focused_session_id
+        focused_session_id = session_id
+    priority_worker.submit(_apply_focus_priorities, previous, session_id)
+
+
+def _clear_focus(session_id):
+    """Forget focus if it pointed at a session that is going away."""
+    global focused_session_id
+    with focus_lock:
+        if focused_session_id == session_id:
+            focused_session_id = None
+
+
+def _apply_focus_priorities(previous_id, focused_id):
+    """Re-prioritize the sessions a focus move touched.
+
+    Each gets the priority matching focus as it is now, not as it was when
+    the move was queued, so a stale change can't override a newer one.
+    """
+    for sid in (previous_id, focused_id):
+        session = _get_session(sid) if sid else None
+        if not session:
+            continue
+        with focus_lock:
+            focused = focused_session_id == sid
+        try:
+            state = session_resources.apply_priority(session["pid"], focused, session.get("cgroup"))
+        except Exception as e:
+            logger.warning(f"Could not re-prioritize session {sid}: {e}")
+            continue
+        with session["lock"]:
+            session["priority"] = state
+        logger.info(f"Session {sid} priority -> {'foreground' if focused else 'background'} {state}")
+
+
+def _spill_path(session_id):
+    return os.path.join(HIBERNATE_DIR, f"{session_id}.out")
+
+
+def _hibernate_session(session_id, session):
+    """Freeze an idle session and move its buffered output to disk.
+
+    The buffer is compacted into a single string first; if the spill file
+    can't be written the compacted copy stays in memory instead. Runs under
+    the session lock so a concurrent wake can't interleave with it.
+    """
+    with session["lock"]:
+        if session.get("hibernation") or session.get("exited"):
+            return False
+        compacted = "".join(session["output_buffer"])
+        session["output_buffer"].clear()
+        history = session.get("history")
+        if history and len(history) > 1:
+            # One chunk instead of hundreds; offsets stay valid from its start
+            start = history[0][0]
+            joined = "".join(chunk for _, chunk in history)
+            history.clear()
+            history.append((start, joined))
+
+        spilled = False
+        if compacted:
+            try:
+                os.makedirs(HIBERNATE_DIR, exist_ok=True)
+                with open(_spill_path(session_id), "w", encoding="utf-8", newline="") as f:
+                    f.write(compacted)
+                spilled = True
+            except OSError as e:
+                logger.warning(f"Could not spill output of {session_id}: {e}")
+
+        mechanism = session_resources.hibernate_tree(session["pid"], session.get("cgroup"))
+        session["hibernation"] = {
+            "since": time.time(),
+            "mechanism": mechanism,
+            "spilled": spilled,
+            "buffer": None if spilled else compacted,
+        }
+        session.setdefault("wake", threading.Event()).clear()
+
+    logger.info(f"Session {session_id} hibernated ({mechanism}, {len(compacted)} chars buffered)")
+    return True
+
+
+def _wake_session(session_id, session=None):
+    """Resume a hibernated session. Costs one dict lookup when it's awake."""
+    session = session or _get_session(session_id)
+    if not session or not session.get("hibernation"):
+        return
+
+    with session["lock"]:
+        hibernation = session.get("hibernation")
+        if not hibernation:
+            return
+        restored = hibernation["buffer"] or ""
+        if hibernation["spilled"]:
+            try:
+                with open(_spill_path(session_id), encoding="utf-8", newline="") as f:
+                    restored = f.read()
+                os.unlink(_spill_path(session_id))
+            except OSError as e:
+                logger.warning(f"Could not restore spilled output of {session_id}: {e}")
+        if restored:
+            session["output_buffer"].appendleft(restored)
+
+        state = session_resources.resume_tree(
+            session["pid"], session.get("cgroup"), hibernation["mechanism"],
+            focused=session_id == focused_session_id,
+        )
+        if state:
+            session["priority"] = state
+        session["hibernation"] = None
+        session["last_poll_time"] = time.time()
+        session["wake"].set()
+
+    _arm_hibernate_timer(session_id, session)
+    logger.info(f"Session {session_id} resumed after {time.time() - hibernation['since']:.0f}s hibernated")
+
+
+def _arm_hibernate_timer(session_id, session):
+    """Schedule the hibernation check for when the session would go idle."""
+    if session_resources.HIBERNATE_AFTER_SECONDS <= 0:
+        return
+    last_activity = max(session["last_poll_time"], session.get("last_output_time", 0))
+    session_scheduler.schedule(("hibernate", session_id),
+                               last_activity + session_resources.HIBERNATE_AFTER_SECONDS,
+                               lambda: _submit_session_work(_on_hibernate_deadline, session_id))
+
+
+def _on_hibernate_deadline(session_id):
+    """Hibernate the session if nobody has watched it and it has gone quiet.
+
+    A session qualifies once it has had no client activity and no output
+    for HIBERNATE_AFTER_SECONDS, and its tree used no CPU since the previous
+    check — a silent build or test run is re-checked later instead.
+    Activity in the meantime just moves the deadline forward. Runs on
+    session_worker, never on the scheduler thread.
+    """
+    session = _get_session(session_id)
+    if not session or session.get("hibernation") or session.get("exited"):
+        return
+
+    now = time.time()
+    last_activity = max(session["last_poll_time"], session.get("last_output_time", 0))
+    if now - last_activity < session_resources.HIBERNATE_AFTER_SECONDS:
+        _arm_hibernate_timer(session_id, session)
+        return
+
+    # The /proc scan runs unlocked; the mark is read and moved under the
+    # session lock, like every other hibernation state change
+    usage = session_resources.sessions_usage([session["pid"]]).get(session["pid"]) or {}
+    cpu = usage.get("cpu_seconds")
+    with session["lock"]:
+        if session.get("hibernation") or session.get("exited"):
+            return
+        previous_cpu = session.get("hibernate_cpu_mark")
+        session["hibernate_cpu_mark"] = cpu
+    if cpu is None or cpu != previous_cpu:
+        session_scheduler.schedule(("hibernate", session_id),
+                                   now + HIBERNATE_CHECK_INTERVAL_SECONDS,
+                                   lambda: _submit_session_work(_on_hibernate_deadline, session_id))
+        return
+    _hibernate_session(session_id, session)
+
+
+def _wait_while_hibernated(session, fd):
+    """Block the reader while its session is hibernated.
+
+    A frozen tree can't produce output, so the reader sleeps on the wake
+    event instead of polling select(). A deprioritized tree keeps running,
+    so the reader blocks in select() and any output ends the hibernation.
+    Returns True if the fd is readable.
+    """
+    hibernation = session.get("hibernation") or {}
+    if hibernation.get("mechanism") == "deprioritize":
+        readable, _, errors = select.select([fd], [], [fd], HIBERNATED_WAIT_SECONDS)
+        return bool(readable or errors)
+    session["wake"].wait(HIBERNATED_WAIT_SECONDS)
+    return False
+
+
+def _record_output(session, decoded):
+    """Buffer PTY output and advance the session's output offset.
+
+    Call with the session lock held. The offset counts every character the
+    session has produced; clients store the offset they have rendered up to
+    and reattach with it to fetch only the delta from the history ring.
+    Returns the new end offset.
+    """
+    # Buffer for HTTP polling fallback (AC-15)
+    session["output_buffer"].append(decoded)
+
+    start = session.get("output_offset", 0)
+    end = start + len(decoded)
+    session["output_offset"] = end
+
+    history = session.setdefault("history", deque())
+    history.append((start, decoded))
+    chars = session.get("history_chars", 0) + len(decoded)
+    while len(history) > 1 and chars - len(history[0][1]) >= OUTPUT_HISTORY_CHARS:
+        chars -= len(history.popleft()[1])
+    session["history_chars"] = chars
+    return end
+
+
+def _history_since(session, since):
+    """Output produced after offset *since*, or None if it's no longer retained.
+
+    Call with the session lock held.
+    """
+    end = session.get("output_offset", 0)
+    if since == end:
+        return ""
+    history = session.get("history")
+    if not history or since > end or since < history[0][0]:
+        return None
+    parts = []
+    for start, chunk in history:
+        if start + len(chunk) <= since:
+            continue
+        parts.append(chunk[max(0, since - start):])
+    return "".join(parts)
+
+
 def read_pty_output(session_id, fd):
     """Background thread to read PTY output into buffer and push via WebSocket."""
     session = _get_session(session_id)
@@ -646,21 +938,27 @@ def read_pty_output(session_id, fd):
             if session_id not in sessions:
                 break
         try:
-            readable, _, errors = select.select([fd], [], [fd], 0.05)
-            if readable or errors:
+            if session.get("hibernation"):
+                ready = _wait_while_hibernated(session, fd)
+            else:
+                readable, _, errors = select.select([fd], [], [fd], 0.05)
+                ready = bool(readable or errors)
+            if ready:
                 output = os.read(fd, 65536)
                 if not output:
                     # EOF — process exited
                     break
+                # New output means the session is no longer idle
+                _wake_session(session_id, session)
                 decoded = output.decode(errors="replace")
                 with session_lock:
-                    # Buffer for HTTP polling fallback (AC-15)
-                    session["output_buffer"].append(decoded)
+                    offset = _record_output(session, decoded)
                     session["last_poll_time"] = time.time()  # Keep session alive during WS output
+                    session["last_output_time"] = session["last_poll_time"]
                 # Push via WebSocket to the session room (AC-8)
                 try:
                     socketio.emit('terminal_output',
-                                  {'session_id': session_id, 'output': decoded},
+                                  {'session_id': session_id, 'output': decoded, 'offset': offset},
                                   room=session_id)
                 except Exception:
                     pass  # No WebSocket clients — HTTP polling handles it
@@ -691,7 +989,20 @@ def read_pty_output(session_id, fd):
 
 
 def terminate_session(session_id, pid, master_fd):
-    """Gracefully terminate a session: SIGHUP -> wait -> SIGKILL -> cleanup."""
+    """Gracefully terminate a session: SIGHUP now, SIGKILL + cleanup later.
+
+    The session leaves the dict immediately; the SIGKILL escalation and the
+    master fd close run on the scheduler GRACEFUL_SHUTDOWN_WAIT seconds
+    later, so callers (HTTP close, the reader thread, the idle reaper) never
+    block on the grace period. Only the first call for a session does
+    anything — the reader thread's call after an HTTP close is a no-op, so
+    the pending escalation (and its cgroup) isn't replaced.
+    """
+    with sessions_lock:
+        session = sessions.pop(session_id, None)
+    if session is None:
+        return
+
     logger.info(f"Terminating stale session {session_id} (pid={pid})")
 
     # Notify WebSocket clients that the session is closed
@@ -700,24 +1011,38 @@ def terminate_session(session_id, pid, master_fd):
     except Exception:
         pass
 
+    # A frozen shell would only see SIGHUP once thawed
+    _wake_session(session_id, session)
+
     try:
         os.kill(pid, signal.SIGHUP)
-        time.sleep(GRACEFUL_SHUTDOWN_WAIT)
+    except OSError:
+        pass  # Process already gone
+
+    _clear_focus(session_id)
+    session_scheduler.cancel(("idle", session_id))
+    session_scheduler.cancel(("hibernate", session_id))
+    session_scheduler.schedule(
+        ("kill", session_id), time.time() + GRACEFUL_SHUTDOWN_WAIT,
+        lambda: _finish_termination(session_id, pid, master_fd, session.get("cgroup")),
+    )
 
-        # Check if still alive, force kill if needed
-        try:
-            os.kill(pid, 0)  # Check if process exists
-            os.kill(pid, signal.SIGKILL)
-            logger.info(f"Force killed session {session_id} (pid={pid})")
-        except OSError:
-            pass  # Already dead
 
+def _finish_termination(session_id, pid, master_fd, cgroup_path):
+    """Escalation timer: SIGKILL if the shell ignored SIGHUP, then release resources."""
+    try:
+        os.kill(pid, 0)  # Check if process exists
+        os.kill(pid, signal.SIGKILL)
+        logger.info(f"Force killed session {session_id} (pid={pid})")
+    except OSError:
+        pass  # Already dead
+
+    try:
         os.close(master_fd)
     except OSError:
-        pass  # Process or fd already gone
+        pass  # fd already gone
 
-    with sessions_lock:
-        sessions.pop(session_id, None)
+    session_resources.remove_session_cgroup(cgroup_path)
 
 
 def _get_session_process(pid):
@@ -773,32 +1098,56 @@ def _get_session_process(pid):
         return "unknown"
 
 
+def _arm_idle_timer(session_id, session):
+    """Schedule the session's next idle check from its last_poll_time.
+
+    Polls and heartbeats only bump last_poll_time; the timer re-reads it
+    when it fires and re-arms itself if the session was active since.
+    """
+    warning_at = session["last_poll_time"] + SESSION_TIMEOUT_SECONDS * 0.8
+    session_scheduler.schedule(("idle", session_id), warning_at,
+                               lambda: _on_idle_deadline(session_id))
+
+
+def _on_idle_deadline(session_id):
+    """Warn at 80% of the idle timeout and reap at 100%."""
+    session = _get_session(session_id)
+    if not session:
+        return
+
+    now = time.time()
+    last_poll = session["last_poll_time"]
+    idle = now - last_poll
+    if idle > SESSION_TIMEOUT_SECONDS:
+        logger.info(f"Session {session_id} idle for {idle:.0f}s — reaping")
+        # Waking a hibernated session first means spill-file and cgroup I/O
+        _submit_session_work(terminate_session, session_id, session["pid"], session["master_fd"])
+    elif idle > SESSION_TIMEOUT_SECONDS * 0.8:
+        session["timeout_warning"] = True
+        # Just past the timeout, so the strict idle > timeout check holds
+        session_scheduler.schedule(("idle", session_id), last_poll + SESSION_TIMEOUT_SECONDS + 1,
+                                   lambda: _on_idle_deadline(session_id))
+    else:
+        _arm_idle_timer(session_id, session)
+
+
 def cleanup_stale_sessions():
-    """Background thread that removes sessions with no recent polling."""
+    """Backstop for the idle timers: arm one for any session that lacks it.
+
+    Warnings and reaps fire from the scheduler on time; this sweep only
+    covers sessions whose timer was lost (e.g. a callback that raised).
+    It reads the dict and scheduler state without taking per-session locks.
+    """
     while True:
         time.sleep(CLEANUP_INTERVAL_SECONDS)
 
-        now = time.time()
-        stale_sessions = []
-        warning_threshold = SESSION_TIMEOUT_SECONDS * 0.8
-
         with sessions_lock:
             session_snapshot = list(sessions.items())
 
         for session_id, session in session_snapshot:
-            with session["lock"]:
-                idle = now - session["last_poll_time"]
-                if idle > SESSION_TIMEOUT_SECONDS:
-                    stale_sessions.append((session_id, session["pid"], session["master_fd"]))
-                elif idle > warning_threshold:
-                    session["timeout_warning"] = True
-
-        if stale_sessions:
-            logger.info(f"Found {len(stale_sessions)} stale session(s) to clean up")
-
-        # Terminate each stale session (outside the lock)
-        for session_id, pid, master_fd in stale_sessions:
-            terminate_session(session_id, pid, master_fd)
+            if session_scheduler.deadline(("idle", session_id)) is None:
+                _arm_idle_timer(session_id, session)
+                logger.info(f"Re-armed missing idle timer for session {session_id}")
 
 
 @app.before_request
@@ -844,7 +1193,12 @@ def set_security_headers(response):
 
 @app.route("/")
 def index():
-    return send_from_directory("static", "index.html")
+    return static_assets.serve_asset("index.html")
+
+
+@app.route("/static/<path:filename>")
+def static_file(filename):
+    return static_assets.serve_asset(filename)
 
 
 @app.route("/api/setup-status")
@@ -865,6 +1219,9 @@ def list_sessions():
     with sessions_lock:
         snapshot = list(sessions.items())
 
+    usage = session_resources.sessions_usage(
+        [sess["pid"] for _, sess in snapshot if not sess.get("exited")])
+
     result = []
     for session_id, sess in snapshot:
         if sess.get("exited"):
@@ -877,27 +1234,98 @@ def list_sessions():
             "exited": False,
             "process": _get_session_process(sess["pid"]),
             "idle_seconds": round(now - sess.get("last_poll_time", now), 1),
+            "priority": _priority_snapshot(session_id, sess),
+            "hibernated": bool(sess.get("hibernation")),
+            "limits": sess.get("limits") or {},
+            "usage": usage.get(sess["pid"]),
         })
     return jsonify(result)
 
 
+@app.route("/api/metrics")
+def session_metrics():
+    """Per-session resource usage and limits, plus totals across sessions."""
+    with sessions_lock:
+        snapshot = [(sid, sess) for sid, sess in sessions.items() if not sess.get("exited")]
+
+    usage = session_resources.sessions_usage([sess["pid"] for _, sess in snapshot])
+    per_session = {}
+    totals = {"processes": 0, "cpu_seconds": 0.0, "rss_bytes": 0,
+              "read_bytes": 0, "write_bytes": 0}
+    for session_id, sess in snapshot:
+        session_usage = usage.get(sess["pid"]) or {}
+        for key in totals:
+            totals[key] += session_usage.get(key, 0)
+        per_session[session_id] = {
+            "label": sess.get("label", ""),
+            "pid": sess["pid"],
+            "usage": session_usage,
+            "limits": sess.get("limits") or {},
+        }
+    totals["cpu_seconds"] = round(totals["cpu_seconds"], 2)
+
+    return jsonify({
+        "timestamp": time.time(),
+        "sessions": per_session,
+        "totals": totals,
+        "configured_limits": {
+            "memory_mb": session_resources.MEMORY_LIMIT_MB or None,
+            "processes": session_resources.PIDS_LIMIT or None,
+            "cpu_seconds": session_resources.CPU_LIMIT_SECONDS or None,
+        },
+    })
+
+
+def _priority_snapshot(session_id, sess):
+    """Priority policy and last-applied priorities for one session."""
+    applied = sess.get("priority") or {}
+    return {
+        "policy": session_resources.PRIORITY_POLICY,
+        "mechanisms": session_resources.priority_mechanisms(),
+        "focused": session_id == focused_session_id,
+        "nice": applied.get("nice"),
+        "ionice": applied.get("ionice"),
+        "cgroup_weight": applied.get("cgroup_weight"),
+    }
+
+
 @app.route("/api/session/attach", methods=["POST"])
 def attach_session():
-    """Reattach to an existing session — returns buffered output for replay."""
+    """Reattach to an existing session — returns buffered output for replay.
+
+    A client holding a cached copy of the session's output passes the offset
+    it cached up to as ``since``; ``delta`` is then everything produced after
+    it, or null if that range has aged out of the history ring.
+    """
     data = request.get_json(silent=True) or {}
     session_id = data.get("session_id", "")
+    since = data.get("since")
 
     sess = _get_session(session_id)
     if not sess or sess.get("exited"):
         return jsonify({"error": "Session not found or exited"}), 404
 
+    _wake_session(session_id, sess)
+
     # Reset idle clock so the 24h reaper starts fresh
     sess["last_poll_time"] = time.time()
 
+    delta = None
+    with sess["lock"]:
+        output = list(sess["output_buffer"])
+        output_offset = sess.get("output_offset", 0)
+        if isinstance(since, int) and since >= 0:
+            delta = _history_since(sess, since)
+            if delta is not None:
+                # The delta already covers the poll buffer — don't deliver it twice
+                sess["output_buffer"].clear()
+
     return jsonify({
         "session_id": session_id,
         "label": sess.get("label", ""),
-        "output": list(sess["output_buffer"]),
+        "output": output,
+        "output_offset": output_offset,
+        "delta": delta,
         "process": _get_session_process(sess["pid"]),
         "created_at": sess.get("created_at"),
     })
@@ -1035,19 +1463,24 @@ def create_session():
         projects_dir = os.path.join(shell_env["HOME"], "projects")
         os.makedirs(projects_dir, exist_ok=True)
 
+        session_id = str(uuid.uuid4())
+        # Per-session cgroup (cgroup v2 only) — None when not writable here.
+        # Created before the spawn so the shell joins it, and its limits,
+        # before exec (see apply_session_limits for what falls back to rlimits).
+        cgroup_path = session_resources.create_session_cgroup(session_id)
+        limits, rlimits = session_resources.apply_session_limits(cgroup_path)
+
         pid = subprocess.Popen(
             ["/bin/bash"],
             stdin=slave_fd,
             stdout=slave_fd,
             stderr=slave_fd,
-            preexec_fn=os.setsid,
+            preexec_fn=session_resources.spawn_preexec(cgroup_path, rlimits),
             env=shell_env,
             cwd=projects_dir
         ).pid
         os.close(slave_fd)  # Parent doesn't need the slave side; child inherited it
 
-        session_id = str(uuid.uuid4())
-
         with sessions_lock:
             # Authoritative check under the same lock as insertion — prevents
             # TOCTOU race where two concurrent requests both pass the early check.
@@ -1057,21 +1490,39 @@ def create_session():
                     os.kill(pid, signal.SIGKILL)
                 except OSError:
                     pass
+                session_resources.remove_session_cgroup(cgroup_path)
                 return jsonify({"error": f"Maximum {MAX_CONCURRENT_SESSIONS} concurrent sessions reached. Close an existing session first."}), 429
             sessions[session_id] = {
                 "master_fd": master_fd,
                 "pid": pid,
                 "output_buffer": deque(maxlen=1000),
+                "output_offset": 0,
+                "history": deque(),
+                "history_chars": 0,
                 "lock": threading.Lock(),
                 "last_poll_time": time.time(),
                 "created_at": time.time(),
                 "label": label,
+                "cgroup": cgroup_path,
+                "priority": None,
+                "limits": limits,
+                "last_output_time": time.time(),
+                "hibernation": None,
+                "wake": threading.Event(),
             }
 
         # Start background reader thread
         thread = threading.Thread(target=read_pty_output, args=(session_id, master_fd), daemon=True)
         thread.start()
 
+        # A new session is opened from the pane the user is looking at
+        _set_focused_session(session_id)
+
+        new_session = _get_session(session_id)
+        if new_session:
+            _arm_idle_timer(session_id, new_session)
+            _arm_hibernate_timer(session_id, new_session)
+
         # Telemetry: track session creation with agent type
         log_telemetry("agent", label or "shell")
 
@@ -1091,7 +1542,11 @@ def send_input():
     if not session:
         return jsonify({"error": "Session not found"}), 404
 
+    _wake_session(session_id, session)
+    with session["lock"]:
+        session["last_input_time"] = time.time()
     fd = session["master_fd"]
+    _set_focused_session(session_id)
 
     try:
         os.write(fd, input_data.encode())
@@ -1115,23 +1570,114 @@ def upload_file():
 
     logger.info(f"Upload file: name={f.filename}, content_type={f.content_type}")
 
-    home = os.environ.get("HOME", "/app/python/source_code")
-    if not home or home == "/":
-        home = "/app/python/source_code"
-    upload_dir = os.path.join(home, "uploads")
-    os.makedirs(upload_dir, exist_ok=True)
+    # Saved beside the store, then moved in by content hash (deduplicated)
+    partial_dir = os.path.join(uploads.upload_dir(), ".partial")
+    os.makedirs(partial_dir, exist_ok=True)
+    tmp_path = os.path.join(partial_dir, f"{uuid.uuid4().hex}.upload")
+    f.save(tmp_path)
+    file_size = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+    file_path, sha256, deduplicated = uploads.store_file(tmp_path, f.filename)
+
+    # The browser downscales/re-encodes images before upload (image-worker.js)
+    # and reports what it started from
+    original_size = request.form.get("original_size", type=int) or file_size
+    original_width = request.form.get("original_width", type=int)
+    original_height = request.form.get("original_height", type=int)
+    original_dims = f", {original_width}x{original_height}" if original_width and original_height else ""
+    logger.info(f"Upload saved: {file_path} ({file_size} bytes, original {original_size} bytes"
+                f"{original_dims}{', deduplicated' if deduplicated else ''})")
 
-    safe_name = f"{uuid.uuid4().hex[:8]}_{secure_filename(f.filename)}"
-    file_path = os.path.join(upload_dir, safe_name)
-    f.save(file_path)
+    # Telemetry: track file uploads
+    log_telemetry("event", "file_upload")
 
-    file_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
-    logger.info(f"Upload saved: {file_path} ({file_size} bytes)")
+    return jsonify({"path": file_path, "size": file_size, "original_size": original_size,
+                    "sha256": sha256, "deduplicated": deduplicated})
 
-    # Telemetry: track file uploads
+
+@app.route("/api/upload/check", methods=["POST"])
+def upload_check():
+    """Pre-upload hash check: {sha256, filename} -> {exists, path?}.
+
+    Content already in the store is linked under the new name and its path
+    returned, so the client can skip sending the bytes.
+    """
+    data = request.json or {}
+    try:
+        path = uploads.lookup(data.get("sha256"), data.get("filename"))
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    if path is None:
+        return jsonify({"exists": False})
+    logger.info(f"Upload skipped, content already stored: {path}")
+    return jsonify({"exists": True, "path": path})
+
+
+@app.route("/api/download", methods=["GET"])
+def download_file():
+    """Download a file under ~/projects or ~/uploads: ?path=<abs or ~-relative>.
+
+    Supports Range and conditional requests; ?inline=1 displays instead of saving
+    (HTML, SVG and XML are always saved, so they can't run on this origin).
+    """
+    return downloads.serve_download(request.args.get("path", ""),
+                                    as_attachment=not request.args.get("inline"))
+
+
+# ── Chunked uploads (see uploads.py) ──────────────────────────────────────
+
+@app.route("/api/upload/init", methods=["POST"])
+def upload_init():
+    """Start a resumable chunked upload: {filename, size, sha256?} -> status."""
+    data = request.json or {}
+    try:
+        status = uploads.init_upload(data.get("filename"), data.get("size"), data.get("sha256"))
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify(status)
+
+
+@app.route("/api/upload/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    """Report which byte ranges have arrived, so a client can resume."""
+    try:
+        return jsonify(uploads.upload_status(upload_id))
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+
+
+@app.route("/api/upload/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    """Stream one chunk (raw body) into the upload at ?offset=N."""
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify({"error": "offset required"}), 400
+    try:
+        status = uploads.append_chunk(upload_id, offset, request.stream, request.content_length,
+                                      request.headers.get("X-Chunk-SHA256"))
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify(status)
+
+
+@app.route("/api/upload/<upload_id>/commit", methods=["POST"])
+def upload_commit(upload_id):
+    """Verify the checksum and move the finished upload into ~/uploads."""
+    data = request.get_json(silent=True) or {}
+    try:
+        result = uploads.commit_upload(upload_id, data.get("sha256"))
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
     log_telemetry("event", "file_upload")
+    return jsonify(result)
+
 
-    return jsonify({"path": file_path})
+@app.route("/api/upload/<upload_id>", methods=["DELETE"])
+def upload_abort(upload_id):
+    try:
+        uploads.abort_upload(upload_id)
+    except uploads.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify({"ok": True})
 
 
 @app.route("/api/output", methods=["POST"])
@@ -1144,17 +1690,20 @@ def get_output():
     if not session:
         return jsonify({"error": "Session not found"}), 404
 
+    _wake_session(session_id, session)
     with session["lock"]:
         session["last_poll_time"] = time.time()
         # Atomic buffer swap: replace buffer, then join outside the lock
         old_buffer = session["output_buffer"]
         session["output_buffer"] = deque(maxlen=1000)
+        offset = session.get("output_offset", 0)
         exited = session.get("exited", False)
         timeout_warning = session.pop("timeout_warning", False)
 
     output = "".join(old_buffer)
 
-    return jsonify({"output": output, "exited": exited, "shutting_down": shutting_down, "timeout_warning": timeout_warning})
+    return jsonify({"output": output, "offset": offset, "exited": exited,
+                    "shutting_down": shutting_down, "timeout_warning": timeout_warning})
 
 
 @app.route("/api/output-batch", methods=["POST"])
@@ -1162,7 +1711,8 @@ def get_output_batch():
     """Get output from multiple terminal sessions in one request.
 
     Accepts: {"session_ids": ["id1", "id2", ...]}
-    Returns: {"outputs": {"id1": {"output": "...", "exited": false}, ...}}
+    Returns: {"outputs": {"id1": {"output": "...", "exited": false}, ...},
+              "next_poll_ms": <suggested delay before the next poll>}
     """
     data = request.json or {}
     session_ids = data.get("session_ids")
@@ -1182,24 +1732,39 @@ def get_output_batch():
 
     # Step 2: Swap buffers under per-session locks (same pattern as get_output)
     swapped = {}
+    last_activity = 0
     for sid, session in resolved.items():
+        _wake_session(sid, session)
         with session["lock"]:
             session["last_poll_time"] = now
             old_buffer = session["output_buffer"]
             session["output_buffer"] = deque(maxlen=1000)
+            offset = session.get("output_offset", 0)
             exited = session.get("exited", False)
             timeout_warning = session.pop("timeout_warning", False)
-        swapped[sid] = (old_buffer, exited, timeout_warning)
+            last_active = max(session.get("last_output_time", 0), session.get("last_input_time", 0))
+        swapped[sid] = (old_buffer, offset, exited, timeout_warning)
+        last_activity = max(last_activity, last_active)
 
     # Step 3: Join strings outside all locks
-    for sid, (old_buffer, exited, timeout_warning) in swapped.items():
+    for sid, (old_buffer, offset, exited, timeout_warning) in swapped.items():
         outputs[sid] = {
             "output": "".join(old_buffer),
+            "offset": offset,
             "exited": exited,
             "timeout_warning": timeout_warning,
         }
 
-    return jsonify({"outputs": outputs, "shutting_down": shutting_down})
+    return jsonify({"outputs": outputs, "shutting_down": shutting_down,
+                    "next_poll_ms": _next_poll_ms(now - last_activity)})
+
+
+def _next_poll_ms(idle_seconds):
+    """Suggested poll delay after *idle_seconds* without output or input."""
+    steps = max(0, int(idle_seconds // POLL_BACKOFF_STEP_SECONDS))
+    if steps >= 16:
+        return POLL_INTERVAL_MAX_MS
+    return min(POLL_INTERVAL_MAX_MS, POLL_INTERVAL_MIN_MS * 2 ** steps)
 
 
 @app.route("/api/heartbeat", methods=["POST"])
@@ -1212,9 +1777,12 @@ def heartbeat():
     if not session:
         return jsonify({"error": "Session not found"}), 404
 
+    _wake_session(session_id, session)
     with session["lock"]:
         session["last_poll_time"] = time.time()
         timeout_warning = session.pop("timeout_warning", False)
+    if data.get("focused"):
+        _set_focused_session(session_id)
     return jsonify({"status": "ok", "timeout_warning": timeout_warning})
 
 
@@ -1230,6 +1798,7 @@ def resize_terminal():
     if not session:
         return jsonify({"error": "Session not found"}), 404
 
+    _wake_session(session_id, session)
     fd = session["master_fd"]
 
     try:
@@ -1291,10 +1860,14 @@ def initialize_app(local_dev=False):
     # Telemetry: app startup ping (fire-and-forget in background thread)
     log_telemetry("event", "app_startup")
 
-    # Start background cleanup thread
+    # Idle warnings/reaps, hibernation and kill escalation run on the scheduler;
+    # the cleanup thread only backstops lost idle timers
+    session_scheduler.start()
     cleanup_thread = threading.Thread(target=cleanup_stale_sessions, daemon=True)
     cleanup_thread.start()
-    logger.info(f"Started session cleanup thread (timeout={SESSION_TIMEOUT_SECONDS}s, interval={CLEANUP_INTERVAL_SECONDS}s)")
+    logger.info(f"Started session scheduler (timeout={SESSION_TIMEOUT_SECONDS}s, "
+                f"backstop interval={CLEANUP_INTERVAL_SECONDS}s, "
+                f"hibernate after={session_resources.HIBERNATE_AFTER_SECONDS or 'off'})")
 
 
 if __name__ == "__main__":
@@ -11,26 +11,74 @@ Response-side fixes:
   - Fixes finish_reason when tool calls are present
 
 Runs on localhost (never exposed externally). Zero external dependencies
-beyond stdlib + requests (already installed via databricks-sdk).
+beyond stdlib + requests (already installed via databricks-sdk); httpx and
+orjson are used when installed.
+
+Two serving modes (PROXY_SERVER_MODE):
+  threaded — ThreadingMixIn HTTPServer, one OS thread per in-flight request
+  asyncio  — one event loop for every connection, upstream I/O via httpx;
+             parallel subagents' long streams cost a coroutine each, not a
+             thread. Falls back to threaded when httpx isn't installed.
 
 See: https://github.com/sst/opencode/issues/5028
      https://github.com/BerriAI/litellm/pull/20384
 """
+import asyncio
 import configparser
+import hashlib
 import json
 import logging
 import os
 import sys
+import threading
 import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http import HTTPStatus
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from socketserver import ThreadingMixIn
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 UPSTREAM_BASE = os.environ.get("PROXY_UPSTREAM_BASE", "")
 LISTEN_HOST = os.environ.get("PROXY_HOST", "127.0.0.1")
 LISTEN_PORT = int(os.environ.get("PROXY_PORT", "4000"))
 
+# Upstream connection pool — keep-alive connections shared by all handler threads
+POOL_SIZE = int(os.environ.get("PROXY_POOL_SIZE", "16"))
+# Drop pooled connections unused this long, before the gateway's load
+# balancer closes them under us mid-request
+POOL_IDLE_TIMEOUT = float(os.environ.get("PROXY_POOL_IDLE_TIMEOUT", "50"))
+UPSTREAM_RETRIES = int(os.environ.get("PROXY_UPSTREAM_RETRIES", "2"))
+UPSTREAM_TIMEOUT = 300
+# Statuses re-sent to the same upstream. Only 503 by default: a 502 or 504
+# can come back after the model started generating, and re-sending a POST
+# completion would bill a second one. 429s are left to the concurrency limiter
+RETRY_STATUSES = tuple(int(s) for s in os.environ.get("PROXY_RETRY_STATUSES", "503").split(",") if s.strip())
+STREAM_READ_BYTES = 64 * 1024
+
+SERVER_MODE = os.environ.get("PROXY_SERVER_MODE", "threaded").strip().lower()
+
+# Never forwarded upstream (plus host/content-length, which are recomputed)
+_HOP_BY_HOP_HEADERS = {
+    "host", "content-length", "transfer-encoding", "connection", "keep-alive",
+    "proxy-connection", "proxy-authorization", "te", "trailer", "upgrade",
+}
+
 # ---------------------------------------------------------------------------
 # Fresh token injection — survives PAT rotation
 # ---------------------------------------------------------------------------
@@ -120,7 +168,7 @@ def sanitize_tool_schemas(data):
     for tool in tools:
         func = tool.get("function", {})
         if "parameters" in func:
-            func["parameters"] = strip_unsupported_schema_keys(func["parameters"])
+            func["parameters"] = _strip_tool_parameters(func.get("name"), func["parameters"])
 
     # Strip unsupported top-level fields
     for key in GEMINI_UNSUPPORTED_REQUEST_KEYS:
@@ -180,69 +228,37 @@ def _extract_tool_refs_from_message(msg):
 def sanitize_messages(messages):
     """Strip empty text blocks and orphaned tool_result/tool messages.
 
-    Runs multiple passes to handle cascading orphans (dropping one message
-    can make the next one orphaned too).
+    Single O(n) sweep. Tool results are checked against the tool IDs of the
+    most recent assistant message already *kept*, so cascading orphans
+    (dropping one message orphaning the next) are resolved as we go. The
+    IDs are recomputed only when an assistant message is kept, never by
+    scanning back through the output.
     """
     if not isinstance(messages, list):
         return messages
 
-    log.info(f"Sanitizing {len(messages)} messages")
-
-    # Log message structure for debugging
-    for i, msg in enumerate(messages):
-        role = msg.get("role", "")
-        tool_ids = _extract_tool_ids_from_message(msg)
-        tool_refs = _extract_tool_refs_from_message(msg)
-        content = msg.get("content")
-        content_desc = ""
-        if isinstance(content, list):
-            types = [b.get("type", "?") if isinstance(b, dict) else "str" for b in content]
-            content_desc = f"[{', '.join(types)}]"
-        elif isinstance(content, str):
-            content_desc = f'str({len(content)} chars)'
-        elif content is None:
-            content_desc = "null"
-        extras = ""
-        if tool_ids:
-            extras += f" tool_ids={tool_ids}"
-        if tool_refs:
-            extras += f" tool_refs={tool_refs}"
-        if msg.get("tool_calls"):
-            extras += f" tool_calls={len(msg['tool_calls'])}"
-        log.info(f"  [{i}] {role}: {content_desc}{extras}")
-
-    # Multi-pass sanitization (handles cascading orphans)
-    prev_len = -1
-    pass_num = 0
-    result = list(messages)
-
-    while len(result) != prev_len and pass_num < 5:
-        prev_len = len(result)
-        pass_num += 1
-        result = _sanitize_single_pass(result, pass_num)
-
-    stripped = len(messages) - len(result)
-    if stripped > 0:
-        log.info(f"Sanitization complete: stripped {stripped} messages/blocks in {pass_num} passes")
-
-    return result
-
-
-def _sanitize_single_pass(messages, pass_num):
-    """One pass of message sanitization."""
     cleaned = []
+    stripped_blocks = _sanitize_from(messages, 0, cleaned, -1, 0)
+    _log_sanitized(messages, cleaned, stripped_blocks)
+    return cleaned
+
+
+def _sanitize_from(messages, start, cleaned, last_assistant, stripped_blocks, trace=None):
+    """Sanitize ``messages[start:]``, appending to *cleaned*.
+
+    *last_assistant* is the index of the last assistant message in
+    *cleaned* (-1 if none) and *stripped_blocks* the running count of
+    stripped content blocks, which is returned. If *trace* is given,
+    ``(len(cleaned), last_assistant, stripped_blocks)`` is appended to it
+    after each input message so a later request can resume at any point.
+    """
+    prev_tool_ids = _extract_tool_ids_from_message(cleaned[last_assistant]) if last_assistant >= 0 else set()
 
-    for i, msg in enumerate(messages):
+    for i in range(start, len(messages)):
+        msg = messages[i]
         role = msg.get("role", "")
         content = msg.get("content")
-
-        # Build valid tool IDs from the most recent assistant message IN THE
-        # CLEANED list (not the original), so cascading drops are handled.
-        prev_tool_ids = set()
-        for j in range(len(cleaned) - 1, -1, -1):
-            if cleaned[j].get("role") == "assistant":
-                prev_tool_ids = _extract_tool_ids_from_message(cleaned[j])
-                break
+        keep = True
 
         # --- Handle list content (Anthropic format) ---
         if isinstance(content, list):
@@ -254,24 +270,22 @@ def _sanitize_single_pass(messages, pass_num):
 
                 # Strip empty/whitespace-only text blocks
                 if block.get("type") == "text" and block.get("text", "").strip() == "":
-                    log.info(f"  pass {pass_num}: strip empty text block from msg[{i}] ({role})")
+                    log.debug(f"strip empty text block from msg[{i}] ({role})")
                     continue
 
                 # Strip orphaned tool_result blocks
                 if block.get("type") == "tool_result":
                     tool_use_id = block.get("tool_use_id")
                     if tool_use_id and tool_use_id not in prev_tool_ids:
-                        log.info(f"  pass {pass_num}: strip orphaned tool_result {tool_use_id} from msg[{i}] (prev_ids={prev_tool_ids})")
+                        log.debug(f"strip orphaned tool_result {tool_use_id} from msg[{i}]")
                         continue
 
                 filtered.append(block)
 
-            if not filtered:
-                if role == "assistant":
-                    msg = {**msg, "content": filtered}
-                else:
-                    log.info(f"  pass {pass_num}: drop empty {role} msg[{i}]")
-                    continue
+            stripped_blocks += len(content) - len(filtered)
+            if not filtered and role != "assistant":
+                log.debug(f"drop empty {role} msg[{i}]")
+                keep = False
             else:
                 msg = {**msg, "content": filtered}
 
@@ -279,26 +293,256 @@ def _sanitize_single_pass(messages, pass_num):
         elif role == "tool":
             tool_call_id = msg.get("tool_call_id")
             if tool_call_id and tool_call_id not in prev_tool_ids:
-                log.info(f"  pass {pass_num}: strip orphaned tool msg[{i}] {tool_call_id} (prev_ids={prev_tool_ids})")
-                continue
+                log.debug(f"strip orphaned tool msg[{i}] {tool_call_id}")
+                keep = False
 
         # --- Handle empty/null string content ---
         elif content is None and role == "assistant" and not msg.get("tool_calls"):
             # Assistant message with null content and no tool_calls — replace
-            log.info(f"  pass {pass_num}: replace null assistant content msg[{i}] with placeholder")
             msg = {**msg, "content": "."}
         elif isinstance(content, str) and content.strip() == "":
             if role == "assistant":
                 # Can't drop assistant messages (breaks alternation), replace with minimal content
-                log.info(f"  pass {pass_num}: replace empty assistant string msg[{i}] with placeholder")
                 msg = {**msg, "content": "."}
             else:
-                log.info(f"  pass {pass_num}: strip empty string {role} msg[{i}]")
-                continue
+                log.debug(f"strip empty string {role} msg[{i}]")
+                keep = False
 
-        cleaned.append(msg)
+        if keep:
+            if role == "assistant":
+                prev_tool_ids = _extract_tool_ids_from_message(msg)
+                last_assistant = len(cleaned)
+            cleaned.append(msg)
+        if trace is not None:
+            trace.append((len(cleaned), last_assistant, stripped_blocks))
 
-    return cleaned
+    return stripped_blocks
+
+
+def _log_sanitized(messages, cleaned, stripped_blocks):
+    dropped = len(messages) - len(cleaned)
+    if dropped or stripped_blocks:
+        log.info(f"Sanitized {len(messages)} messages: dropped {dropped} messages, "
+                 f"stripped {stripped_blocks} blocks")
+
+
+# ---------------------------------------------------------------------------
+# Cross-request memoization
+# ---------------------------------------------------------------------------
+# OpenCode resends the whole conversation and the same tools array on every
+# turn. Sanitized results are kept in two small LRUs so a turn only pays for
+# what changed:
+#   conversations — keyed by a content hash of the opening messages (system
+#     prompt + first user turn). The stored input is compared message by
+#     message with the new request; the shared prefix's sanitized output
+#     (and the sanitizer state after it) is reused, only the tail is swept.
+#   tool schemas — keyed by tool name; reused while the parameters compare
+#     equal, re-stripped when a tool changes.
+# Cached entries are confirmed with ``==`` rather than a hash of every
+# message/schema: dict comparison runs in C and is ~10x cheaper than
+# serializing the content to hash it (which costs more than re-sanitizing).
+# Cached objects are shared between requests and must never be mutated.
+
+MEMO_CONVERSATIONS = int(os.environ.get("PROXY_MEMO_CONVERSATIONS", "16"))
+MEMO_TOOL_SCHEMAS = int(os.environ.get("PROXY_MEMO_TOOL_SCHEMAS", "256"))
+
+MEMO_STATS = {
+    "conversation_hits": 0, "conversation_misses": 0,
+    "messages_reused": 0, "messages_sanitized": 0,
+    "tool_hits": 0, "tool_misses": 0,
+    "saved_ms": 0.0,
+}
+
+_memo_lock = threading.Lock()
+_conversation_memo = OrderedDict()  # root hash -> {"messages", "cleaned", "trace"}
+_tool_memo = OrderedDict()  # tool name -> (parameters, stripped parameters, strip seconds)
+_memo_cost = {"per_message": 0.0}  # EWMA seconds to sanitize one message
+
+
+def _lru_get(memo, key):
+    with _memo_lock:
+        entry = memo.get(key)
+        if entry is not None:
+            memo.move_to_end(key)
+        return entry
+
+
+def _lru_put(memo, key, value, limit):
+    with _memo_lock:
+        memo[key] = value
+        memo.move_to_end(key)
+        while len(memo) > limit:
+            memo.popitem(last=False)
+
+
+def _conversation_key(messages):
+    return hashlib.sha1(json.dumps(messages[:2], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def sanitize_messages_cached(messages):
+    """:func:`sanitize_messages`, reusing the result for a prefix seen before."""
+    return sanitize_conversation(messages)[0]
+
+
+def sanitize_conversation(messages):
+    """Memoized sanitize; returns ``(cleaned, stable)``.
+
+    *stable* is how many leading messages of *cleaned* are identical to the
+    previous request of the same conversation (0 on a first sighting).
+    """
+    if not isinstance(messages, list) or len(messages) < 2 or MEMO_CONVERSATIONS <= 0:
+        return sanitize_messages(messages), 0
+
+    started = time.perf_counter()
+    key = _conversation_key(messages)
+    entry = _lru_get(_conversation_memo, key)
+
+    shared = 0
+    if entry is not None:
+        previous = entry["messages"]
+        limit = min(len(previous), len(messages))
+        while shared < limit and messages[shared] == previous[shared]:
+            shared += 1
+
+    kept = 0
+    if shared:
+        kept, last_assistant, stripped_blocks = entry["trace"][shared - 1]
+        cleaned = entry["cleaned"][:kept]
+        trace = entry["trace"][:shared]
+    else:
+        cleaned, last_assistant, stripped_blocks, trace = [], -1, 0, []
+    reuse_done = time.perf_counter()
+
+    stripped_blocks = _sanitize_from(messages, shared, cleaned, last_assistant, stripped_blocks, trace)
+    finished = time.perf_counter()
+    _lru_put(_conversation_memo, key, {"messages": messages, "cleaned": cleaned, "trace": trace},
+             MEMO_CONVERSATIONS)
+
+    swept = len(messages) - shared
+    with _memo_lock:
+        if swept:
+            sample = (finished - reuse_done) / swept
+            previous_cost = _memo_cost["per_message"]
+            _memo_cost["per_message"] = sample if not previous_cost else 0.8 * previous_cost + 0.2 * sample
+        MEMO_STATS["conversation_hits" if shared else "conversation_misses"] += 1
+        MEMO_STATS["messages_reused"] += shared
+        MEMO_STATS["messages_sanitized"] += swept
+        if shared:
+            # Estimated: what sweeping the prefix would have cost, minus the lookup
+            saved = shared * _memo_cost["per_message"] - (reuse_done - started)
+            MEMO_STATS["saved_ms"] += max(saved, 0.0) * 1000
+
+    _log_sanitized(messages, cleaned, stripped_blocks)
+    return list(cleaned), kept
+
+
+def _strip_tool_parameters(name, parameters):
+    """strip_unsupported_schema_keys(*parameters*), memoized per tool name."""
+    if not name or MEMO_TOOL_SCHEMAS <= 0:
+        return strip_unsupported_schema_keys(parameters)
+
+    started = time.perf_counter()
+    entry = _lru_get(_tool_memo, name)
+    if entry is not None and entry[0] == parameters:
+        with _memo_lock:
+            MEMO_STATS["tool_hits"] += 1
+            MEMO_STATS["saved_ms"] += max(entry[2] - (time.perf_counter() - started), 0.0) * 1000
+        return entry[1]
+
+    stripped = strip_unsupported_schema_keys(parameters)
+    _lru_put(_tool_memo, name, (parameters, stripped, time.perf_counter() - started), MEMO_TOOL_SCHEMAS)
+    with _memo_lock:
+        MEMO_STATS["tool_misses"] += 1
+    return stripped
+
+
+def memo_stats():
+    """Snapshot of MEMO_STATS with hit rates, for /health."""
+    with _memo_lock:
+        stats = dict(MEMO_STATS)
+        stats["conversations_cached"] = len(_conversation_memo)
+        stats["tools_cached"] = len(_tool_memo)
+    for kind in ("conversation", "tool"):
+        lookups = stats[f"{kind}_hits"] + stats[f"{kind}_misses"]
+        stats[f"{kind}_hit_rate"] = round(stats[f"{kind}_hits"] / lookups, 3) if lookups else None
+    stats["saved_ms"] = round(stats["saved_ms"], 3)
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Prompt caching (Claude)
+# ---------------------------------------------------------------------------
+# OpenCode's openai-compatible provider never marks anything cacheable, so
+# every turn of a long agent session is billed and prefilled from scratch.
+# With PROXY_PROMPT_CACHE=1 the proxy adds cache_control breakpoints for
+# models matching PROXY_PROMPT_CACHE_MODELS:
+#   1. the system prompt — caches it and the tool definitions before it
+#   2. the end of the prefix this conversation shared with its previous
+#      request (from the conversation memo) — reads what that turn wrote
+#   3. the end of this request, once the conversation is seen growing turn
+#      over turn — written for the next turn to read
+# Requests that already carry cache_control are left alone; at most three
+# breakpoints are added (the API allows four). Marked messages are copies:
+# the originals are shared with the conversation memo.
+
+PROMPT_CACHE = os.environ.get("PROXY_PROMPT_CACHE", "0").strip().lower() in ("1", "true", "yes", "on")
+PROMPT_CACHE_MODELS = [m.strip().lower() for m in
+                       os.environ.get("PROXY_PROMPT_CACHE_MODELS", "claude").split(",") if m.strip()]
+
+PROMPT_CACHE_STATS = {"requests": 0, "breakpoints": 0}
+_prompt_cache_lock = threading.Lock()
+
+
+def _with_cache_control(msg):
+    """Copy of *msg* with a breakpoint on its last content block, or None if it has none."""
+    content = msg.get("content")
+    if isinstance(content, str) and content:
+        blocks = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+    elif isinstance(content, list) and content and isinstance(content[-1], dict):
+        blocks = content[:-1] + [{**content[-1], "cache_control": {"type": "ephemeral"}}]
+    else:
+        return None
+    return {**msg, "content": blocks}
+
+
+def add_cache_breakpoints(data, stable):
+    """Mark the stable prefix of a request cacheable; returns the breakpoints added.
+
+    *stable* is the number of leading messages shared with the conversation's
+    previous request (see :func:`sanitize_conversation`). ``data["messages"]``
+    is replaced element-wise, never mutated.
+    """
+    model = str(data.get("model", "")).lower()
+    messages = data.get("messages")
+    if not any(m in model for m in PROMPT_CACHE_MODELS) or not isinstance(messages, list) or not messages:
+        return 0
+
+    targets = []
+    leading_system = 0
+    while leading_system < len(messages) and messages[leading_system].get("role") == "system":
+        leading_system += 1
+    if leading_system:
+        targets.append(leading_system - 1)
+    if stable:
+        targets.append(min(stable, len(messages)) - 1)
+        targets.append(len(messages) - 1)
+
+    marked = set()
+    for target in targets:
+        # Walk back to the nearest message with content to hang the breakpoint on
+        for i in range(target, -1, -1):
+            if i in marked:
+                break
+            replacement = _with_cache_control(messages[i])
+            if replacement is not None:
+                messages[i] = replacement
+                marked.add(i)
+                break
+
+    with _prompt_cache_lock:
+        PROMPT_CACHE_STATS["requests"] += 1
+        PROMPT_CACHE_STATS["breakpoints"] += len(marked)
+    return len(marked)
 
 
 # ---------------------------------------------------------------------------
@@ -360,13 +604,56 @@ def fix_response_data(data):
 # ---------------------------------------------------------------------------
 
 class SSEProcessor:
-    """Buffers and fixes SSE events, handling tool name remapping across chunks."""
+    """Buffers and fixes SSE events, handling tool name remapping across chunks.
+
+    Servers hand it raw upstream bytes via :meth:`feed` / :meth:`finish`.
+    Almost every event of a token stream is plain content that never needs
+    rewriting, so complete lines are forwarded byte-for-byte unless a cheap
+    substring scan finds something :meth:`process_line` might change:
+    ``tool_calls`` (which covers ``databricks-tool-call`` names), or a
+    ``"stop"`` finish_reason once a tool call is in flight. Only those lines
+    are decoded, parsed and re-serialized.
+    """
 
     def __init__(self):
         # Per tool-call-index state for streaming name resolution
         # {index: {"args_buffer": str, "resolved_name": str|None, "buffered_lines": []}}
         self._tool_state = {}
         self._pending_flush = []
+        self._partial = b""  # Trailing bytes of an incomplete line
+
+    def feed(self, data):
+        """Process raw upstream bytes; returns the bytes to send downstream.
+
+        A trailing partial line is held back until its newline arrives.
+        """
+        self._partial += data
+        cut = self._partial.rfind(b"\n") + 1
+        if not cut:
+            return b""
+        complete, self._partial = self._partial[:cut], self._partial[cut:]
+        return self._process_bytes(complete)
+
+    def finish(self):
+        """Bytes still owed at end of stream (a final unterminated line, buffered events)."""
+        out = self._process_bytes(self._partial) if self._partial else b""
+        self._partial = b""
+        return out + b"".join((line + "\r\n").encode() for line in self.flush_remaining())
+
+    def _process_bytes(self, data):
+        if b"tool_calls" not in data and not (self._tool_state and b'"stop"' in data):
+            return data  # Fast path: nothing to rewrite
+
+        out = []
+        for raw_line in data.splitlines():
+            line = raw_line.decode("utf-8", "replace").strip()
+            if not line:
+                # Blank line = event boundary
+                out.append(b"\r\n")
+                continue
+            for out_line in self.process_line(line):
+                out.append((out_line + "\r\n").encode())
+        return b"".join(out)
 
     def process_line(self, line):
         """Process one SSE line. Returns list of lines to send (may be empty if buffering)."""
@@ -424,6 +711,8 @@ class SSEProcessor:
                             state["resolved_name"] = args.pop("name")
                             # Rewrite all buffered events with the real name
                             flushed = self._flush_tool_buffer(idx, state["resolved_name"], args)
+                            # This event's fragment is part of the cleaned arguments just sent
+                            func["arguments"] = ""
                             return flushed + [self._rewrite_event_line(line, data)]
                     except json.JSONDecodeError:
                         pass  # Arguments still incomplete — keep buffering
@@ -506,13 +795,726 @@ class SSEProcessor:
         return result
 
 
+# ---------------------------------------------------------------------------
+# JSON codec
+# ---------------------------------------------------------------------------
+# Request bodies carry the whole conversation, tool output included, and run
+# to several MB. orjson parses/serializes them several times faster than the
+# stdlib; it's used when importable (not a requirement). Anything it refuses
+# — NaN, integers beyond 64 bits, lone surrogates — goes through the stdlib.
+
+def json_loads(data):
+    """Parse JSON (bytes or str); raises ValueError if it isn't JSON."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def json_dumps(obj, sort_keys=False):
+    """Serialize *obj* to compact JSON bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys).encode()
+
+
+# ---------------------------------------------------------------------------
+# Response cache
+# ---------------------------------------------------------------------------
+# OpenCode makes small non-streaming side calls — session titles, summaries —
+# and repeats them with identical bodies, each a full upstream round trip.
+# With PROXY_RESPONSE_CACHE=1 a 200 answer to a deterministic call is
+# replayed for PROXY_RESPONSE_CACHE_TTL seconds. Deterministic means not
+# streaming, and either temperature 0, a path in PROXY_RESPONSE_CACHE_PATHS
+# or a model matching PROXY_RESPONSE_CACHE_MODELS (substrings). The key
+# hashes the path and the sanitized request with its keys sorted, so key
+# order and stripped empty blocks don't split the cache; least recently
+# used entries go past PROXY_RESPONSE_CACHE_SIZE.
+
+RESPONSE_CACHE = os.environ.get("PROXY_RESPONSE_CACHE", "0").strip().lower() in ("1", "true", "yes", "on")
+RESPONSE_CACHE_TTL = float(os.environ.get("PROXY_RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_SIZE = int(os.environ.get("PROXY_RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_PATHS = {p.strip() for p in
+                        os.environ.get("PROXY_RESPONSE_CACHE_PATHS", "").split(",") if p.strip()}
+RESPONSE_CACHE_MODELS = [m.strip().lower() for m in
+                         os.environ.get("PROXY_RESPONSE_CACHE_MODELS", "").split(",") if m.strip()]
+
+RESPONSE_CACHE_STATS = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0}
+_response_cache_lock = threading.Lock()
+_response_cache = OrderedDict()  # key -> (expires at, response headers, body)
+
+
+def response_cache_key(path, data):
+    """Cache key for a parsed request, or None unless it's cacheable."""
+    if not RESPONSE_CACHE or data.get("stream"):
+        return None
+    model = data.get("model")
+    model = model.lower() if isinstance(model, str) else ""
+    temperature = data.get("temperature")
+    # A real number only: False == 0 too, and a malformed request isn't deterministic
+    deterministic = type(temperature) in (int, float) and temperature == 0
+    if not (deterministic or path in RESPONSE_CACHE_PATHS
+            or any(m in model for m in RESPONSE_CACHE_MODELS)):
+        return None
+    return hashlib.sha256(path.encode() + b"\0" + json_dumps(data, sort_keys=True)).hexdigest()
+
+
+def response_cache_get(key):
+    """Cached ``(headers, body)`` for *key*, or None."""
+    now = time.time()
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry is not None and entry[0] <= now:
+            del _response_cache[key]
+            RESPONSE_CACHE_STATS["expired"] += 1
+            entry = None
+        if entry is None:
+            RESPONSE_CACHE_STATS["misses"] += 1
+            return None
+        _response_cache.move_to_end(key)
+        RESPONSE_CACHE_STATS["hits"] += 1
+        return entry[1], entry[2]
+
+
+def response_cache_put(key, status, headers, body):
+    """Remember a response for *key*; only 200s are kept."""
+    if status != 200:
+        return
+    with _response_cache_lock:
+        _response_cache[key] = (time.time() + RESPONSE_CACHE_TTL, headers, body)
+        _response_cache.move_to_end(key)
+        RESPONSE_CACHE_STATS["stores"] += 1
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+            RESPONSE_CACHE_STATS["evictions"] += 1
+
+
+def response_cache_stats():
+    """Snapshot of RESPONSE_CACHE_STATS with the hit rate, for /health."""
+    with _response_cache_lock:
+        stats = {"enabled": RESPONSE_CACHE, **RESPONSE_CACHE_STATS, "entries": len(_response_cache)}
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Request / response plumbing shared by both servers
+# ---------------------------------------------------------------------------
+
+def prepare_upstream_request(path, body, incoming_headers):
+    """Sanitize a request and build what to send upstream.
+
+    *incoming_headers* is an iterable of (name, value). Returns
+    ``(model, body, headers, is_stream, cache_key)``; *model* is "" when
+    the body doesn't name one, *cache_key* None unless the response may
+    come from the response cache.
+    """
+    # --- Sanitize request ---
+    # Parsed once; every stage works on the same object, serialized once.
+    model = ""
+    is_stream = False
+    cache_key = None
+    try:
+        data = json_loads(body)
+    except ValueError as e:
+        log.warning(f"Could not parse request body: {e}")
+        data = None  # Forward as-is if not valid JSON
+    if isinstance(data, dict):
+        stable = 0
+        if "messages" in data:
+            before = len(data["messages"])
+            data["messages"], stable = sanitize_conversation(data["messages"])
+            after = len(data["messages"])
+            if before != after:
+                log.info(f"Messages: {before} -> {after}")
+        # Strip unsupported schema keys from tool definitions (all models)
+        data = sanitize_tool_schemas(data)
+        # Keyed before cache breakpoints, which vary with the conversation memo
+        cache_key = response_cache_key(path, data)
+        # Byte scan: the client placed its own breakpoints
+        if PROMPT_CACHE and b'"cache_control"' not in body:
+            add_cache_breakpoints(data, stable)
+        is_stream = data.get("stream", False)
+        if isinstance(data.get("model"), str):
+            model = data["model"]
+        body = json_dumps(data)
+
+    # Forward headers (inject fresh token to survive PAT rotation). Hop-by-hop
+    # headers stay behind — a client's "Connection: close" would otherwise
+    # close the pooled upstream connection after every request.
+    headers = {}
+    for key, value in incoming_headers:
+        if key.lower() not in _HOP_BY_HOP_HEADERS:
+            headers[key] = value
+    headers["Content-Length"] = str(len(body))
+
+    # Override auth with fresh token from disk — OpenCode's cached token
+    # goes stale after PAT rotation since it's a long-lived TUI process
+    fresh_token = _get_fresh_token()
+    if fresh_token:
+        headers["Authorization"] = f"Bearer {fresh_token}"
+
+    return model, body, headers, is_stream, cache_key
+
+
+def response_headers(items):
+    """Upstream response headers to pass on (framing headers are re-done locally)."""
+    return [(key, value) for key, value in items
+            if key.lower() not in ("transfer-encoding", "content-encoding", "content-length")]
+
+
+def iter_upstream_bytes(resp):
+    """Yield a streaming ``requests`` response body as soon as bytes arrive.
+
+    Chunked bodies come one HTTP chunk at a time; anything else via
+    ``read1``, which returns whatever the socket has rather than blocking
+    for a full read size. (``iter_lines(decode_unicode=True)`` also decoded
+    with the header charset — Latin-1 for ``text/event-stream`` — and
+    mangled non-ASCII tokens.)
+    """
+    raw = resp.raw
+    if raw.chunked and raw.supports_chunked_reads():
+        yield from raw.read_chunked(STREAM_READ_BYTES, decode_content=True)
+        return
+    while True:
+        data = raw.read1(STREAM_READ_BYTES, decode_content=True)
+        if not data:
+            return
+        yield data
+
+
+def fix_response_body(content):
+    """Fix a non-streaming response body; returns it unchanged if it isn't JSON.
+
+    fix_response_data only ever touches tool calls, so a body without any
+    is passed through without being parsed.
+    """
+    if b"tool_calls" not in content:
+        return content
+    try:
+        resp_data = json_loads(content)
+    except ValueError:
+        return content
+    return json_dumps(fix_response_data(resp_data))
+
+
+# ---------------------------------------------------------------------------
+# Upstream connection pool
+# ---------------------------------------------------------------------------
+# One requests.Session (and its urllib3 pool) serves every request, so an
+# agent turn reuses a warm TLS connection instead of paying DNS + TCP + TLS
+# before the first token. Socket connects are counted per thread by the
+# connection classes below (urllib3 reconnects a dropped pooled connection
+# in place, so counting new pool entries isn't enough), which tells us
+# whether each request connected or reused a pooled connection.
+
+_conn_local = threading.local()
+_pool_lock = threading.Lock()
+_pool = {"session": None, "last_used": 0.0}
+POOL_STATS = {"requests": 0, "connects": 0, "reuses": 0, "idle_resets": 0}
+
+
+class _CountingHTTPConnection(urllib3.connection.HTTPConnection):
+    def connect(self):
+        _conn_local.new_connections = getattr(_conn_local, "new_connections", 0) + 1
+        super().connect()
+
+
+class _CountingHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        _conn_local.new_connections = getattr(_conn_local, "new_connections", 0) + 1
+        super().connect()
+
+
+class _CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class _UpstreamAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+class _UpstreamRetry(Retry):
+    # urllib3 retries any 429 carrying Retry-After, status_forcelist or not;
+    # those belong to the concurrency limiter
+    RETRY_AFTER_STATUS_CODES = frozenset({503})
+
+
+def _new_upstream_session():
+    # Retry connection failures and "try again" statuses only: a request
+    # that reached the model may already be generating, so read errors
+    # are never retried.
+    #
+    # The retry layers stack, innermost first:
+    #   transport (here)  — connect failures and RETRY_STATUSES, up to
+    #                       PROXY_UPSTREAM_RETRIES times on the same upstream
+    #   429 retries       — _post_to, up to PROXY_RATE_LIMIT_RETRIES times;
+    #                       each attempt gets its own transport retries
+    #   failover, hedging — send_upstream re-sends a 5xx or connection
+    #                       failure left over from both to the alternate once
+    # Only the last layer can repeat a request the model already started on
+    # (a 502/504, or a hedge), and it sends at most one extra
+    retry = _UpstreamRetry(
+        total=UPSTREAM_RETRIES, connect=UPSTREAM_RETRIES, read=0, status=UPSTREAM_RETRIES,
+        status_forcelist=RETRY_STATUSES, allowed_methods=frozenset({"POST"}),
+        backoff_factor=0.5, respect_retry_after_header=True, raise_on_status=False,
+    )
+    adapter = _UpstreamAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _get_upstream_session():
+    """Return the shared upstream session, replacing it after POOL_IDLE_TIMEOUT idle."""
+    now = time.time()
+    with _pool_lock:
+        session = _pool["session"]
+        if session is not None and now - _pool["last_used"] > POOL_IDLE_TIMEOUT:
+            # Connections still streaming keep working; they're closed when released
+            session.close()
+            session = None
+            POOL_STATS["idle_resets"] += 1
+        if session is None:
+            session = _pool["session"] = _new_upstream_session()
+        _pool["last_used"] = now
+        return session
+
+
+def upstream_post(url, **kwargs):
+    """POST through the shared pool; returns (response, connected) — False when reused."""
+    _conn_local.new_connections = 0
+    resp = _get_upstream_session().post(url, timeout=UPSTREAM_TIMEOUT, **kwargs)
+    connected = _conn_local.new_connections > 0
+    with _pool_lock:
+        POOL_STATS["requests"] += 1
+        POOL_STATS["connects" if connected else "reuses"] += 1
+    return resp, connected
+
+
+# ---------------------------------------------------------------------------
+# Adaptive concurrency and rate-limit retries
+# ---------------------------------------------------------------------------
+# Parallel subagents burst many completions at once. Instead of passing the
+# resulting 429s back to OpenCode, whose blind retries deepen the storm,
+# every request takes a slot per (upstream, model) before going out:
+#   additive increase       — a success raises the limit by 1/limit, i.e.
+#                             about +1 per limit's worth of successes
+#   multiplicative decrease — a 429 halves it, once per window: only a
+#                             request sent after the last decrease counts,
+#                             so one burst of 429s isn't a cascade of halvings
+#   fair queue              — requests over the limit wait in arrival order;
+#                             a rate-limited request retries from the front
+#   retries                 — a 429 is a rejection before generation starts,
+#                             so it's re-sent after Retry-After (or a backoff)
+#                             up to PROXY_RATE_LIMIT_RETRIES times
+# The limit starts at PROXY_CONCURRENCY_MAX, so nothing queues until the
+# upstream first pushes back. A slot is held until the response is closed —
+# the whole stream for streaming requests — so responses are closed with
+# close_upstream(), which frees it.
+
+CONCURRENCY_MAX = int(os.environ.get("PROXY_CONCURRENCY_MAX", "64"))  # 0 disables the limiter
+RATE_LIMIT_RETRIES = int(os.environ.get("PROXY_RATE_LIMIT_RETRIES", "3"))
+RETRY_AFTER_MAX = 30.0
+QUEUE_TIMEOUT = UPSTREAM_TIMEOUT
+
+_limiter_lock = threading.Lock()
+_limiters = {}  # (base, model) -> state, see _limiter_state
+
+
+def _limiter_state(key):
+    state = _limiters.get(key)
+    if state is None:
+        state = _limiters[key] = {
+            "limit": float(CONCURRENCY_MAX), "in_flight": 0, "waiters": deque(), "last_decrease": 0.0,
+            "queued": 0, "throttled": 0, "retries": 0,
+        }
+    return state
+
+
+def _grant_waiters(state):
+    # Caller holds _limiter_lock; a granted slot is handed over, not re-contended
+    while state["waiters"] and state["in_flight"] < int(state["limit"]):
+        state["in_flight"] += 1
+        state["waiters"].popleft()()
+
+
+def _try_acquire(key, grant, front):
+    """Take a slot for *key* now (True), or queue *grant* to be called with one."""
+    with _limiter_lock:
+        state = _limiter_state(key)
+        if not state["waiters"] and state["in_flight"] < int(state["limit"]):
+            state["in_flight"] += 1
+            return True
+        state["queued"] += 1
+        if front:
+            state["waiters"].appendleft(grant)
+        else:
+            state["waiters"].append(grant)
+        return False
+
+
+def _cancel_wait(key, grant):
+    """Leave *key*'s queue; False if a slot was granted meanwhile (the caller owns it)."""
+    with _limiter_lock:
+        try:
+            _limiter_state(key)["waiters"].remove(grant)
+        except ValueError:
+            return False
+        return True
+
+
+def acquire_slot(key, front=False):
+    """Block until *key* has a free slot; returns the time it was taken."""
+    if CONCURRENCY_MAX > 0:
+        granted = threading.Event()
+        grant = granted.set
+        if not _try_acquire(key, grant, front):
+            if not granted.wait(QUEUE_TIMEOUT) and _cancel_wait(key, grant):
+                raise requests.exceptions.Timeout(f"Queued {QUEUE_TIMEOUT:.0f}s for a slot on {key[0]}")
+    return time.time()
+
+
+def release_slot(key):
+    if CONCURRENCY_MAX > 0:
+        with _limiter_lock:
+            state = _limiter_state(key)
+            state["in_flight"] -= 1
+            _grant_waiters(state)
+
+
+def record_limit_result(key, status, sent):
+    """AIMD step for a response with *status* to a request sent at *sent*."""
+    if CONCURRENCY_MAX <= 0:
+        return
+    with _limiter_lock:
+        state = _limiter_state(key)
+        if status == 429:
+            state["throttled"] += 1
+            if sent <= state["last_decrease"]:
+                return
+            state["limit"] = limit = max(state["limit"] / 2, 1.0)
+            state["last_decrease"] = time.time()
+        else:
+            if status < 400:
+                state["limit"] = min(state["limit"] + 1 / state["limit"], float(CONCURRENCY_MAX))
+                _grant_waiters(state)
+            return
+    log.warning(f"Upstream {key[0]} rate-limited {key[1] or 'requests'}; concurrency limit now {int(limit)}")
+
+
+def _retry_after(resp, attempt):
+    try:
+        return min(max(float(resp.headers.get("Retry-After", "")), 0.0), RETRY_AFTER_MAX)
+    except ValueError:
+        return 0.5 * (2 ** attempt)
+
+
+def _count_retry(key):
+    with _limiter_lock:
+        _limiter_state(key)["retries"] += 1
+
+
+def _hold_slot(resp, key):
+    # Released by close_upstream(), or when the response is collected if a
+    # path forgets to close it. The handle lives on the response itself, so
+    # there's no shared table for handler threads and GC to race on; a
+    # finalize runs at most once, whichever calls it first
+    if CONCURRENCY_MAX > 0:
+        resp._slot_release = weakref.finalize(resp, release_slot, key)
+
+
+def _release_held(resp):
+    release = getattr(resp, "_slot_release", None)
+    if isinstance(release, weakref.finalize):
+        release()
+
+
+def close_upstream(resp):
+    """Close an upstream response and free the concurrency slot it holds."""
+    try:
+        resp.close()
+    finally:
+        _release_held(resp)
+
+
+def limiter_status():
+    """Per-(upstream, model) concurrency limits and queue counters, for /health."""
+    with _limiter_lock:
+        return [{"base": base, "model": model, "limit": int(state["limit"]), "in_flight": state["in_flight"],
+                 "waiting": len(state["waiters"]), "queued": state["queued"],
+                 "throttled": state["throttled"], "retries": state["retries"]}
+                for (base, model), state in _limiters.items()]
+
+
+# ---------------------------------------------------------------------------
+# Upstream selection: failover, fail-back and hedging
+# ---------------------------------------------------------------------------
+# When the primary upstream is the AI Gateway, setup_proxy.py passes the
+# workspace's /serving-endpoints as PROXY_UPSTREAM_ALTERNATE (same token,
+# same OpenAI-compatible paths and model names). Requests go to the first
+# healthy upstream in configured order:
+#   failover  — a connect error, timeout or 5xx marks the upstream down for a
+#               cooldown (doubling per consecutive failure) and the request
+#               is re-sent to the next one; nothing has reached the client yet
+#   fail-back — once the cooldown passes the primary is tried again, and one
+#               success marks it healthy
+#   hedging   — opt-in (PROXY_HEDGE=1), since the duplicate is billed too:
+#               a non-streaming request still unanswered after the preferred
+#               upstream's p95 latency is duplicated to the alternate; the
+#               first good answer wins and the other is discarded
+# Streaming requests are never hedged: the duplicate would be a second full
+# generation, billed but never seen.
+
+UPSTREAM_ALTERNATE = os.environ.get("PROXY_UPSTREAM_ALTERNATE", "").rstrip("/")
+HEDGE = os.environ.get("PROXY_HEDGE", "0").strip().lower() in ("1", "true", "yes", "on")
+HEDGE_MIN_SAMPLES = 20  # Don't trust a p95 from fewer requests than this
+HEDGE_MIN_DELAY = 1.0
+FAILOVER_COOLDOWN = 10.0
+FAILOVER_COOLDOWN_MAX = 300.0
+LATENCY_WINDOW = 200
+
+_upstream_lock = threading.Lock()
+_upstreams = {}  # base URL -> state, see _upstream_state
+_hedge_executor = {"executor": None}
+
+
+def _upstream_state(base):
+    state = _upstreams.get(base)
+    if state is None:
+        state = _upstreams[base] = {
+            "latencies": deque(maxlen=LATENCY_WINDOW),  # non-streaming, whole response
+            "ttfb": deque(maxlen=LATENCY_WINDOW),       # streaming, to response headers
+            "requests": 0, "failures": 0, "consecutive_failures": 0, "down_until": 0.0,
+            "failovers": 0, "hedges": 0, "hedge_wins": 0,
+        }
+    return state
+
+
+def upstream_bases():
+    """Configured upstreams, preferred first: healthy ones in order, then soonest to recover."""
+    bases = [UPSTREAM_BASE]
+    if UPSTREAM_ALTERNATE and UPSTREAM_ALTERNATE != UPSTREAM_BASE:
+        bases.append(UPSTREAM_ALTERNATE)
+    now = time.time()
+    with _upstream_lock:
+        down_until = {base: _upstream_state(base)["down_until"] for base in bases}
+    healthy = [base for base in bases if down_until[base] <= now]
+    return healthy + sorted((base for base in bases if down_until[base] > now), key=down_until.get)
+
+
+def record_upstream_result(base, ok, elapsed=None, stream=False):
+    """Feed one request's outcome into *base*'s health and latency window."""
+    with _upstream_lock:
+        state = _upstream_state(base)
+        state["requests"] += 1
+        if ok:
+            if state["down_until"]:
+                log.info(f"Upstream {base} recovered")
+            state["consecutive_failures"] = 0
+            state["down_until"] = 0.0
+            if elapsed is not None:
+                state["ttfb" if stream else "latencies"].append(elapsed)
+            return
+        state["failures"] += 1
+        state["consecutive_failures"] += 1
+        cooldown = min(FAILOVER_COOLDOWN * 2 ** (state["consecutive_failures"] - 1), FAILOVER_COOLDOWN_MAX)
+        state["down_until"] = time.time() + cooldown
+    log.warning(f"Upstream {base} marked down for {cooldown:.0f}s")
+
+
+def _count_upstream(base, key):
+    with _upstream_lock:
+        _upstream_state(base)[key] += 1
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def hedge_delay(base):
+    """Seconds to wait on *base* before hedging, or None without enough history."""
+    with _upstream_lock:
+        samples = list(_upstream_state(base)["latencies"])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(_percentile(samples, 0.95), HEDGE_MIN_DELAY)
+
+
+def upstream_status():
+    """Per-upstream health and latency percentiles, for /health."""
+    now = time.time()
+    status = []
+    for base in upstream_bases():
+        with _upstream_lock:
+            state = _upstream_state(base)
+            entry = {key: state[key] for key in ("requests", "failures", "failovers", "hedges", "hedge_wins")}
+            latencies, ttfb = list(state["latencies"]), list(state["ttfb"])
+            entry["healthy"] = state["down_until"] <= now
+        for name, samples in (("latency", latencies), ("ttfb", ttfb)):
+            for q in (50, 95):
+                entry[f"{name}_p{q}_ms"] = round(_percentile(samples, q / 100) * 1000) if samples else None
+        status.append({"base": base, **entry})
+    return status
+
+
+def _post_to(base, path, body, headers, is_stream, model=""):
+    """upstream_post to one upstream within its concurrency limit, recording the outcome.
+
+    429s are retried here. The response holds a slot until close_upstream().
+    """
+    key = (base, model)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        sent = acquire_slot(key, front=attempt > 0)
+        try:
+            resp, connected = upstream_post(base + path, data=body, headers=headers, stream=is_stream)
+        except BaseException as e:
+            release_slot(key)
+            if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                record_upstream_result(base, False)
+            raise
+        record_limit_result(key, resp.status_code, sent)
+        if resp.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+            break
+        delay = _retry_after(resp, attempt)
+        resp.close()
+        release_slot(key)
+        _count_retry(key)
+        log.info(f"Upstream {base} returned 429; retry {attempt + 1}/{RATE_LIMIT_RETRIES} in {delay:.1f}s")
+        time.sleep(delay)
+    _hold_slot(resp, key)
+    record_upstream_result(base, resp.status_code < 500, time.time() - sent, is_stream)
+    return resp, connected
+
+
+def send_upstream(path, body, headers, is_stream, model=""):
+    """POST to the preferred upstream with failover, hedging non-streaming requests.
+
+    Returns ``(response, connected, base)``; close the response with
+    close_upstream(). A 5xx is returned only when every upstream failed;
+    connection errors / timeouts are re-raised likewise.
+    """
+    bases = upstream_bases()
+    if not is_stream and HEDGE and len(bases) > 1:
+        delay = hedge_delay(bases[0])
+        if delay is not None:
+            return _hedged_post(path, body, headers, bases, delay, model)
+
+    for i, base in enumerate(bases):
+        last = i == len(bases) - 1
+        try:
+            resp, connected = _post_to(base, path, body, headers, is_stream, model)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if last:
+                raise
+            log.warning(f"Upstream {base} failed ({e}); failing over")
+        else:
+            if resp.status_code < 500 or last:
+                return resp, connected, base
+            close_upstream(resp)
+            log.warning(f"Upstream {base} returned {resp.status_code}; failing over")
+        _count_upstream(base, "failovers")
+
+
+def _get_hedge_executor():
+    with _upstream_lock:
+        if _hedge_executor["executor"] is None:
+            _hedge_executor["executor"] = ThreadPoolExecutor(max_workers=POOL_SIZE * 2,
+                                                             thread_name_prefix="upstream")
+        return _hedge_executor["executor"]
+
+
+def _close_result(future):
+    try:
+        close_upstream(future.result()[0])
+    except Exception:
+        pass
+
+
+def _hedged_post(path, body, headers, bases, delay, model=""):
+    """Non-streaming POST to bases[0], duplicated to bases[1] after *delay* (or on failure)."""
+    executor = _get_hedge_executor()
+    primary = executor.submit(_post_to, bases[0], path, body, headers, False, model)
+    futures = {primary: bases[0]}
+    pending = {primary}
+    deadline = time.time() + delay
+    second = fallback = error = winner = None
+
+    try:
+        while pending or second is None:
+            if second is None and (not pending or time.time() >= deadline):
+                if pending:
+                    log.info(f"Upstream {bases[0]} slower than p95 ({delay:.1f}s); hedging to {bases[1]}")
+                    _count_upstream(bases[1], "hedges")
+                else:
+                    _count_upstream(bases[0], "failovers")
+                second = executor.submit(_post_to, bases[1], path, body, headers, False, model)
+                futures[second] = bases[1]
+                pending.add(second)
+            timeout = None if second is not None else max(deadline - time.time(), 0)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    resp, connected = future.result()
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+                    continue
+                if resp.status_code < 500:
+                    if future is second and primary in pending:
+                        _count_upstream(bases[1], "hedge_wins")
+                    winner = future
+                    return resp, connected, futures[future]
+                fallback = future
+
+        if fallback is None:
+            raise error
+        winner = fallback
+        return (*fallback.result(), futures[fallback])
+    finally:
+        # Every response but the returned one is closed however we leave —
+        # a still-pending request's once it completes — so none holds its
+        # limiter slot until GC
+        for future in futures:
+            if future is not winner:
+                future.add_done_callback(_close_result)
+
+
 # ---------------------------------------------------------------------------
 # HTTP Server
 # ---------------------------------------------------------------------------
 
+def health_status():
+    """Body of GET /health (both servers)."""
+    with _pool_lock:
+        pool = dict(POOL_STATS)
+    with _prompt_cache_lock:
+        prompt_cache = {"enabled": PROMPT_CACHE, **PROMPT_CACHE_STATS}
+    return {"status": "ok", "upstream": UPSTREAM_BASE, "upstreams": upstream_status(), "pool": pool,
+            "concurrency": limiter_status(), "memo": memo_stats(), "prompt_cache": prompt_cache,
+            "response_cache": response_cache_stats()}
+
+
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """Handle concurrent requests (e.g., health checks during streaming)."""
     daemon_threads = True
+    request_queue_size = 128  # Default backlog of 5 resets bursts of parallel subagent calls
 
 
 class ProxyHandler(BaseHTTPRequestHandler):
@@ -523,107 +1525,53 @@ class ProxyHandler(BaseHTTPRequestHandler):
         body = self.rfile.read(content_length)
 
         log.info(f"POST {self.path} ({content_length} bytes)")
-
-        # --- Sanitize request ---
+        model, body, headers, is_stream, cache_key = prepare_upstream_request(self.path, body, self.headers.items())
+        cached = response_cache_get(cache_key) if cache_key else None
+        if cached is not None:
+            log.info(f"Response cache hit for {self.path}")
+            self._send_body(200, *cached)
+            return
+
+        resp = None
         try:
-            data = json.loads(body)
-            if "messages" in data:
-                before = len(data["messages"])
-                data["messages"] = sanitize_messages(data["messages"])
-                after = len(data["messages"])
-                if before != after:
-                    log.info(f"Messages: {before} -> {after}")
-            # Strip unsupported schema keys from tool definitions (all models)
-            data = sanitize_tool_schemas(data)
-            body = json.dumps(data).encode()
-        except (json.JSONDecodeError, KeyError) as e:
-            log.warning(f"Could not parse request body: {e}")
-            pass  # Forward as-is if not valid JSON
-
-        # Build upstream URL
-        upstream_url = UPSTREAM_BASE + self.path
-
-        # Forward headers (inject fresh token to survive PAT rotation)
-        headers = {}
-        for key in self.headers:
-            if key.lower() not in ("host", "content-length", "transfer-encoding"):
-                headers[key] = self.headers[key]
-        headers["Content-Length"] = str(len(body))
-
-        # Override auth with fresh token from disk — OpenCode's cached token
-        # goes stale after PAT rotation since it's a long-lived TUI process
-        fresh_token = _get_fresh_token()
-        if fresh_token:
-            headers["Authorization"] = f"Bearer {fresh_token}"
-
-        # Detect streaming
-        is_stream = False
-        try:
-            is_stream = json.loads(body).get("stream", False)
-        except Exception:
-            pass
-
-        try:
-            resp = requests.post(
-                upstream_url,
-                data=body,
-                headers=headers,
-                stream=is_stream,
-                timeout=300,
-            )
-
-            # Log upstream errors
-            if resp.status_code >= 400:
+            started = time.time()
+            resp, connected, base = send_upstream(self.path, body, headers, is_stream, model)
+            log.info(f"Upstream {resp.status_code} from {base} in {(time.time() - started) * 1000:.0f}ms "
+                     f"({'new connection' if connected else 'reused connection'})")
+
+            # Log upstream errors. That reads the body, so an error to a
+            # streaming request is sent whole, like a non-streaming response
+            failed = resp.status_code >= 400
+            if failed:
                 log.error(f"Upstream returned {resp.status_code}: {resp.text[:500]}")
 
             # --- Non-streaming response ---
-            if not is_stream:
-                # Fix response
-                try:
-                    resp_data = resp.json()
-                    resp_data = fix_response_data(resp_data)
-                    resp_body = json.dumps(resp_data).encode()
-                except (json.JSONDecodeError, ValueError):
-                    resp_body = resp.content
-
-                self.send_response(resp.status_code)
-                for key, value in resp.headers.items():
-                    if key.lower() not in ("transfer-encoding", "content-encoding", "content-length"):
-                        self.send_header(key, value)
-                self.send_header("Content-Length", str(len(resp_body)))
-                self.end_headers()
-                self.wfile.write(resp_body)
+            if not is_stream or failed:
+                resp_body = fix_response_body(resp.content)
+                out_headers = response_headers(resp.headers.items())
+                if cache_key:
+                    response_cache_put(cache_key, resp.status_code, out_headers, resp_body)
+                self._send_body(resp.status_code, out_headers, resp_body)
                 return
 
             # --- Streaming response ---
             self.send_response(resp.status_code)
-            for key, value in resp.headers.items():
-                if key.lower() not in ("transfer-encoding", "content-encoding", "content-length"):
-                    self.send_header(key, value)
+            for key, value in response_headers(resp.headers.items()):
+                self.send_header(key, value)
             self.send_header("Transfer-Encoding", "chunked")
             self.end_headers()
 
+            # One chunk per upstream read, not one write per SSE line
             processor = SSEProcessor()
-
-            for raw_line in resp.iter_lines(decode_unicode=True):
-                if raw_line is None:
-                    continue
-
-                line = raw_line.strip() if isinstance(raw_line, str) else raw_line.decode().strip()
-
-                if not line:
-                    # Blank line = event boundary, send it
-                    self._send_chunk(b"\r\n")
-                    continue
-
-                # Process through SSE fixer
-                output_lines = processor.process_line(line)
-                for out_line in output_lines:
-                    self._send_chunk((out_line + "\r\n").encode())
+            for data in iter_upstream_bytes(resp):
+                out = processor.feed(data)
+                if out:
+                    self._send_chunk(out)
 
             # Flush any remaining buffered events
-            for remaining in processor.flush_remaining():
-                self._send_chunk((remaining + "\r\n").encode())
+            out = processor.finish()
+            if out:
+                self._send_chunk(out)
 
             # Send final zero-length chunk to end chunked transfer
             self._send_chunk(b"")
@@ -632,6 +1580,20 @@ class ProxyHandler(BaseHTTPRequestHandler):
             self.send_error(502, f"Upstream connection failed: {e}")
         except requests.exceptions.Timeout:
             self.send_error(504, "Upstream timeout")
+        finally:
+            # Release the upstream connection (and its concurrency slot) even
+            # if the client went away mid-stream
+            if resp is not None:
+                close_upstream(resp)
+
+    def _send_body(self, status, headers, body):
+        """Send a complete (non-streaming) response."""
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
     def _send_chunk(self, data):
         """Send a chunk in HTTP chunked transfer encoding."""
@@ -648,7 +1610,7 @@ class ProxyHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         """Health check endpoint."""
         if self.path == "/health":
-            body = json.dumps({"status": "ok", "upstream": UPSTREAM_BASE}).encode()
+            body = json.dumps(health_status()).encode()
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.send_header("Content-Length", str(len(body)))
@@ -662,6 +1624,355 @@ class ProxyHandler(BaseHTTPRequestHandler):
         pass
 
 
+# ---------------------------------------------------------------------------
+# asyncio server (PROXY_SERVER_MODE=asyncio)
+# ---------------------------------------------------------------------------
+# Same pipeline as ProxyHandler — prepare_upstream_request, SSEProcessor,
+# fix_response_body — with a minimal HTTP/1.1 front end on asyncio streams
+# (OpenCode sends plain POSTs with Content-Length) and httpx for upstream.
+
+_MAX_HEADER_BYTES = 64 * 1024
+_async_client = None
+# prepare_upstream_request parses, sanitizes and re-serializes the whole
+# conversation (megabytes, late in a session) and reads the token file; run
+# on the loop it would stall every other stream. Two workers, so the loop
+# still holds no thread per request
+_prepare_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prepare")
+
+
+def _new_async_client():
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=POOL_SIZE,
+                          keepalive_expiry=POOL_IDLE_TIMEOUT)
+    # Transport retries cover connection failures only, like the threaded pool
+    transport = httpx.AsyncHTTPTransport(retries=UPSTREAM_RETRIES, limits=limits)
+    return httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(UPSTREAM_TIMEOUT))
+
+
+def _status_line(status):
+    try:
+        phrase = HTTPStatus(status).phrase
+    except ValueError:
+        phrase = ""
+    return f"HTTP/1.1 {status} {phrase}\r\n".encode()
+
+
+def _head(status, headers):
+    lines = [_status_line(status)]
+    lines += [f"{key}: {value}\r\n".encode("latin-1", "replace") for key, value in headers]
+    return b"".join(lines) + b"\r\n"
+
+
+async def _write_simple(writer, status, body, content_type="text/plain"):
+    writer.write(_head(status, [("Content-Type", content_type), ("Content-Length", str(len(body)))]) + body)
+    await writer.drain()
+
+
+async def async_upstream_post(url, body, headers):
+    """POST upstream without reading the body; returns (response, connected).
+
+    Retries RETRY_STATUSES like the threaded pool's Retry policy; the
+    transport retries connect failures.
+    """
+    connects = 0
+
+    async def trace(event_name, info):
+        nonlocal connects
+        if event_name == "connection.connect_tcp.started":
+            connects += 1
+
+    for attempt in range(UPSTREAM_RETRIES + 1):
+        request = _async_client.build_request("POST", url, content=body, headers=headers,
+                                              extensions={"trace": trace})
+        resp = await _async_client.send(request, stream=True)
+        if resp.status_code not in RETRY_STATUSES or attempt == UPSTREAM_RETRIES:
+            break
+        await resp.aclose()
+        await asyncio.sleep(_retry_after(resp, attempt))
+
+    with _pool_lock:
+        POOL_STATS["requests"] += 1
+        POOL_STATS["connects" if connects else "reuses"] += 1
+    return resp, connects > 0
+
+
+async def async_acquire_slot(key, front=False):
+    """Asyncio twin of :func:`acquire_slot`; waits without blocking the loop."""
+    if CONCURRENCY_MAX > 0:
+        granted = asyncio.get_running_loop().create_future()
+
+        def grant():
+            if not granted.done():
+                granted.set_result(None)
+
+        if not _try_acquire(key, grant, front):
+            try:
+                await asyncio.wait_for(granted, QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if _cancel_wait(key, grant):
+                    raise httpx.PoolTimeout(f"Queued {QUEUE_TIMEOUT:.0f}s for a slot on {key[0]}")
+            except asyncio.CancelledError:
+                # Client went away while queued
+                if not _cancel_wait(key, grant):
+                    release_slot(key)
+                raise
+    return time.time()
+
+
+async def async_close_upstream(resp):
+    """Asyncio twin of :func:`close_upstream`."""
+    try:
+        await resp.aclose()
+    finally:
+        _release_held(resp)
+
+
+async def _async_post_to(base, path, body, headers, is_stream, model=""):
+    """async_upstream_post to one upstream within its concurrency limit, recording the outcome.
+
+    429s are retried here. Non-streaming bodies are read here, so a hedged
+    pair races on complete answers. The response holds a slot until
+    async_close_upstream().
+    """
+    key = (base, model)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        sent = await async_acquire_slot(key, front=attempt > 0)
+        try:
+            resp, connected = await async_upstream_post(base + path, body, headers)
+        except BaseException as e:
+            release_slot(key)
+            if isinstance(e, httpx.TransportError):
+                record_upstream_result(base, False)
+            raise
+        record_limit_result(key, resp.status_code, sent)
+        if resp.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+            break
+        delay = _retry_after(resp, attempt)
+        await resp.aclose()
+        release_slot(key)
+        _count_retry(key)
+        log.info(f"Upstream {base} returned 429; retry {attempt + 1}/{RATE_LIMIT_RETRIES} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+    _hold_slot(resp, key)
+    if not is_stream:
+        try:
+            await resp.aread()
+        except BaseException as e:
+            # Includes cancellation of a losing hedge
+            await async_close_upstream(resp)
+            if isinstance(e, httpx.TransportError):
+                record_upstream_result(base, False)
+            raise
+    record_upstream_result(base, resp.status_code < 500, time.time() - sent, is_stream)
+    return resp, connected
+
+
+async def async_send_upstream(path, body, headers, is_stream, model=""):
+    """Asyncio twin of :func:`send_upstream`; returns ``(response, connected, base)``."""
+    bases = upstream_bases()
+    if not is_stream and HEDGE and len(bases) > 1:
+        delay = hedge_delay(bases[0])
+        if delay is not None:
+            return await _async_hedged_post(path, body, headers, bases, delay, model)
+
+    for i, base in enumerate(bases):
+        last = i == len(bases) - 1
+        try:
+            resp, connected = await _async_post_to(base, path, body, headers, is_stream, model)
+        except httpx.TransportError as e:
+            if last:
+                raise
+            log.warning(f"Upstream {base} failed ({e!r}); failing over")
+        else:
+            if resp.status_code < 500 or last:
+                return resp, connected, base
+            await async_close_upstream(resp)
+            log.warning(f"Upstream {base} returned {resp.status_code}; failing over")
+        _count_upstream(base, "failovers")
+
+
+def _async_discard(task):
+    """Cancel a losing request; close its response if it finished anyway."""
+    def close(done):
+        if not done.cancelled() and done.exception() is None:
+            asyncio.ensure_future(async_close_upstream(done.result()[0]))
+    task.cancel()
+    task.add_done_callback(close)
+
+
+async def _async_hedged_post(path, body, headers, bases, delay, model=""):
+    """Asyncio twin of :func:`_hedged_post`; the losing request is cancelled."""
+    primary = asyncio.ensure_future(_async_post_to(bases[0], path, body, headers, False, model))
+    tasks = {primary: bases[0]}
+    pending = {primary}
+    deadline = time.time() + delay
+    second = fallback = error = winner = None
+
+    try:
+        while pending or second is None:
+            if second is None and (not pending or time.time() >= deadline):
+                if pending:
+                    log.info(f"Upstream {bases[0]} slower than p95 ({delay:.1f}s); hedging to {bases[1]}")
+                    _count_upstream(bases[1], "hedges")
+                else:
+                    _count_upstream(bases[0], "failovers")
+                second = asyncio.ensure_future(_async_post_to(bases[1], path, body, headers, False, model))
+                tasks[second] = bases[1]
+                pending.add(second)
+            timeout = None if second is not None else max(deadline - time.time(), 0)
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    resp, connected = task.result()
+                except httpx.TransportError as e:
+                    error = e
+                    continue
+                if resp.status_code < 500:
+                    if task is second and primary in pending:
+                        _count_upstream(bases[1], "hedge_wins")
+                    winner = task
+                    return resp, connected, tasks[task]
+                fallback = task
+
+        if fallback is None:
+            raise error
+        winner = fallback
+        return (*fallback.result(), tasks[fallback])
+    finally:
+        # As in _hedged_post: everything but the returned response is
+        # cancelled or closed, on every exit path
+        for task in tasks:
+            if task is not winner:
+                _async_discard(task)
+
+
+async def _async_send_chunk(writer, data):
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n" if data else b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def _async_post(writer, path, body, incoming_headers):
+    log.info(f"POST {path} ({len(body)} bytes)")
+    model, body, headers, is_stream, cache_key = await asyncio.get_running_loop().run_in_executor(
+        _prepare_executor, prepare_upstream_request, path, body, incoming_headers)
+    cached = response_cache_get(cache_key) if cache_key else None
+    if cached is not None:
+        log.info(f"Response cache hit for {path}")
+        out_headers, resp_body = cached
+        writer.write(_head(200, out_headers + [("Content-Length", str(len(resp_body)))]) + resp_body)
+        await writer.drain()
+        return
+
+    started = time.time()
+    try:
+        resp, connected, base = await async_send_upstream(path, body, headers, is_stream, model)
+    except httpx.TimeoutException:
+        await _write_simple(writer, 504, b"Upstream timeout")
+        return
+    except httpx.TransportError as e:
+        await _write_simple(writer, 502, f"Upstream connection failed: {e}".encode())
+        return
+    log.info(f"Upstream {resp.status_code} from {base} in {(time.time() - started) * 1000:.0f}ms "
+             f"({'new connection' if connected else 'reused connection'})")
+
+    try:
+        failed = resp.status_code >= 400
+        if failed:
+            await resp.aread()
+            log.error(f"Upstream returned {resp.status_code}: {resp.text[:500]}")
+
+        # --- Non-streaming response (and any error, whose body is read) ---
+        if not is_stream or failed:
+            resp_body = fix_response_body(await resp.aread())
+            out_headers = response_headers(resp.headers.multi_items())
+            if cache_key:
+                response_cache_put(cache_key, resp.status_code, out_headers, resp_body)
+            writer.write(_head(resp.status_code, out_headers + [("Content-Length", str(len(resp_body)))])
+                         + resp_body)
+            await writer.drain()
+            return
+
+        # --- Streaming response ---
+        out_headers = response_headers(resp.headers.multi_items())
+        out_headers.append(("Transfer-Encoding", "chunked"))
+        writer.write(_head(resp.status_code, out_headers))
+
+        processor = SSEProcessor()
+        async for data in resp.aiter_bytes():
+            out = processor.feed(data)
+            if out:
+                await _async_send_chunk(writer, out)
+
+        out = processor.finish()
+        if out:
+            await _async_send_chunk(writer, out)
+        await _async_send_chunk(writer, b"")
+    except httpx.TransportError as e:
+        log.warning(f"Upstream stream failed: {e}")
+        raise ConnectionError(e)
+    finally:
+        await async_close_upstream(resp)
+
+
+async def _async_get(writer, path):
+    """Health check endpoint."""
+    if path == "/health":
+        body = json.dumps({**health_status(), "mode": "asyncio"}).encode()
+        await _write_simple(writer, 200, body, "application/json")
+    else:
+        await _write_simple(writer, 404, b"Not Found")
+
+
+async def _handle_async_connection(reader, writer):
+    """Serve HTTP/1.1 requests on one client connection until it closes."""
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                return
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, path, version = request_line.split(" ", 2)
+            except ValueError:
+                await _write_simple(writer, 400, b"Bad Request")
+                return
+            incoming_headers = []
+            for header_line in header_lines:
+                if header_line:
+                    key, _, value = header_line.partition(":")
+                    incoming_headers.append((key.strip(), value.strip()))
+            lookup = {key.lower(): value for key, value in incoming_headers}
+            keep_alive = version == "HTTP/1.1" and lookup.get("connection", "").lower() != "close"
+            body = await reader.readexactly(int(lookup.get("content-length") or 0))
+
+            if method == "POST":
+                await _async_post(writer, path, body, incoming_headers)
+            elif method == "GET":
+                await _async_get(writer, path)
+            else:
+                await _write_simple(writer, 501, b"Not Implemented")
+            if not keep_alive:
+                return
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass  # Client went away mid-request or mid-stream
+    finally:
+        writer.close()
+
+
+async def start_async_server(host, port):
+    """Create the shared upstream client and start listening; returns the asyncio server."""
+    global _async_client
+    if _async_client is None:
+        _async_client = _new_async_client()
+    return await asyncio.start_server(_handle_async_connection, host, port, limit=_MAX_HEADER_BYTES)
+
+
+async def _serve_async_forever(host, port):
+    server = await start_async_server(host, port)
+    async with server:
+        await server.serve_forever()
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
@@ -671,9 +1982,17 @@ if __name__ == "__main__":
         print("Error: PROXY_UPSTREAM_BASE environment variable is required", file=sys.stderr)
         sys.exit(1)
 
-    server = ThreadedHTTPServer((LISTEN_HOST, LISTEN_PORT), ProxyHandler)
-    print(f"Content-filter proxy listening on {LISTEN_HOST}:{LISTEN_PORT}")
+    mode = SERVER_MODE
+    if mode == "asyncio" and httpx is None:
+        print("Warning: PROXY_SERVER_MODE=asyncio needs httpx — falling back to threaded", file=sys.stderr)
+        mode = "threaded"
+
+    print(f"Content-filter proxy listening on {LISTEN_HOST}:{LISTEN_PORT} ({mode})")
     print(f"Forwarding to: {UPSTREAM_BASE}")
     print(f"Fixes: empty text blocks, orphaned tool_results, tool name remapping, finish_reason")
     sys.stdout.flush()
-    server.serve_forever()
+    if mode == "asyncio":
+        asyncio.run(_serve_async_forever(LISTEN_HOST, LISTEN_PORT))
+    else:
+        server = ThreadedHTTPServer((LISTEN_HOST, LISTEN_PORT), ProxyHandler)
+        server.serve_forever()
@@ -0,0 +1,119 @@
+"""File downloads from ``~/projects`` and ``~/uploads``.
+
+Files are served with Flask's ``send_file``: the open file is handed to the
+WSGI server's ``wsgi.file_wrapper`` (gunicorn uses ``sendfile(2)``), so a
+large build output or notebook goes from page cache to socket without being
+read into Python. ``conditional=True`` gives us ETag / Last-Modified, 304s
+and single-range ``Range`` requests (206) for resumed downloads.
+
+Text files can instead be gzip-compressed on the fly when the client
+accepts it — streamed block by block, never held in memory whole. A gzip
+response has no stable length, so Range requests always get the identity
+encoding.
+"""
+
+import logging
+import mimetypes
+import os
+import zlib
+
+from flask import Response, request, send_file
+
+import uploads
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_ROOTS = ("projects", "uploads")
+GZIP_MIN_BYTES = 1024
+_GZIP_BLOCK = 256 * 1024
+_TEXT_MIMETYPES = ("application/json", "application/javascript", "application/xml",
+                   "application/x-ipynb+json", "application/x-sh", "image/svg+xml")
+
+# Types a browser would render as a document and run scripts in. Shown inline
+# they'd execute on the app's origin, so they're always saved instead
+_ACTIVE_MIMETYPES = ("text/html", "application/xhtml+xml", "image/svg+xml",
+                     "application/xml", "text/xml")
+
+mimetypes.add_type("application/x-ipynb+json", ".ipynb")
+mimetypes.add_type("text/plain", ".log")
+mimetypes.add_type("application/json", ".jsonl")
+
+
+def resolve_download_path(path):
+    """Return the real path of *path* if it is a file inside a download root, else None.
+
+    *path* may be absolute or relative to ``$HOME``; symlinks are resolved
+    before the check, so a link can't point outside the roots.
+    """
+    if not path or "\x00" in path:
+        return None
+    home = uploads.home_dir()
+    full = os.path.realpath(os.path.join(home, os.path.expanduser(path)))
+    for root in DOWNLOAD_ROOTS:
+        real_root = os.path.realpath(os.path.join(home, root))
+        if full.startswith(real_root + os.sep) and os.path.isfile(full):
+            return full
+    return None
+
+
+def _is_text(mimetype):
+    return bool(mimetype) and (mimetype.startswith("text/") or mimetype in _TEXT_MIMETYPES)
+
+
+def _accepts_gzip():
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if token.strip().lower() == "gzip" and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            return True
+    return False
+
+
+def _gzip_stream(path):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_GZIP_BLOCK), b""):
+            out = compressor.compress(block)
+            if out:
+                yield out
+    yield compressor.flush()
+
+
+def serve_download(path, as_attachment=True):
+    """Serve a file under ~/projects or ~/uploads (404 for anything else).
+
+    ``as_attachment=False`` displays the file, except for HTML, SVG and
+    XML, which are always sent as attachments.
+    """
+    full = resolve_download_path(path)
+    if full is None:
+        logger.warning(f"Download refused: {path!r}")
+        return Response("Not Found", status=404, mimetype="text/plain")
+
+    st = os.stat(full)
+    mimetype = mimetypes.guess_type(full)[0] or "application/octet-stream"
+    # The requested name, not the resolved one (uploads may be symlinks into the store)
+    name = os.path.basename(path.rstrip("/"))
+    if mimetype in _ACTIVE_MIMETYPES:
+        as_attachment = True
+
+    if (_is_text(mimetype) and st.st_size >= GZIP_MIN_BYTES and _accepts_gzip()
+            and "Range" not in request.headers):
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}-gzip"'
+        if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+            response = Response(status=304)
+        else:
+            response = Response(_gzip_stream(full), mimetype=mimetype)
+            response.headers["Content-Encoding"] = "gzip"
+            if as_attachment:
+                response.headers.set("Content-Disposition", "attachment", filename=name)
+        response.headers["ETag"] = etag
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    response = send_file(full, mimetype=mimetype, as_attachment=as_attachment,
+                         download_name=name, conditional=True, etag=True, max_age=0)
+    response.headers["Cache-Control"] = "no-cache"
+    if _is_text(mimetype):
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
@@ -0,0 +1,105 @@
+"""Deadline-ordered timer scheduler.
+
+One daemon thread sleeps until the earliest deadline in a heap, runs that
+callback, and goes back to sleep — so timers fire on time and the cost of
+arming or replacing one is O(log n), however many are pending.
+
+Timers are keyed (e.g. ``("idle", session_id)``). Scheduling an existing
+key replaces its deadline; the old heap entry is left in place and skipped
+when it surfaces (lazy invalidation), which keeps ``schedule`` and
+``cancel`` cheap enough to call from request handlers.
+
+Callbacks run on the scheduler thread, one at a time, so they must not
+block — anything slow should hand off to its own thread.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """Run keyed callbacks at absolute ``time.time()`` deadlines."""
+
+    def __init__(self, name="deadline-scheduler"):
+        self._name = name
+        self._heap = []                 # (deadline, seq, key)
+        self._timers = {}               # key -> (deadline, seq, callback)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """Start the scheduler thread (idempotent)."""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name=self._name)
+            self._thread.start()
+
+    def schedule(self, key, deadline, callback):
+        """Run *callback* at *deadline*, replacing any timer already under *key*."""
+        with self._cond:
+            seq = next(self._seq)
+            self._timers[key] = (deadline, seq, callback)
+            heapq.heappush(self._heap, (deadline, seq, key))
+            self._compact()
+            # Only wake the thread if this timer is now the earliest
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+        self.start()
+
+    def cancel(self, key):
+        """Drop the timer under *key*. Returns True if one was pending."""
+        with self._cond:
+            return self._timers.pop(key, None) is not None
+
+    def deadline(self, key):
+        """Return the pending deadline for *key*, or None."""
+        with self._cond:
+            timer = self._timers.get(key)
+            return timer[0] if timer else None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._timers)
+
+    def _compact(self):
+        """Rebuild the heap once stale entries outnumber live ones."""
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._timers):
+            self._heap = [(d, s, k) for k, (d, s, _) in self._timers.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self):
+        """Block until a live timer is due, then remove and return its callback."""
+        with self._cond:
+            while True:
+                while self._heap:
+                    deadline, seq, key = self._heap[0]
+                    timer = self._timers.get(key)
+                    if timer is None or timer[1] != seq:
+                        heapq.heappop(self._heap)   # Cancelled or rescheduled
+                        continue
+                    break
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = deadline - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._timers[key]
+                return key, timer[2]
+
+    def _run(self):
+        while True:
+            key, callback = self._pop_due()
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Scheduled callback {key!r} failed: {e}")
@@ -0,0 +1,507 @@
+"""Process-tree controls for terminal sessions.
+
+Every session shell is spawned with ``os.setsid``, so everything it starts —
+including the separate process groups bash creates for each job — shares the
+shell's session ID. This module enumerates that tree from ``/proc`` and
+adjusts its scheduling priority so the focused pane gets latency and
+background panes get throughput.
+
+Mechanisms, applied best-effort (each one silently drops out when the
+container doesn't allow it):
+  - nice      — ``setpriority`` on every process in the session
+  - ionice    — best-effort I/O class level via the ``ionice`` binary
+  - cgroup v2 — ``cpu.weight`` / ``io.weight`` on a per-session cgroup,
+                when the app's cgroup (or SESSION_CGROUP_ROOT) is writable
+
+Idle sessions can be hibernated: the whole tree is frozen (cgroup.freeze or
+SIGSTOP) or dropped to the lowest priority until a client comes back.
+
+It also caps what a single session may consume (``memory.max`` / ``pids.max``
+on the session cgroup; process count falls back to an rlimit set in the
+child before exec, memory has no fallback) and reports live usage of each session's tree for /api/sessions and
+/api/metrics.
+"""
+
+import logging
+import os
+import resource
+import shutil
+import signal
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# "focus" re-prioritizes on focus changes; "off" leaves every session alone
+PRIORITY_POLICY = os.environ.get("SESSION_PRIORITY_POLICY", "focus").strip().lower()
+
+FOREGROUND_NICE = 0
+BACKGROUND_NICE = int(os.environ.get("SESSION_BACKGROUND_NICE", "10"))
+FOREGROUND_IO_LEVEL = 0             # best-effort class: 0 = highest, 7 = lowest
+BACKGROUND_IO_LEVEL = 7
+FOREGROUND_CGROUP_WEIGHT = 400      # cgroup v2 weights: 1-10000, kernel default 100
+BACKGROUND_CGROUP_WEIGHT = 50
+
+# Per-session limits — 0 disables a limit
+MEMORY_LIMIT_MB = int(os.environ.get("SESSION_MEMORY_LIMIT_MB", "0"))
+PIDS_LIMIT = int(os.environ.get("SESSION_PIDS_LIMIT", "0"))
+CPU_LIMIT_SECONDS = int(os.environ.get("SESSION_CPU_LIMIT_SECONDS", "0"))
+
+# Hibernation: "stop" freezes the tree, "deprioritize" leaves it running at
+# the lowest CPU/IO priority. HIBERNATE_AFTER_SECONDS = 0 disables it.
+HIBERNATE_AFTER_SECONDS = int(os.environ.get("SESSION_HIBERNATE_AFTER_SECONDS", "0"))
+HIBERNATE_MODE = os.environ.get("SESSION_HIBERNATE_MODE", "stop").strip().lower()
+HIBERNATE_NICE = 19
+HIBERNATE_CGROUP_WEIGHT = 1
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+_CGROUP_MOUNT = "/sys/fs/cgroup"
+_cgroup_base_cache = {"resolved": False, "path": None}
+# Controllers a session cgroup uses. Their interface files (cpu.weight,
+# memory.max, ...) only exist in it once the parent enables them in
+# cgroup.subtree_control
+_SESSION_CONTROLLERS = ("cpu", "io", "memory", "pids")
+_controllers_enabled = set()  # bases already set up
+_warned = set()
+
+
+# ---------------------------------------------------------------------------
+# /proc helpers
+# ---------------------------------------------------------------------------
+
+def _read_stat_fields(pid):
+    """Return the fields of /proc/<pid>/stat after the ``(comm)`` column.
+
+    The command name may contain spaces or parentheses, so split on the last
+    ``)``. Index 0 is the state, 1 ppid, 2 pgrp, 3 session, 11-14 utime,
+    stime, cutime, cstime (clock ticks), 21 rss (pages).
+    """
+    with open(f"/proc/{pid}/stat") as f:
+        data = f.read()
+    return data.rsplit(")", 1)[1].split()
+
+
+def _scan_sessions(sids):
+    """Map each session ID in *sids* to ``{pid: stat_fields}`` in one /proc pass."""
+    wanted = {sid for sid in sids if isinstance(sid, int) and sid > 0}
+    found = {sid: {} for sid in wanted}
+    if not wanted:
+        return found
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return found
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            fields = _read_stat_fields(entry)
+            sid = int(fields[3])
+        except (OSError, IndexError, ValueError):
+            continue  # Process exited mid-scan or unreadable
+        if sid in wanted:
+            found[sid][int(entry)] = fields
+    return found
+
+
+def session_pids(sid):
+    """Return every live PID whose session ID is *sid* (the shell's PID)."""
+    return list(_scan_sessions([sid]).get(sid, {}))
+
+
+# ---------------------------------------------------------------------------
+# nice / ionice
+# ---------------------------------------------------------------------------
+
+def _can_lower_nice(target):
+    """True if this process may move a niced process back down to *target*.
+
+    Unprivileged processes can only raise nice values unless RLIMIT_NICE
+    allows otherwise (the floor is ``20 - rlim_cur``). Without that, a
+    background pane could never be restored, so nice is left untouched.
+    """
+    if os.geteuid() == 0:
+        return True
+    try:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NICE)
+    except (AttributeError, ValueError, OSError):
+        return False
+    return soft == resource.RLIM_INFINITY or 20 - soft <= target
+
+
+NICE_ENABLED = _can_lower_nice(FOREGROUND_NICE)
+
+
+def set_nice(pids, value):
+    """Set the nice value of each PID. Returns False on a permission error."""
+    for pid in pids:
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, value)
+        except ProcessLookupError:
+            continue
+        except PermissionError as e:
+            logger.warning(f"renice {pid} -> {value} not permitted: {e}")
+            return False
+    return True
+
+
+def set_ionice(pids, level):
+    """Set the best-effort I/O priority level of each PID via ``ionice``."""
+    if not pids:
+        return True
+    try:
+        result = subprocess.run(
+            ["ionice", "-c", "2", "-n", str(level), "-p", *[str(p) for p in pids]],
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+        return result.returncode == 0
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return False
+
+
+# ---------------------------------------------------------------------------
+# cgroup v2
+# ---------------------------------------------------------------------------
+
+def cgroup_base():
+    """Resolve the writable cgroup v2 directory session cgroups live under.
+
+    SESSION_CGROUP_ROOT wins if set (a delegated subtree); otherwise the
+    app's own cgroup. Returns None on cgroup v1 or read-only hierarchies.
+    The result is cached after the first call.
+    """
+    if _cgroup_base_cache["resolved"]:
+        return _cgroup_base_cache["path"]
+
+    path = None
+    if os.path.exists(os.path.join(_CGROUP_MOUNT, "cgroup.controllers")):
+        explicit = os.environ.get("SESSION_CGROUP_ROOT", "").strip()
+        if explicit:
+            path = explicit
+        else:
+            try:
+                with open("/proc/self/cgroup") as f:
+                    for line in f:
+                        if line.startswith("0::"):
+                            path = os.path.join(_CGROUP_MOUNT, line[3:].strip().lstrip("/"))
+                            break
+            except OSError:
+                path = None
+        if path and not os.access(path, os.W_OK):
+            path = None
+
+    _cgroup_base_cache["resolved"] = True
+    _cgroup_base_cache["path"] = path
+    return path
+
+
+def _enable_controllers(base):
+    """Enable _SESSION_CONTROLLERS for the children of *base*, once per base.
+
+    Best-effort, one controller at a time: cgroup v2 refuses (EBUSY) while
+    *base* itself holds processes, which is why a delegated, empty
+    SESSION_CGROUP_ROOT works where the app's own cgroup may not.
+    """
+    if base in _controllers_enabled:
+        return
+    _controllers_enabled.add(base)
+    try:
+        with open(os.path.join(base, "cgroup.controllers")) as f:
+            available = set(f.read().split())
+        with open(os.path.join(base, "cgroup.subtree_control")) as f:
+            enabled = set(f.read().split())
+    except OSError:
+        return
+    for controller in _SESSION_CONTROLLERS:
+        if controller in available and controller not in enabled:
+            if not _write_knob(base, "cgroup.subtree_control", f"+{controller}"):
+                logger.debug(f"Could not enable the {controller} controller under {base}")
+
+
+def create_session_cgroup(session_id, pid=None):
+    """Create ``coda-<session_id>`` under cgroup_base() and move *pid* into it.
+
+    With no *pid*, the cgroup is created empty so the shell can join it
+    itself before exec (see spawn_preexec) and never run outside its limits.
+    Returns the cgroup path, or None if cgroups aren't usable here.
+    """
+    base = cgroup_base()
+    if not base:
+        return None
+    _enable_controllers(base)
+    path = os.path.join(base, f"coda-{session_id}")
+    try:
+        os.makedirs(path, exist_ok=True)
+        if pid is not None:
+            with open(os.path.join(path, "cgroup.procs"), "w") as f:
+                f.write(str(pid))
+        return path
+    except OSError as e:
+        logger.debug(f"Could not create session cgroup {path}: {e}")
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        return None
+
+
+def remove_session_cgroup(path):
+    """Remove a session cgroup (only succeeds once its processes are gone)."""
+    if not path:
+        return
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def set_cgroup_weight(path, weight):
+    """Write cpu.weight and io.weight for a session cgroup, where available."""
+    if not path:
+        return False
+    applied = False
+    for name in ("cpu.weight", "io.weight"):
+        applied = _write_knob(path, name, weight) or applied
+    return applied
+
+
+def _write_knob(path, name, value):
+    """Write one cgroup interface file. Returns False if it's missing or read-only."""
+    knob = os.path.join(path, name)
+    if not os.path.exists(knob):
+        return False
+    try:
+        with open(knob, "w") as f:
+            f.write(str(value))
+        return True
+    except OSError:
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Limits
+# ---------------------------------------------------------------------------
+
+def apply_session_limits(cgroup_path=None):
+    """Decide how each configured limit is enforced for a new session.
+
+    Memory and process-count limits go on the session cgroup when its
+    ``memory.max`` / ``pids.max`` accept them. A process count the cgroup
+    can't take falls back to RLIMIT_NPROC, set in the child by
+    spawn_preexec() (the kernel counts it per UID, and doesn't enforce it
+    for root). Memory has no fallback: RLIMIT_AS caps address space, and
+    node/V8-based agents reserve far more of it than they use, so they'd
+    fail to start — the session runs uncapped and a warning is logged.
+    CPU time is always RLIMIT_CPU, i.e. seconds per process.
+
+    Returns ``(limits, rlimits)`` — a description for /api/sessions keyed
+    by resource, and the ``(resource, value)`` pairs spawn_preexec applies.
+    """
+    limits = {}
+    rlimits = []
+
+    if MEMORY_LIMIT_MB > 0:
+        memory_bytes = MEMORY_LIMIT_MB * 1024 * 1024
+        if cgroup_path and _write_knob(cgroup_path, "memory.max", memory_bytes):
+            limits["memory_bytes"] = {"limit": memory_bytes, "via": "cgroup"}
+        elif "memory" not in _warned:
+            _warned.add("memory")
+            logger.warning("SESSION_MEMORY_LIMIT_MB needs the cgroup v2 memory controller on "
+                           "session cgroups (see SESSION_CGROUP_ROOT); sessions run without a memory cap")
+
+    if PIDS_LIMIT > 0:
+        if cgroup_path and _write_knob(cgroup_path, "pids.max", PIDS_LIMIT):
+            limits["processes"] = {"limit": PIDS_LIMIT, "via": "cgroup"}
+        else:
+            rlimits.append((resource.RLIMIT_NPROC, PIDS_LIMIT))
+            limits["processes"] = {"limit": PIDS_LIMIT, "via": "rlimit"}
+
+    if CPU_LIMIT_SECONDS > 0:
+        rlimits.append((resource.RLIMIT_CPU, CPU_LIMIT_SECONDS))
+        limits["cpu_seconds"] = {"limit": CPU_LIMIT_SECONDS, "via": "rlimit"}
+
+    return limits, rlimits
+
+
+def spawn_preexec(cgroup_path=None, rlimits=()):
+    """Build the ``preexec_fn`` for a session shell.
+
+    Runs in the forked child: starts a new session (so the session ID is the
+    shell's PID), joins the session cgroup, and applies *rlimits*. Failures
+    are ignored — a session without limits beats no session at all.
+    """
+    procs_file = os.path.join(cgroup_path, "cgroup.procs") if cgroup_path else None
+
+    def preexec():
+        os.setsid()
+        if procs_file:
+            try:
+                with open(procs_file, "w") as f:
+                    f.write("0")
+            except OSError:
+                pass
+        for res, value in rlimits:
+            try:
+                resource.setrlimit(res, (value, value))
+            except (ValueError, OSError):
+                pass
+
+    return preexec
+
+
+# ---------------------------------------------------------------------------
+# Accounting
+# ---------------------------------------------------------------------------
+
+def _read_io_bytes(pid):
+    """Return (read_bytes, write_bytes) of storage I/O from /proc/<pid>/io."""
+    read_bytes = write_bytes = 0
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "read_bytes":
+                    read_bytes = int(value)
+                elif key == "write_bytes":
+                    write_bytes = int(value)
+    except (OSError, ValueError):
+        pass  # Exited, or /proc/<pid>/io not readable for this process
+    return read_bytes, write_bytes
+
+
+def _usage_from_stats(stats):
+    """Aggregate ``{pid: stat_fields}`` of one session into a usage dict.
+
+    CPU time includes cutime/cstime, so work done by already-reaped children
+    (finished builds, test runs) still counts toward the session.
+    """
+    ticks = rss_pages = read_bytes = write_bytes = 0
+    for pid, fields in stats.items():
+        try:
+            ticks += sum(int(v) for v in fields[11:15])
+            rss_pages += int(fields[21])
+        except (IndexError, ValueError):
+            continue
+        r, w = _read_io_bytes(pid)
+        read_bytes += r
+        write_bytes += w
+    return {
+        "processes": len(stats),
+        "cpu_seconds": round(ticks / _CLK_TCK, 2),
+        "rss_bytes": rss_pages * _PAGE_SIZE,
+        "read_bytes": read_bytes,
+        "write_bytes": write_bytes,
+    }
+
+
+def sessions_usage(sids):
+    """Return ``{sid: usage}`` for every session ID in *sids*.
+
+    One /proc scan covers all sessions, so listing N sessions costs the
+    same directory walk as listing one.
+    """
+    return {sid: _usage_from_stats(stats) for sid, stats in _scan_sessions(sids).items()}
+
+
+def session_usage(sid):
+    """Live CPU, RSS, I/O and process count of the session led by *sid*."""
+    return sessions_usage([sid]).get(sid) or _usage_from_stats({})
+
+
+# ---------------------------------------------------------------------------
+# Priority policy
+# ---------------------------------------------------------------------------
+
+def apply_priority(pid, focused, cgroup_path=None):
+    """Re-prioritize the process tree of the session led by *pid*.
+
+    Returns a dict describing what was applied, suitable for /api/sessions.
+    """
+    pids = session_pids(pid)
+    nice = FOREGROUND_NICE if focused else BACKGROUND_NICE
+    io_level = FOREGROUND_IO_LEVEL if focused else BACKGROUND_IO_LEVEL
+    weight = FOREGROUND_CGROUP_WEIGHT if focused else BACKGROUND_CGROUP_WEIGHT
+
+    state = {"focused": focused, "nice": None, "ionice": None, "cgroup_weight": None}
+    if NICE_ENABLED and set_nice(pids, nice):
+        state["nice"] = nice
+    if set_ionice(pids, io_level):
+        state["ionice"] = io_level
+    if set_cgroup_weight(cgroup_path, weight):
+        state["cgroup_weight"] = weight
+    return state
+
+
+# ---------------------------------------------------------------------------
+# Hibernation
+# ---------------------------------------------------------------------------
+
+def _signal_tree(pids, sig):
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            continue  # Exited since the scan
+
+
+def hibernate_tree(pid, cgroup_path=None):
+    """Freeze or deprioritize the session led by *pid* per HIBERNATE_MODE.
+
+    Returns the mechanism used (``"freeze"``, ``"sigstop"`` or
+    ``"deprioritize"``) for resume_tree(), or None if nothing was applied.
+
+    SIGSTOP goes to the shell first: a running bash that saw its foreground
+    job stop would print "Stopped" and take the terminal back from it.
+    """
+    if HIBERNATE_MODE == "deprioritize":
+        pids = session_pids(pid)
+        if NICE_ENABLED:
+            set_nice(pids, HIBERNATE_NICE)
+        set_ionice(pids, BACKGROUND_IO_LEVEL)
+        set_cgroup_weight(cgroup_path, HIBERNATE_CGROUP_WEIGHT)
+        return "deprioritize"
+
+    if cgroup_path and _write_knob(cgroup_path, "cgroup.freeze", 1):
+        return "freeze"
+
+    pids = session_pids(pid)
+    if pid not in pids:
+        return None
+    _signal_tree([pid] + [p for p in pids if p != pid], signal.SIGSTOP)
+    return "sigstop"
+
+
+def resume_tree(pid, cgroup_path, mechanism, focused=False):
+    """Undo hibernate_tree() and restore the session's normal priority.
+
+    SIGCONT reaches the children before the shell, so by the time bash runs
+    again its foreground job is already running and it never reports it
+    as stopped.
+    """
+    if mechanism == "freeze":
+        _write_knob(cgroup_path, "cgroup.freeze", 0)
+    elif mechanism == "sigstop":
+        pids = session_pids(pid)
+        _signal_tree([p for p in pids if p != pid] + [pid], signal.SIGCONT)
+    elif mechanism == "deprioritize":
+        # With the focus policy off every session runs at foreground priority
+        return apply_priority(pid, focused or PRIORITY_POLICY != "focus", cgroup_path)
+    return None
+
+
+def priority_mechanisms():
+    """List the mechanisms the focus policy can use in this container."""
+    mechanisms = []
+    if PRIORITY_POLICY == "off":
+        return mechanisms
+    if NICE_ENABLED:
+        mechanisms.append("nice")
+    if shutil.which("ionice"):
+        mechanisms.append("ionice")
+    if cgroup_base():
+        mechanisms.append("cgroup")
+    return mechanisms
@@ -72,9 +72,16 @@ if not token:
     sys.exit(0)
 
 # Determine the upstream base URL
+# With the AI Gateway as primary, serving endpoints are the failover target
+# (and the hedge target with PROXY_HEDGE=1) — same workspace, token and
+# OpenAI-compatible API
+upstream_alternate = ""
 if gateway_host:
     upstream_base = f"{gateway_host}/mlflow/v1"
     print(f"Content-filter proxy will forward to AI Gateway: {gateway_host}")
+    if host:
+        upstream_alternate = f"{host}/serving-endpoints"
+        print(f"Content-filter proxy will fail over to: {upstream_alternate}")
 else:
     upstream_base = f"{host}/serving-endpoints"
     print(f"Content-filter proxy will forward to: {host}/serving-endpoints")
@@ -86,6 +93,8 @@ print(f"Starting content-filter proxy on {PROXY_HOST}:{PROXY_PORT}...")
 
 env = os.environ.copy()
 env["PROXY_UPSTREAM_BASE"] = upstream_base
+if upstream_alternate:
+    env["PROXY_UPSTREAM_ALTERNATE"] = upstream_alternate
 env["PROXY_HOST"] = PROXY_HOST
 env["PROXY_PORT"] = str(PROXY_PORT)
 
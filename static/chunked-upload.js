@@ -0,0 +1,137 @@
+/**
+ * chunked-upload.js — resumable, parallel uploads via /api/upload/init.
+ *
+ * Loaded on demand (loadScript) the first time a non-image file is dropped.
+ * The file is cut into the chunk size the server suggests and up to
+ * PARALLEL_CHUNKS chunks are PUT at once, each with its SHA-256 so the server
+ * can reject a corrupted chunk. A failed chunk is retried with backoff; the
+ * upload id is remembered in localStorage so dropping the same file again
+ * after a lost connection sends only the chunks the server doesn't have.
+ * When the whole-file hash is known, /api/upload/check is asked first and
+ * content the server already stores isn't sent at all.
+ *
+ * Exposes one global:
+ *   uploadFileChunked(file, onProgress) → Promise<{ path, size, sha256, deduplicated }>
+ *     onProgress(receivedBytes, totalBytes) is called as chunks land
+ */
+
+/* eslint-env browser */
+"use strict";
+
+const PARALLEL_CHUNKS = 4;
+const CHUNK_RETRIES = 4;
+// Hashing the whole file needs it in memory at once (SubtleCrypto can't
+// stream), so larger files rely on per-chunk checksums alone
+const WHOLE_FILE_HASH_MAX_BYTES = 64 * 1024 * 1024;
+
+function _hex(buffer) {
+  return Array.from(new Uint8Array(buffer), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function _sha256(data) {
+  if (!window.crypto || !crypto.subtle) return null;
+  return _hex(await crypto.subtle.digest('SHA-256', data));
+}
+
+function _resumeKey(file) {
+  return `upload-resume:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function _json(resp) {
+  const data = await resp.json().catch(() => ({}));
+  if (!resp.ok) throw new Error(data.error || `HTTP ${resp.status}`);
+  return data;
+}
+
+// Resume a previous attempt at this file if the server still has it
+async function _startUpload(file, sha256) {
+  const key = _resumeKey(file);
+  const previous = localStorage.getItem(key);
+  if (previous) {
+    const resp = await fetch(`/api/upload/${previous}`);
+    if (resp.ok) return resp.json();
+    localStorage.removeItem(key);
+  }
+  const status = await _json(await fetch('/api/upload/init', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size, sha256 }),
+  }));
+  localStorage.setItem(key, status.upload_id);
+  return status;
+}
+
+// Byte ranges [start, end) not yet covered by the server's received ranges,
+// cut into chunk-sized pieces
+function _missingChunks(size, ranges, chunkSize) {
+  const chunks = [];
+  let pos = 0;
+  const gaps = [];
+  for (const [lo, hi] of ranges) {
+    if (lo > pos) gaps.push([pos, lo]);
+    pos = Math.max(pos, hi);
+  }
+  if (pos < size) gaps.push([pos, size]);
+  for (const [lo, hi] of gaps) {
+    for (let start = lo; start < hi; start += chunkSize) {
+      chunks.push([start, Math.min(start + chunkSize, hi)]);
+    }
+  }
+  return chunks;
+}
+
+async function _putChunk(uploadId, file, start, end) {
+  const body = await file.slice(start, end).arrayBuffer();
+  const headers = { 'Content-Type': 'application/octet-stream' };
+  const digest = await _sha256(body);
+  if (digest) headers['X-Chunk-SHA256'] = digest;
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await _json(await fetch(`/api/upload/${uploadId}?offset=${start}`, {
+        method: 'PUT', headers, body,
+      }));
+    } catch (err) {
+      if (attempt + 1 >= CHUNK_RETRIES) throw err;
+      await new Promise(r => setTimeout(r, 500 * Math.pow(2, attempt)));
+    }
+  }
+}
+
+async function uploadFileChunked(file, onProgress) {
+  const sha256 = file.size <= WHOLE_FILE_HASH_MAX_BYTES
+    ? await _sha256(await file.arrayBuffer()) : null;
+  if (sha256) {
+    const known = await _json(await fetch('/api/upload/check', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ sha256, filename: file.name }),
+    }));
+    if (known.exists) {
+      if (onProgress) onProgress(file.size, file.size);
+      return { path: known.path, size: file.size, sha256, deduplicated: true };
+    }
+  }
+  const status = await _startUpload(file, sha256);
+  const uploadId = status.upload_id;
+  const queue = _missingChunks(file.size, status.ranges, status.chunk_size);
+  let received = status.received;
+  if (onProgress) onProgress(received, file.size);
+
+  async function drain() {
+    while (queue.length) {
+      const [start, end] = queue.shift();
+      await _putChunk(uploadId, file, start, end);
+      received += end - start;
+      if (onProgress) onProgress(received, file.size);
+    }
+  }
+  await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, drain));
+
+  const result = await _json(await fetch(`/api/upload/${uploadId}/commit`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ sha256 }),
+  }));
+  localStorage.removeItem(_resumeKey(file));
+  return result;
+}
@@ -0,0 +1,79 @@
+/**
+ * image-worker.js — Web Worker that shrinks images before upload.
+ *
+ * Pasted screenshots and dropped photos are often several megabytes of PNG
+ * at a resolution the agent never looks at. Decoding, scaling and
+ * re-encoding happen here so the main thread keeps rendering the terminal
+ * while a large image is prepared:
+ *   - createImageBitmap decodes the file off the main thread
+ *   - the longest edge is scaled down to maxDimension (never up)
+ *   - OffscreenCanvas re-encodes as WebP, or as JPEG where WebP encoding
+ *     is unsupported and the source format has no transparency
+ *
+ * The original file is kept when the browser lacks OffscreenCanvas, when
+ * decoding fails (SVG, HEIC, ...), or when re-encoding would not make the
+ * upload smaller.
+ *
+ * Message protocol (main → worker):
+ *   { id, file, maxDimension, quality }
+ *
+ * Message protocol (worker → main):
+ *   { id, blob, width, height, originalWidth, originalHeight }
+ *     blob is null when the original file should be uploaded unchanged
+ */
+
+/* eslint-env worker */
+"use strict";
+
+// Formats that can carry transparency; JPEG would flatten them to black
+const ALPHA_TYPES = new Set(["image/png", "image/gif", "image/webp", "image/avif"]);
+
+async function encode(canvas, type, quality) {
+  const blob = await canvas.convertToBlob({ type, quality });
+  // Browsers that can't encode a type silently fall back to PNG
+  return blob.type === type ? blob : null;
+}
+
+async function shrink(file, maxDimension, quality) {
+  if (typeof OffscreenCanvas === "undefined" || typeof createImageBitmap === "undefined") {
+    return { blob: null };
+  }
+  let bitmap;
+  try {
+    bitmap = await createImageBitmap(file);
+  } catch (e) {
+    return { blob: null };
+  }
+  const originalWidth = bitmap.width;
+  const originalHeight = bitmap.height;
+  const longest = Math.max(originalWidth, originalHeight);
+  const scale = maxDimension > 0 && longest > maxDimension ? maxDimension / longest : 1;
+  const width = Math.max(1, Math.round(originalWidth * scale));
+  const height = Math.max(1, Math.round(originalHeight * scale));
+
+  try {
+    const canvas = new OffscreenCanvas(width, height);
+    const ctx = canvas.getContext("2d");
+    ctx.imageSmoothingQuality = "high";
+    ctx.drawImage(bitmap, 0, 0, width, height);
+
+    let blob = await encode(canvas, "image/webp", quality);
+    if (!blob && !ALPHA_TYPES.has(file.type)) blob = await encode(canvas, "image/jpeg", quality);
+    if (!blob && scale < 1) blob = await encode(canvas, "image/png");
+    if (!blob || blob.size >= file.size) return { blob: null, originalWidth, originalHeight };
+    return { blob, width, height, originalWidth, originalHeight };
+  } finally {
+    bitmap.close();
+  }
+}
+
+self.onmessage = async function (event) {
+  const { id, file, maxDimension, quality } = event.data;
+  let result;
+  try {
+    result = await shrink(file, maxDimension, quality);
+  } catch (e) {
+    result = { blob: null };
+  }
+  self.postMessage(Object.assign({ id }, result));
+};
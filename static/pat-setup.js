@@ -0,0 +1,91 @@
+/**
+ * pat-setup.js — Databricks PAT prompt, loaded only when no valid PAT is set.
+ *
+ * Kept off index.html's critical path: most page loads find a PAT already
+ * configured and never need it. Shares the page's globals.
+ */
+
+/* eslint-env browser */
+"use strict";
+
+// Collect a token in the terminal and configure it. Returns true once the
+// CLI is configured, false if the user gave up or the token was rejected.
+async function promptForPat(term, patData) {
+  // Show PAT setup prompt in the terminal
+  term.write('\x1b[2J\x1b[H');  // clear screen
+  term.write('\r\n');
+  term.write('\x1b[1;33m  Databricks CLI is not configured.\x1b[0m\r\n');
+  term.write('\r\n');
+  term.write('\x1b[37m  To allow the coding agent to act on your behalf,\x1b[0m\r\n');
+  term.write('\x1b[37m  create a short-lived token and paste it here.\x1b[0m\r\n');
+  term.write('\r\n');
+  const wsHost = patData.workspace_host || '';
+  const tokenUrl = wsHost ? wsHost + '#setting/account/token' : 'your Databricks workspace > User Settings > Access Tokens';
+  term.write('\x1b[90m  1. Open: \x1b[4;36m' + tokenUrl + '\x1b[0m\r\n');
+  term.write('\x1b[90m  2. Create a token with the shortest lifetime\x1b[0m\r\n');
+  term.write('\x1b[90m  3. Paste it below\x1b[0m\r\n');
+  term.write('\r\n');
+  term.write('\x1b[1;37m  Token: \x1b[0m');
+  term.focus();
+
+  // Collect token input from the terminal
+  let tokenInput = '';
+  await new Promise((resolve) => {
+    const disposable = term.onData(data => {
+      if (data === '\r' || data === '\n') {
+        term.write('\r\n');
+        disposable.dispose();
+        resolve();
+        return;
+      }
+      if (data === '\x7f' || data === '\b') {
+        if (tokenInput.length > 0) {
+          tokenInput = tokenInput.slice(0, -1);
+          term.write('\b \b');
+        }
+        return;
+      }
+      let chunk = data;
+      let submitAfter = false;
+      if (/[\r\n]$/.test(chunk)) {
+        chunk = chunk.replace(/[\r\n]+$/, '');
+        submitAfter = true;
+      }
+      const printable = Array.from(chunk).filter(c => c >= ' ');
+      if (printable.length) {
+        tokenInput += printable.join('');
+        term.write('*'.repeat(printable.length));
+      }
+      if (submitAfter) {
+        term.write('\r\n');
+        disposable.dispose();
+        resolve();
+      }
+    });
+  });
+
+  if (!tokenInput.trim()) {
+    term.write('\x1b[1;31m  No token provided. Reload to try again.\x1b[0m\r\n');
+    return false;
+  }
+
+  term.write('\x1b[90m  Validating token...\x1b[0m\r\n');
+
+  const configResp = await fetch('/api/configure-pat', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ token: tokenInput.trim() })
+  });
+  const configData = await configResp.json();
+
+  if (configData.error) {
+    term.write('\x1b[1;31m  Error: ' + configData.error + '\x1b[0m\r\n');
+    term.write('\x1b[90m  Reload to try again.\x1b[0m\r\n');
+    return false;
+  }
+
+  term.write('\x1b[1;32m  Token configured for ' + configData.user + '\x1b[0m\r\n');
+  term.write('\x1b[90m  Auto-rotation started. This token will be rotated out in 10 minutes.\x1b[0m\r\n');
+  term.write('\r\n');
+  return true;
+}
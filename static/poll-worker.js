@@ -1,41 +1,150 @@
 /**
- * poll-worker.js — Web Worker for terminal output polling and heartbeat.
+ * poll-worker.js — Web Worker that owns the terminal transport.
+ *
+ * All network and decode work for terminal output happens here, so the
+ * main thread only renders:
+ *   - Socket.IO (true WebSocket) when available, batch HTTP polling of
+ *     /api/output-batch otherwise
+ *   - JSON parsing, de-duplication by server output offset, and UTF-8
+ *     encoding of each pane's output into a Uint8Array that is
+ *     transferred (not copied) to the main thread
+ *   - The IndexedDB scrollback cache (scrollback-cache.js)
  *
  * Runs in a Web Worker so it is NOT throttled by the browser when the tab
  * is in the background. Uses batch polling to fetch output for all panes
  * in a single HTTP request.
  *
  * Message protocol (main → worker):
- *   { type: 'start_poll',        paneId, sessionId }
- *   { type: 'stop_poll',         paneId }
+ *   { type: 'attach',            paneId, sessionId }
+ *   { type: 'detach',            paneId }
+ *   { type: 'input',             sessionId, input }
+ *   { type: 'resize',            sessionId, cols, rows }
+ *   { type: 'focus',             sessionId }
+ *   { type: 'seen',              sessionId, offset }  (output up to offset is on screen)
  *   { type: 'visibility_change', hidden: bool }
+ *   { type: 'cache',             op, args }           (ScrollbackCache method call)
+ *   { type: 'cache_load',        requestId, sessionId }
  *
  * Message protocol (worker → main):
- *   { type: 'output',            paneId, data }
+ *   { type: 'output',            paneId, bytes, offset, altExit }  (bytes is transferred)
+ *   { type: 'timeout_warning',   paneId }
  *   { type: 'session_ended',     paneId, reason }
+ *   { type: 'shutting_down',     paneId }
  *   { type: 'connection_status', paneId, status, attempt, maxAttempts }
  *   { type: 'session_dead',      paneId }
+ *   { type: 'cache_loaded',      requestId, entry }
+ *   { type: 'cache_status',      available }
  */
 
 /* eslint-env worker */
+/* global io, ScrollbackCache */
 "use strict";
 
+importScripts("/static/lib/socket.io.min.js", "/static/scrollback-cache.js");
+
 // ── Constants ─────────────────────────────────────────────────────────────
-const POLL_INTERVAL_FG = 100;        // ms — foreground batch poll
+// Foreground batch polls adapt to activity: POLL_INTERVAL_MIN while output
+// is flowing or just after input, doubling once POLL_IDLE_GRACE polls in a
+// row come back empty, up to POLL_INTERVAL_MAX. The server's next_poll_ms
+// hint (which also sees input from other tabs) takes precedence when given.
+const POLL_INTERVAL_MIN = 100;       // ms
+const POLL_INTERVAL_MAX = 2000;      // ms — client-side idle ceiling
+const POLL_HINT_MAX = 10000;         // ms — longest server hint honored
+const POLL_IDLE_GRACE = 10;          // empty polls at the fast rate before backing off
+const INPUT_FAST_WINDOW_MS = 2000;   // poll fast this long after local input
 const HEARTBEAT_INTERVAL_BG = 30000; // ms — background heartbeat
+const WS_HEARTBEAT_INTERVAL = 30000; // 30s — well within 24-hour session timeout
 const RETRY_BASE_MS = 500;
 const RETRY_MULTIPLIER = 2;
 const RETRY_MAX_DELAY_MS = 10000;
 const RETRY_MAX_ATTEMPTS = 8;
 const SILENT_RETRY_THRESHOLD = 5;  // Don't show banner until this many consecutive failures
+const ALT_SCREEN_EXIT = "\x1b[?1049l";
 
 // ── Per-pane state ────────────────────────────────────────────────────────
 const panes = new Map();
 // Each entry: { sessionId }
 
+// Highest server output offset delivered per session. Output can reach us
+// twice (WebSocket room and HTTP poll, or attach delta and live stream);
+// anything at or below this offset has already been rendered.
+const seenOffsets = new Map();
+
+const encoder = new TextEncoder();
+
 let globalHidden = false;
 let batchTimerId = null;
 let retryCount = 0;
+let emptyPolls = 0;
+let lastInputAt = 0;
+let serverPollHint = null;   // next_poll_ms from the last batch response
+let nextPollAt = 0;
+let pollInFlight = false;
+let focusedSessionId = null;
+
+let socket = null;
+let wsConnected = false;
+let wsHeartbeatTimer = null;
+let httpChain = Promise.resolve();  // Keeps HTTP input/resize in order
+
+function attachedSessionIds() {
+  return Array.from(new Set(Array.from(panes.values(), (s) => s.sessionId)));
+}
+
+function panesFor(sessionId) {
+  const ids = [];
+  for (const [paneId, state] of panes) {
+    if (state.sessionId === sessionId) ids.push(paneId);
+  }
+  return ids;
+}
+
+// ── Output delivery ───────────────────────────────────────────────────────
+
+// Server offsets count code points; JS string indices count UTF-16 units
+function codePointLength(str) {
+  if (!/[\uD800-\uDFFF]/.test(str)) return str.length;
+  let n = 0;
+  for (const _ of str) n++;  // eslint-disable-line no-unused-vars
+  return n;
+}
+
+function codePointSlice(str, start) {
+  if (!/[\uD800-\uDFFF]/.test(str)) return str.slice(start);
+  return Array.from(str).slice(start).join("");
+}
+
+function deliver(sessionId, output, offset) {
+  if (!output) return;
+  if (typeof offset === "number") {
+    const seen = seenOffsets.get(sessionId);
+    if (seen !== undefined) {
+      if (offset <= seen) return;
+      // Partial overlap: keep only the part past what was already shown
+      if (offset - output.length < seen) {
+        const overlap = seen - (offset - codePointLength(output));
+        if (overlap > 0) output = codePointSlice(output, overlap);
+      }
+    }
+    seenOffsets.set(sessionId, offset);
+  }
+  ScrollbackCache.append(sessionId, output, offset);
+  const altExit = output.includes(ALT_SCREEN_EXIT);
+  for (const paneId of panesFor(sessionId)) {
+    const bytes = encoder.encode(output);
+    self.postMessage({ type: "output", paneId, bytes, offset, altExit }, [bytes.buffer]);
+  }
+}
+
+function endSession(sessionId, reason) {
+  for (const paneId of panesFor(sessionId)) {
+    self.postMessage({ type: "session_ended", paneId, reason });
+    panes.delete(paneId);
+  }
+  seenOffsets.delete(sessionId);
+  if (reason === "exited" || reason === "closed") ScrollbackCache.remove(sessionId);
+  if (panes.size === 0) clearBatchTimer();
+}
 
 // ── Retry helpers ─────────────────────────────────────────────────────────
 
@@ -47,21 +156,48 @@ function retryDelay(attempt) {
 
 // ── Batch polling logic ──────────────────────────────────────────────────
 
-async function batchPoll() {
-  if (panes.size === 0) return;
+function nextPollDelay() {
+  if (Date.now() - lastInputAt < INPUT_FAST_WINDOW_MS) return POLL_INTERVAL_MIN;
+  if (typeof serverPollHint === "number") {
+    return Math.min(POLL_HINT_MAX, Math.max(POLL_INTERVAL_MIN, serverPollHint));
+  }
+  const backoff = POLL_INTERVAL_MIN * Math.pow(2, Math.max(0, emptyPolls - POLL_IDLE_GRACE));
+  return Math.min(POLL_INTERVAL_MAX, backoff);
+}
 
-  const sessionIds = [];
-  const sidToPaneId = new Map();
-  for (const [paneId, state] of panes) {
-    sessionIds.push(state.sessionId);
-    sidToPaneId.set(state.sessionId, paneId);
+function schedulePoll(delay) {
+  clearBatchTimer();
+  nextPollAt = Date.now() + delay;
+  batchTimerId = setTimeout(pollTick, delay);
+}
+
+// One foreground poll, then schedule the next from what it found. A failed
+// poll hands scheduling to handleRetry instead.
+async function pollTick() {
+  batchTimerId = null;
+  pollInFlight = true;
+  const ok = await batchPoll();
+  pollInFlight = false;
+  if (ok && batchTimerId === null && panes.size > 0 && !wsConnected && !globalHidden) {
+    schedulePoll(nextPollDelay());
   }
+}
+
+// Local input: bring a slow idle poll forward so the echo shows promptly
+function pollSoon() {
+  lastInputAt = Date.now();
+  if (wsConnected || globalHidden || pollInFlight || batchTimerId === null || retryCount > 0) return;
+  if (nextPollAt - Date.now() > POLL_INTERVAL_MIN) schedulePoll(POLL_INTERVAL_MIN);
+}
+
+async function batchPoll() {
+  if (panes.size === 0) return false;
 
   try {
     const resp = await fetch("/api/output-batch", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ session_ids: sessionIds }),
+      body: JSON.stringify({ session_ids: attachedSessionIds() }),
     });
 
     if (!resp.ok) {
@@ -70,7 +206,7 @@ async function batchPoll() {
           self.postMessage({ type: "session_ended", paneId, reason: "auth_expired" });
         }
         stopAllPanes();
-        return;
+        return false;
       }
       throw new Error(`HTTP ${resp.status}`);
     }
@@ -85,39 +221,37 @@ async function batchPoll() {
       // Don't stopAllPanes() — retry with backoff so we
       // auto-recover when the new server comes up.
       handleRetry(new Error("Server shutting down"));
-      return;
+      return false;
     }
 
     // Distribute outputs to each pane
+    let gotOutput = false;
     for (const [sid, data] of Object.entries(result.outputs || {})) {
-      const paneId = sidToPaneId.get(sid);
-      if (!paneId) continue;
-
-      self.postMessage({ type: "output", paneId, data });
-
-      if (data.exited) {
-        self.postMessage({ type: "session_ended", paneId, reason: "exited" });
-        panes.delete(paneId);
+      if (data.timeout_warning) {
+        for (const paneId of panesFor(sid)) self.postMessage({ type: "timeout_warning", paneId });
       }
+      if (data.output) gotOutput = true;
+      deliver(sid, data.output, data.offset);
+      if (data.exited) endSession(sid, "exited");
     }
+    emptyPolls = gotOutput ? 0 : emptyPolls + 1;
+    serverPollHint = gotOutput ? POLL_INTERVAL_MIN
+      : (typeof result.next_poll_ms === "number" ? result.next_poll_ms : null);
+    return true;
   } catch (err) {
     handleRetry(err);
+    return false;
   }
 }
 
 async function batchHeartbeat() {
   if (panes.size === 0) return;
 
-  const sessionIds = [];
-  for (const state of panes.values()) {
-    sessionIds.push(state.sessionId);
-  }
-
   try {
     const resp = await fetch("/api/output-batch", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ session_ids: sessionIds }),
+      body: JSON.stringify({ session_ids: attachedSessionIds() }),
     });
 
     if (!resp.ok) {
@@ -133,18 +267,13 @@ async function batchHeartbeat() {
 
     retryCount = 0;
 
+    // The heartbeat drains the output buffer too, so deliver what it returns
     const result = await resp.json();
     for (const [sid, data] of Object.entries(result.outputs || {})) {
       if (data.timeout_warning) {
-        for (const [paneId, state] of panes) {
-          if (state.sessionId === sid) {
-            self.postMessage({
-              type: "output", paneId,
-              data: { timeout_warning: true, output: "", exited: false, shutting_down: false },
-            });
-          }
-        }
+        for (const paneId of panesFor(sid)) self.postMessage({ type: "timeout_warning", paneId });
       }
+      deliver(sid, data.output, data.offset);
     }
   } catch (err) {
     handleRetry(err);
@@ -207,14 +336,16 @@ function clearBatchTimer() {
 
 function startBatchTimer() {
   clearBatchTimer();
-  if (panes.size === 0) return;
+  // A true WebSocket pushes output and carries the heartbeat
+  if (panes.size === 0 || wsConnected) return;
 
   if (globalHidden) {
     batchHeartbeat();
     batchTimerId = setInterval(() => batchHeartbeat(), HEARTBEAT_INTERVAL_BG);
   } else {
-    batchPoll();
-    batchTimerId = setInterval(() => batchPoll(), POLL_INTERVAL_FG);
+    emptyPolls = 0;
+    serverPollHint = null;
+    pollTick();
   }
 }
 
@@ -223,25 +354,187 @@ function stopAllPanes() {
   panes.clear();
 }
 
+// ── WebSocket Connection (AC-10, AC-11, AC-14) ────────────────────────────
+
+function emitWsHeartbeat() {
+  const sids = attachedSessionIds();
+  if (sids.length > 0) {
+    socket.emit("heartbeat", { session_ids: sids, focused_session_id: focusedSessionId });
+  }
+}
+
+function useWebSocket() {
+  wsConnected = true;
+  // Only stop HTTP polling when we have a real WebSocket
+  clearBatchTimer();
+  if (!wsHeartbeatTimer) {
+    wsHeartbeatTimer = setInterval(emitWsHeartbeat, WS_HEARTBEAT_INTERVAL);
+  }
+}
+
+function useHttpPolling() {
+  wsConnected = false;
+  if (wsHeartbeatTimer) { clearInterval(wsHeartbeatTimer); wsHeartbeatTimer = null; }
+  startBatchTimer();
+}
+
+function initWebSocket() {
+  if (socket || typeof io === "undefined") {
+    console.log("[ws] Socket.IO client not available, using HTTP polling");
+    return;
+  }
+
+  socket = io({ transports: ["websocket", "polling"] });
+
+  socket.on("connect", () => {
+    // Check actual transport — Socket.IO reports connected=true even on long-polling
+    // through Databricks proxy. Only stop HTTP polling for true WebSocket.
+    const transport = socket.io.engine.transport.name;
+    console.log(`[ws] Connected (transport: ${transport})`);
+
+    // Always join rooms regardless of transport
+    for (const sid of attachedSessionIds()) {
+      socket.emit("join_session", { session_id: sid });
+    }
+
+    if (transport === "websocket") {
+      useWebSocket();
+    } else {
+      console.log("[ws] Connected via polling — keeping HTTP polling active");
+    }
+
+    // Listen for late upgrade from polling → websocket
+    socket.io.engine.on("upgrade", (upgraded) => {
+      console.log(`[ws] Transport upgraded to: ${upgraded.name}`);
+      if (upgraded.name === "websocket") useWebSocket();
+    });
+  });
+
+  socket.on("disconnect", (reason) => {
+    console.log("[ws] Disconnected:", reason);
+    useHttpPolling();
+  });
+
+  socket.on("connect_error", (err) => {
+    console.log("[ws] Connection error:", err.message);
+    useHttpPolling();
+  });
+
+  socket.on("terminal_output", (data) => deliver(data.session_id, data.output, data.offset));
+  socket.on("session_exited", (data) => endSession(data.session_id, "exited"));
+  socket.on("session_closed", (data) => endSession(data.session_id, "closed"));
+
+  // Server shutting down (SIGTERM) — show message before WS drops
+  socket.on("shutting_down", () => {
+    for (const paneId of panes.keys()) {
+      self.postMessage({ type: "shutting_down", paneId });
+    }
+  });
+}
+
+// ── Input / resize / focus ────────────────────────────────────────────────
+
+function postJson(url, body) {
+  httpChain = httpChain
+    .then(() => fetch(url, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(body),
+    }))
+    .catch(() => {});
+}
+
+function sendInput(sessionId, input) {
+  if (wsConnected) {
+    socket.emit("terminal_input", { session_id: sessionId, input: input });
+  } else {
+    postJson("/api/input", { session_id: sessionId, input: input });
+  }
+}
+
+function sendResize(sessionId, cols, rows) {
+  ScrollbackCache.setSize(sessionId, cols, rows);
+  if (wsConnected) {
+    socket.emit("terminal_resize", { session_id: sessionId, cols: cols, rows: rows });
+  } else {
+    postJson("/api/resize", { session_id: sessionId, cols: cols, rows: rows });
+  }
+}
+
+// Tell the server which session has focus so its process tree runs at
+// foreground priority (other sessions are deprioritized server-side)
+function reportFocus(sessionId) {
+  focusedSessionId = sessionId;
+  if (wsConnected) {
+    socket.emit("heartbeat", { session_ids: [sessionId], focused_session_id: sessionId });
+  } else {
+    postJson("/api/heartbeat", { session_id: sessionId, focused: true });
+  }
+}
+
 // ── Message handler ───────────────────────────────────────────────────────
 
 self.onmessage = function (event) {
   const msg = event.data;
 
   switch (msg.type) {
-    case "start_poll":
+    case "attach":
       panes.set(msg.paneId, { sessionId: msg.sessionId });
+      if (socket && socket.connected) socket.emit("join_session", { session_id: msg.sessionId });
       startBatchTimer();
       break;
 
-    case "stop_poll":
+    case "detach": {
+      const state = panes.get(msg.paneId);
       panes.delete(msg.paneId);
+      // Leave WebSocket room — session stays alive for reattach
+      if (state && socket && socket.connected && panesFor(state.sessionId).length === 0) {
+        socket.emit("leave_session", { session_id: state.sessionId });
+      }
       if (panes.size === 0) clearBatchTimer();
       break;
+    }
+
+    case "input":
+      sendInput(msg.sessionId, msg.input);
+      pollSoon();
+      break;
+
+    case "resize":
+      sendResize(msg.sessionId, msg.cols, msg.rows);
+      break;
+
+    case "focus":
+      reportFocus(msg.sessionId);
+      break;
+
+    case "seen":
+      if (typeof msg.offset === "number") {
+        seenOffsets.set(msg.sessionId, Math.max(msg.offset, seenOffsets.get(msg.sessionId) || 0));
+      }
+      break;
 
     case "visibility_change":
       globalHidden = msg.hidden;
+      if (globalHidden) ScrollbackCache.flush();
       startBatchTimer();
+      // Immediate WS heartbeat on tab hide/show — prevents reaping during background
+      if (wsConnected) emitWsHeartbeat();
+      break;
+
+    case "cache":
+      ScrollbackCache[msg.op](...msg.args);
+      break;
+
+    case "cache_load":
+      ScrollbackCache.load(msg.sessionId).then((entry) => {
+        self.postMessage({ type: "cache_loaded", requestId: msg.requestId, entry });
+      });
       break;
   }
 };
+
+ScrollbackCache.available().then((available) => {
+  self.postMessage({ type: "cache_status", available });
+});
+initWebSocket();
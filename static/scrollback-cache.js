@@ -0,0 +1,190 @@
+/**
+ * scrollback-cache.js — IndexedDB cache of each session's terminal output.
+ *
+ * Every chunk written to a pane is appended here together with the server's
+ * output offset for that chunk (see app.py _record_output). On reattach the
+ * cached output renders immediately, and /api/session/attach is asked only
+ * for the output produced after the cached offset.
+ *
+ * Appends are held in memory and flushed to IndexedDB at most once per
+ * FLUSH_DELAY_MS per session, so caching never sits on the output hot path.
+ * Each entry is capped at MAX_CHARS; trimming cuts at a line boundary so a
+ * replay doesn't start in the middle of an escape sequence.
+ *
+ * Loaded by the transport worker (poll-worker.js) with importScripts, so all
+ * cache writes come from one place; the main thread reaches it through
+ * worker messages. Exposes a single global, ScrollbackCache:
+ *   available()                     → Promise<bool>, false if IndexedDB is unusable
+ *   load(sessionId)                 → Promise<{ data, offset, cols, rows } | null>
+ *   append(sessionId, data, offset) — buffer output up to offset
+ *   replace(sessionId, data, offset)— reset an entry (after a full reattach)
+ *   setSize(sessionId, cols, rows)  — remember the geometry output was for
+ *   remove(sessionId)               — drop an entry (session ended)
+ *   prune(liveSessionIds)           — drop entries for sessions that are gone
+ *   flush()                         → Promise, write everything pending now
+ */
+
+/* eslint-env browser, worker */
+"use strict";
+
+(function (global) {
+  const DB_NAME = "coda-scrollback";
+  const STORE = "sessions";
+  const MAX_CHARS = 512 * 1024;
+  const FLUSH_DELAY_MS = 1000;
+
+  let dbPromise = null;
+  const pending = new Map();   // sessionId -> { entry, reset, base, timer }
+  let lastWrite = Promise.resolve();
+
+  function openDb() {
+    if (dbPromise) return dbPromise;
+    dbPromise = new Promise((resolve) => {
+      if (typeof indexedDB === "undefined") { resolve(null); return; }
+      let req;
+      try {
+        req = indexedDB.open(DB_NAME, 1);
+      } catch (e) {
+        resolve(null);  // Private mode / storage disabled
+        return;
+      }
+      req.onupgradeneeded = () => {
+        req.result.createObjectStore(STORE, { keyPath: "sessionId" });
+      };
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => resolve(null);
+      req.onblocked = () => resolve(null);
+    });
+    return dbPromise;
+  }
+
+  function request(mode, fn) {
+    return openDb().then((db) => new Promise((resolve) => {
+      if (!db) { resolve(null); return; }
+      try {
+        const tx = db.transaction(STORE, mode);
+        const req = fn(tx.objectStore(STORE));
+        tx.oncomplete = () => resolve(req ? req.result : null);
+        tx.onerror = () => resolve(null);
+        tx.onabort = () => resolve(null);
+      } catch (e) {
+        resolve(null);
+      }
+    }));
+  }
+
+  function trim(data) {
+    if (data.length <= MAX_CHARS) return data;
+    const cut = data.length - MAX_CHARS;
+    const nl = data.indexOf("\n", cut);
+    return nl === -1 ? data.slice(cut) : data.slice(nl + 1);
+  }
+
+  // Stored entry + pending appends → the entry as it will be after a flush
+  function merge(stored, p) {
+    if (p.reset || !stored) return Object.assign({}, p.entry, { data: trim(p.entry.data) });
+    return Object.assign({}, stored, {
+      data: trim(stored.data + p.entry.data),
+      offset: p.entry.offset !== null ? p.entry.offset : stored.offset,
+      cols: p.entry.cols || stored.cols,
+      rows: p.entry.rows || stored.rows,
+    });
+  }
+
+  function writeEntry(entry) {
+    entry.updatedAt = Date.now();
+    return request("readwrite", (store) => store.put(entry));
+  }
+
+  function scheduleFlush(sessionId) {
+    const p = pending.get(sessionId);
+    if (!p || p.timer) return;
+    p.timer = setTimeout(() => flushOne(sessionId), FLUSH_DELAY_MS);
+  }
+
+  function flushOne(sessionId) {
+    const p = pending.get(sessionId);
+    if (!p) return Promise.resolve();
+    pending.delete(sessionId);
+    clearTimeout(p.timer);
+    lastWrite = p.base.then((stored) => writeEntry(merge(stored, p)));
+    return lastWrite;
+  }
+
+  function pendingFor(sessionId, reset) {
+    let p = pending.get(sessionId);
+    if (!p || reset) {
+      if (p) clearTimeout(p.timer);
+      p = {
+        entry: { sessionId, data: "", offset: null, cols: 0, rows: 0 },
+        reset: !!reset,
+        // Read the stored entry once per flush window, not once per chunk —
+        // after any in-flight write, so appends never build on a stale copy
+        base: reset ? Promise.resolve(null) : lastWrite.then(() => load(sessionId, true)),
+        timer: null,
+      };
+      pending.set(sessionId, p);
+    }
+    return p;
+  }
+
+  function load(sessionId, storedOnly) {
+    if (storedOnly) return request("readonly", (store) => store.get(sessionId));
+    const write = lastWrite;
+    return write.then(() => request("readonly", (store) => store.get(sessionId))).then((entry) => {
+      // A flush that started mid-read moved pending data into a write we
+      // may not have seen — read again rather than return a gap
+      if (write !== lastWrite) return load(sessionId, false);
+      const p = pending.get(sessionId);
+      const merged = p ? merge(entry, p) : entry;
+      return merged && typeof merged.offset === "number" ? merged : null;
+    });
+  }
+
+  global.ScrollbackCache = {
+    available: () => openDb().then((db) => !!db),
+
+    load: (sessionId) => load(sessionId, false),
+
+    append(sessionId, data, offset) {
+      if (!sessionId || !data || typeof offset !== "number") return;
+      const p = pendingFor(sessionId, false);
+      p.entry.data = trim(p.entry.data + data);
+      p.entry.offset = offset;
+      scheduleFlush(sessionId);
+    },
+
+    replace(sessionId, data, offset) {
+      if (!sessionId || typeof offset !== "number") return;
+      const p = pendingFor(sessionId, true);
+      p.entry.data = trim(data || "");
+      p.entry.offset = offset;
+      scheduleFlush(sessionId);
+    },
+
+    setSize(sessionId, cols, rows) {
+      if (!sessionId) return;
+      const p = pendingFor(sessionId, false);
+      p.entry.cols = cols;
+      p.entry.rows = rows;
+      scheduleFlush(sessionId);
+    },
+
+    remove(sessionId) {
+      const p = pending.get(sessionId);
+      if (p) { clearTimeout(p.timer); pending.delete(sessionId); }
+      return request("readwrite", (store) => store.delete(sessionId));
+    },
+
+    prune(liveSessionIds) {
+      const live = new Set(liveSessionIds);
+      return request("readonly", (store) => store.getAllKeys()).then((keys) => {
+        (keys || []).filter((k) => !live.has(k)).forEach((k) => global.ScrollbackCache.remove(k));
+      });
+    },
+
+    flush() {
+      return Promise.all(Array.from(pending.keys()).map(flushOne));
+    },
+  };
+})(self);
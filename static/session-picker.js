@@ -0,0 +1,176 @@
+/**
+ * session-picker.js — terminal UIs for choosing between existing sessions.
+ *
+ * Loaded on demand (see loadScript in index.html): the first time a pane
+ * finds existing sessions to offer, or when the session manager
+ * (Ctrl+Shift+S) is opened. Shares the page's globals.
+ */
+
+/* eslint-env browser */
+"use strict";
+
+// ── Session Picker Helpers ──────────────────────────────────────
+async function showSessionPicker(term, sessions) {
+  // Returns { sid, reattached }
+  return new Promise((resolve) => {
+    let pendingDelete = false;  // guard against double-input during async kill
+
+    function renderPicker() {
+      term.write('\x1b[2J\x1b[H');  // clear
+      term.write('\r\n');
+      term.write('\x1b[1;36m  Existing sessions:\x1b[0m\r\n\r\n');
+
+      const attachedIds = new Set(getAllPanes().map(p => p.sessionId).filter(Boolean));
+      sessions.forEach((s, i) => {
+        const name = (s.label || s.process || 'bash').padEnd(14);
+        const proc = s.label ? ' \x1b[90m[' + (s.process || 'bash') + ']\x1b[0m' : '';
+        const ago = _formatAge(s.created_at);
+        const idle = s.idle_seconds > 60 ? ', idle ' + _formatDuration(s.idle_seconds) : '';
+        const open = attachedIds.has(s.session_id) ? ' \x1b[1;33m(open)\x1b[0m' : '';
+        const asleep = s.hibernated ? ' \x1b[36m(hibernated)\x1b[0m' : '';
+        term.write('  \x1b[1;32m' + (i + 1) + '\x1b[0m  ');
+        term.write('\x1b[1;37m' + name + '\x1b[0m');
+        term.write('\x1b[90m(' + ago + idle + ')\x1b[0m' + proc + open + asleep + '\r\n');
+      });
+
+      term.write('\r\n  \x1b[1;33mn\x1b[0m  New session\r\n');
+      term.write('  \x1b[1;31md\x1b[0m\x1b[1;31mN\x1b[0m Kill session N (e.g. d2)\r\n');
+      term.write('  \x1b[1;31mx\x1b[0m  Kill all and start fresh\r\n');
+      term.write('  \x1b[90mq\x1b[0m  Cancel\r\n');
+      term.write('\r\n\x1b[90m  Select:\x1b[0m ');
+    }
+
+    renderPicker();
+
+    let dPrefix = false;  // waiting for number after 'd'
+
+    const disposable = term.onData(data => {
+      if (pendingDelete) return;
+
+      if (dPrefix) {
+        // Expecting a number after 'd'
+        dPrefix = false;
+        const num = parseInt(data);
+        if (num >= 1 && num <= sessions.length) {
+          pendingDelete = true;
+          term.write(data + '\r\n\x1b[90m  Killing session...\x1b[0m');
+          fetch('/api/session/close', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ session_id: sessions[num - 1].session_id })
+          }).then(() => {
+            sessions.splice(num - 1, 1);
+            pendingDelete = false;
+            updateSessionBadge();
+            if (sessions.length === 0) {
+              disposable.dispose();
+              createSession().then(sid => resolve({ sid, reattached: false }));
+            } else if (sessions.length === 1) {
+              disposable.dispose();
+              _doAttach(term, sessions[0].session_id).then(sid => resolve({ sid, reattached: true }));
+            } else {
+              renderPicker();
+            }
+          });
+        }
+        return;
+      }
+
+      const num = parseInt(data);
+      if (num >= 1 && num <= sessions.length) {
+        const picked = sessions[num - 1];
+        const openPanes = getAllPanes().filter(p => p.sessionId === picked.session_id);
+        if (openPanes.length > 0) {
+          term.write(data + '\r\n\x1b[1;33m  Already open in another pane.\x1b[0m\r\n');
+          setTimeout(renderPicker, 800);
+          return;
+        }
+        disposable.dispose();
+        _doAttach(term, picked.session_id).then(sid => resolve({ sid, reattached: true }));
+      } else if (data === 'd' || data === 'D') {
+        dPrefix = true;
+        term.write('d');
+      } else if (data === 'n' || data === 'N') {
+        disposable.dispose();
+        term.write('\r\n');
+        createSession().then(sid => resolve({ sid, reattached: false }));
+      } else if (data === 'x' || data === 'X') {
+        disposable.dispose();
+        term.write('\r\n\x1b[90m  Closing all sessions...\x1b[0m\r\n');
+        Promise.all(sessions.map(s =>
+          fetch('/api/session/close', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ session_id: s.session_id })
+          })
+        )).then(() => { updateSessionBadge(); return createSession().then(sid => resolve({ sid, reattached: false })); });
+      } else if (data === 'q' || data === 'Q' || data === '\x1b') {
+        disposable.dispose();
+        resolve({ sid: null, reattached: false, cancelled: true });
+      }
+    });
+  });
+}
+
+function _formatAge(timestamp) {
+  const seconds = Math.floor((Date.now() / 1000) - timestamp);
+  if (seconds < 60) return 'just now';
+  if (seconds < 3600) return Math.floor(seconds / 60) + 'm ago';
+  return Math.floor(seconds / 3600) + 'h ago';
+}
+
+function _formatDuration(seconds) {
+  if (seconds < 60) return seconds + 's';
+  if (seconds < 3600) return Math.floor(seconds / 60) + 'm';
+  return Math.floor(seconds / 3600) + 'h';
+}
+
+// ── Session Creation Prompt ───────────────────────────────────
+async function promptExistingSessions(term, sessions) {
+  // Lightweight prompt shown before creating a new session when others exist.
+  // Returns { action: 'reuse', sessionId } or { action: 'new' }
+  return new Promise((resolve) => {
+    term.write('\x1b[2J\x1b[H');  // clear
+    term.write('\r\n');
+    const n = sessions.length;
+    term.write('\x1b[1;36m  You have ' + n + ' active session' + (n > 1 ? 's' : '') + ':\x1b[0m\r\n\r\n');
+
+    const attachedIds = new Set(getAllPanes().map(p => p.sessionId).filter(Boolean));
+    sessions.forEach((s, i) => {
+      const name = (s.label || s.process || 'bash').padEnd(14);
+      const proc = s.label ? ' \x1b[90m[' + (s.process || 'bash') + ']\x1b[0m' : '';
+      const ago = _formatAge(s.created_at);
+      const idle = s.idle_seconds > 60 ? ', idle ' + _formatDuration(s.idle_seconds) : '';
+      const open = attachedIds.has(s.session_id) ? ' \x1b[1;33m(open)\x1b[0m' : '';
+      const asleep = s.hibernated ? ' \x1b[36m(hibernated)\x1b[0m' : '';
+      term.write('  \x1b[1;32m' + (i + 1) + '\x1b[0m  ');
+      term.write('\x1b[1;37m' + name + '\x1b[0m');
+      term.write('\x1b[90m(' + ago + idle + ')\x1b[0m' + proc + open + asleep + '\r\n');
+    });
+
+    term.write('\r\n  \x1b[1;33mn\x1b[0m  New session\r\n');
+    term.write('\r\n\x1b[90m  Select:\x1b[0m ');
+
+    const disposable = term.onData(data => {
+      const num = parseInt(data);
+      if (num >= 1 && num <= sessions.length) {
+        const picked = sessions[num - 1];
+        const openPanes = getAllPanes().filter(p => p.sessionId === picked.session_id);
+        if (openPanes.length > 0) {
+          term.write(data + '\r\n\x1b[1;33m  Already open in another pane. Pick another:\x1b[0m ');
+          return;
+        }
+        disposable.dispose();
+        resolve({ action: 'reuse', sessionId: picked.session_id });
+      } else if (data === 'n' || data === 'N') {
+        disposable.dispose();
+        term.write('\r\n');
+        resolve({ action: 'new' });
+      } else if (data === 'q' || data === 'Q' || data === '\x1b') {
+        disposable.dispose();
+        term.write('\r\n');
+        resolve({ action: 'new' });  // default to new session on cancel
+      }
+    });
+  });
+}
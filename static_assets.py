@@ -0,0 +1,193 @@
+"""Static asset serving: content-hashed URLs, precompression, HTTP caching.
+
+Every file under ``static/`` is loaded once (on first request) into an
+in-memory manifest:
+
+- References to other static files inside HTML/JS/CSS (``/static/lib/xterm.js``)
+  are rewritten to content-hashed URLs (``/static/lib/xterm.js?v=<hash>``).
+  A file's hash covers its rewritten body, so a change anywhere down the
+  chain (xterm.js → index.html) changes every URL that leads to it.
+- Text assets are gzip-compressed (and brotli-compressed when the optional
+  ``brotli`` package is installed) once, not per request.
+
+Requests carrying the current ``?v=`` hash get ``Cache-Control: immutable``
+for a year, so warm page loads don't touch the network for them. Everything
+else — ``index.html`` itself, or an outdated hash — is served ``no-cache``
+with a strong ETag, so the browser revalidates and gets a 304.
+
+The manifest is rebuilt when any file's mtime changes (checked at most every
+``STALE_CHECK_SECONDS``), so edits show up without a restart.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from flask import Response, request
+from werkzeug.utils import get_content_type
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+URL_PREFIX = "/static/"
+
+HASH_LENGTH = 12
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+STALE_CHECK_SECONDS = 2
+MIN_COMPRESS_BYTES = 512
+
+# Assets whose bodies may reference other assets (and get compressed)
+_TEXT_EXTENSIONS = (".html", ".js", ".css", ".svg")
+_REF_PATTERN = re.compile(r"/static/([\w./-]+\.(?:js|css|svg|png|ico))")
+
+_manifest = {}          # relative path -> asset dict
+_manifest_mtimes = {}   # relative path -> mtime the manifest was built from
+_manifest_checked = 0.0
+_manifest_lock = threading.Lock()
+
+
+def _scan_mtimes(static_dir):
+    mtimes = {}
+    for root, _dirs, files in os.walk(static_dir):
+        for name in files:
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, static_dir).replace(os.sep, "/")
+            try:
+                mtimes[rel] = os.stat(full).st_mtime
+            except OSError:
+                pass
+    return mtimes
+
+
+def _compress(body):
+    """Return {encoding: bytes} for the encodings worth sending."""
+    variants = {}
+    if len(body) < MIN_COMPRESS_BYTES:
+        return variants
+    gz = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(gz) < len(body):
+        variants["gzip"] = gz
+    if brotli is not None:
+        br = brotli.compress(body, quality=11)
+        if len(br) < len(body):
+            variants["br"] = br
+    return variants
+
+
+def build_manifest(static_dir=STATIC_DIR):
+    """Load, rewrite, hash and compress every file under *static_dir*."""
+    paths = sorted(_scan_mtimes(static_dir))
+    known = set(paths)
+    manifest = {}
+    visiting = set()
+
+    def build(rel):
+        if rel in manifest:
+            return manifest[rel]
+        visiting.add(rel)
+        with open(os.path.join(static_dir, rel), "rb") as f:
+            body = f.read()
+        if rel.endswith(_TEXT_EXTENSIONS):
+            text = body.decode("utf-8")
+
+            def hashed(match):
+                ref = match.group(1)
+                if ref not in known or ref in visiting:
+                    return match.group(0)
+                return asset_url(ref, build(ref))
+
+            text = _REF_PATTERN.sub(hashed, text)
+            body = text.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        mimetype = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+        asset = {
+            "body": body,
+            "hash": digest,
+            "content_type": get_content_type(mimetype, "utf-8"),
+            "encodings": _compress(body) if rel.endswith(_TEXT_EXTENSIONS) else {},
+        }
+        visiting.discard(rel)
+        manifest[rel] = asset
+        return asset
+
+    for rel in paths:
+        build(rel)
+    return manifest
+
+
+def asset_url(rel, asset):
+    return f"{URL_PREFIX}{rel}?v={asset['hash']}"
+
+
+def get_manifest():
+    """Return the current manifest, rebuilding it if any file changed."""
+    global _manifest, _manifest_mtimes, _manifest_checked
+    with _manifest_lock:
+        now = time.time()
+        if _manifest and now - _manifest_checked < STALE_CHECK_SECONDS:
+            return _manifest
+        _manifest_checked = now
+        mtimes = _scan_mtimes(STATIC_DIR)
+        if mtimes != _manifest_mtimes:
+            started = time.time()
+            _manifest = build_manifest(STATIC_DIR)
+            _manifest_mtimes = mtimes
+            compressed = sum(1 for a in _manifest.values() if a["encodings"])
+            logger.info(f"Static manifest built: {len(_manifest)} assets, "
+                        f"{compressed} precompressed, brotli={'on' if brotli else 'off'} "
+                        f"({(time.time() - started) * 1000:.0f}ms)")
+        return _manifest
+
+
+def _accepted_encodings():
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+def serve_asset(rel):
+    """Serve static/*rel* with compression, ETag/304 and cache headers."""
+    asset = get_manifest().get(rel)
+    if asset is None:
+        return Response("Not Found", status=404, mimetype="text/plain")
+
+    accepted = _accepted_encodings()
+    encoding = None
+    for candidate in ("br", "gzip"):
+        if candidate in asset["encodings"] and candidate in accepted:
+            encoding = candidate
+            break
+
+    etag = f'"{asset["hash"]}-{encoding}"' if encoding else f'"{asset["hash"]}"'
+    if request.args.get("v") == asset["hash"]:
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        cache_control = REVALIDATE_CACHE_CONTROL
+
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        response = Response(status=304)
+    else:
+        body = asset["encodings"][encoding] if encoding else asset["body"]
+        response = Response(body, content_type=asset["content_type"])
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
@@ -0,0 +1,127 @@
+"""Tests for activity-driven HTTP poll cadence.
+
+Verifies that:
+- /api/output-batch suggests fast polls while a session is active and
+  backs off exponentially (capped) as it goes quiet
+- Input over HTTP and WebSocket counts as activity
+- poll-worker.js schedules polls from activity and the server hint instead
+  of a fixed interval
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from unittest import mock
+
+import pytest
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+def _add_session(app_module, session_id, **extra):
+    session = {
+        "master_fd": os.open(os.devnull, os.O_WRONLY),
+        "pid": 12345,
+        "output_buffer": deque(maxlen=1000),
+        "lock": threading.Lock(),
+        "last_poll_time": time.time(),
+        "created_at": time.time(),
+        **extra,
+    }
+    with app_module.sessions_lock:
+        app_module.sessions[session_id] = session
+    return session
+
+
+def _remove_session(app_module, session_id):
+    with app_module.sessions_lock:
+        session = app_module.sessions.pop(session_id, None)
+    if session:
+        os.close(session["master_fd"])
+
+
+# ---------------------------------------------------------------------------
+# 1. Server hint
+# ---------------------------------------------------------------------------
+
+class TestNextPollHint:
+
+    def test_backoff_curve(self):
+        app_module = _get_app()
+        assert app_module._next_poll_ms(0) == app_module.POLL_INTERVAL_MIN_MS
+        assert app_module._next_poll_ms(1.9) == app_module.POLL_INTERVAL_MIN_MS
+        assert app_module._next_poll_ms(2) == app_module.POLL_INTERVAL_MIN_MS * 2
+        assert app_module._next_poll_ms(6) == app_module.POLL_INTERVAL_MIN_MS * 8
+        assert app_module._next_poll_ms(3600) == app_module.POLL_INTERVAL_MAX_MS
+        assert app_module._next_poll_ms(10 ** 9) == app_module.POLL_INTERVAL_MAX_MS
+
+    def test_batch_hint_follows_most_active_session(self):
+        app_module = _get_app()
+        now = time.time()
+        _add_session(app_module, "quiet-1", last_output_time=now - 3600)
+        _add_session(app_module, "busy-1", last_output_time=now)
+        try:
+            client = app_module.app.test_client()
+            quiet = client.post("/api/output-batch", json={"session_ids": ["quiet-1"]}).get_json()
+            both = client.post("/api/output-batch",
+                               json={"session_ids": ["quiet-1", "busy-1"]}).get_json()
+        finally:
+            _remove_session(app_module, "quiet-1")
+            _remove_session(app_module, "busy-1")
+        assert quiet["next_poll_ms"] == app_module.POLL_INTERVAL_MAX_MS
+        assert both["next_poll_ms"] == app_module.POLL_INTERVAL_MIN_MS
+
+    def test_http_input_resets_hint(self):
+        app_module = _get_app()
+        _add_session(app_module, "typing-1", last_output_time=time.time() - 3600)
+        try:
+            client = app_module.app.test_client()
+            with mock.patch.object(app_module, "_set_focused_session"):
+                client.post("/api/input", json={"session_id": "typing-1", "input": "l"})
+            body = client.post("/api/output-batch", json={"session_ids": ["typing-1"]}).get_json()
+        finally:
+            _remove_session(app_module, "typing-1")
+        assert body["next_poll_ms"] == app_module.POLL_INTERVAL_MIN_MS
+
+    def test_websocket_input_recorded(self):
+        app_module = _get_app()
+        session = _add_session(app_module, "ws-typing-1")
+        try:
+            with mock.patch.object(app_module, "_set_focused_session"):
+                app_module.handle_terminal_input({"session_id": "ws-typing-1", "input": "l"})
+        finally:
+            _remove_session(app_module, "ws-typing-1")
+        assert session["last_input_time"] == pytest.approx(time.time(), abs=1)
+
+
+# ---------------------------------------------------------------------------
+# 2. Worker scheduling
+# ---------------------------------------------------------------------------
+
+class TestWorkerCadence:
+
+    @pytest.fixture(autouse=True)
+    def _load(self):
+        path = os.path.join(os.path.dirname(__file__), "..", "static", "poll-worker.js")
+        with open(path) as f:
+            self.worker = f.read()
+
+    def test_no_fixed_interval_poll(self):
+        assert "POLL_INTERVAL_FG" not in self.worker
+        assert "setInterval(() => batchPoll()" not in self.worker
+        assert "setTimeout(pollTick, delay)" in self.worker
+
+    def test_honors_server_hint(self):
+        assert "result.next_poll_ms" in self.worker
+        assert "Math.min(POLL_HINT_MAX, Math.max(POLL_INTERVAL_MIN, serverPollHint))" in self.worker
+
+    def test_input_pulls_poll_forward(self):
+        assert "pollSoon();" in self.worker
+        assert "Math.pow(2, Math.max(0, emptyPolls - POLL_IDLE_GRACE))" in self.worker
@@ -0,0 +1,195 @@
+"""Tests for resumable chunked uploads (/api/upload/init, PUT chunk, commit).
+
+Verifies that:
+- Chunks stream into a preallocated partial file at their offsets, in any order
+- Status reports received ranges so a client can resume
+- A restarted server picks partial uploads back up from their sidecar
+- Commit verifies the whole-file checksum; chunk checksums are checked on arrival
+- Commit is refused while a chunk is still being written
+"""
+
+import hashlib
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+@pytest.fixture
+def client(tmp_path):
+    app_module = _get_app()
+    with mock.patch.dict(os.environ, {"HOME": str(tmp_path)}):
+        yield app_module.app.test_client()
+
+
+def _init(client, payload, **extra):
+    body = {"filename": "data.csv", "size": len(payload), **extra}
+    resp = client.post("/api/upload/init", json=body)
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def _put(client, upload_id, payload, start, end, **headers):
+    return client.put(f"/api/upload/{upload_id}?offset={start}", data=payload[start:end],
+                      content_type="application/octet-stream", headers=headers)
+
+
+# ---------------------------------------------------------------------------
+# 1. Happy path
+# ---------------------------------------------------------------------------
+
+class TestChunkedUpload:
+
+    def test_out_of_order_chunks_commit(self, client, tmp_path):
+        payload = os.urandom(3000)
+        status = _init(client, payload, sha256=hashlib.sha256(payload).hexdigest())
+        uid = status["upload_id"]
+        assert status["received"] == 0 and status["chunk_size"] > 0
+
+        for start, end in [(2000, 3000), (0, 1000), (1000, 2000)]:
+            assert _put(client, uid, payload, start, end).status_code == 200
+
+        resp = client.post(f"/api/upload/{uid}/commit", json={})
+        assert resp.status_code == 200
+        result = resp.get_json()
+        assert result["sha256"] == hashlib.sha256(payload).hexdigest()
+        assert os.path.dirname(result["path"]) == str(tmp_path / "uploads")
+        assert result["path"].endswith("_data.csv")
+        with open(result["path"], "rb") as f:
+            assert f.read() == payload
+        assert os.listdir(tmp_path / "uploads" / ".partial") == []
+
+    def test_status_reports_merged_ranges(self, client):
+        payload = b"x" * 300
+        uid = _init(client, payload)["upload_id"]
+        _put(client, uid, payload, 0, 100)
+        _put(client, uid, payload, 200, 300)
+        status = client.get(f"/api/upload/{uid}").get_json()
+        assert status["ranges"] == [[0, 100], [200, 300]]
+        assert status["complete"] is False
+
+        _put(client, uid, payload, 100, 200)
+        status = client.get(f"/api/upload/{uid}").get_json()
+        assert status["ranges"] == [[0, 300]]
+        assert status["complete"] is True
+
+    def test_resumes_after_server_restart(self, client):
+        import uploads
+        payload = b"abcdef" * 100
+        uid = _init(client, payload)["upload_id"]
+        _put(client, uid, payload, 0, 300)
+        uploads._uploads.clear()  # Forget in-memory state, as a restart would
+
+        status = client.get(f"/api/upload/{uid}").get_json()
+        assert status["ranges"] == [[0, 300]]
+        _put(client, uid, payload, 300, 600)
+        result = client.post(f"/api/upload/{uid}/commit", json={}).get_json()
+        with open(result["path"], "rb") as f:
+            assert f.read() == payload
+
+
+# ---------------------------------------------------------------------------
+# 2. Validation
+# ---------------------------------------------------------------------------
+
+class TestChunkedUploadValidation:
+
+    def test_commit_incomplete_rejected(self, client):
+        payload = b"y" * 100
+        uid = _init(client, payload)["upload_id"]
+        _put(client, uid, payload, 0, 50)
+        resp = client.post(f"/api/upload/{uid}/commit", json={})
+        assert resp.status_code == 409
+
+    def test_whole_file_checksum_mismatch(self, client):
+        payload = b"z" * 100
+        uid = _init(client, payload, sha256="0" * 64)["upload_id"]
+        _put(client, uid, payload, 0, 100)
+        resp = client.post(f"/api/upload/{uid}/commit", json={})
+        assert resp.status_code == 422
+        assert client.get(f"/api/upload/{uid}").status_code == 404
+
+    def test_chunk_checksum_mismatch_not_recorded(self, client):
+        payload = b"q" * 100
+        uid = _init(client, payload)["upload_id"]
+        resp = _put(client, uid, payload, 0, 100, **{"X-Chunk-SHA256": "f" * 64})
+        assert resp.status_code == 422
+        assert client.get(f"/api/upload/{uid}").get_json()["received"] == 0
+
+        good = hashlib.sha256(payload).hexdigest()
+        assert _put(client, uid, payload, 0, 100, **{"X-Chunk-SHA256": good}).status_code == 200
+
+    def test_commit_waits_for_chunk_in_flight(self, client):
+        import uploads
+        payload = b"r" * 100
+        uid = _init(client, payload)["upload_id"]
+        _put(client, uid, payload, 0, 100)
+
+        reading = threading.Event()
+        release = threading.Event()
+
+        class _SlowStream:
+            def read(self, size):
+                reading.set()
+                release.wait(5)
+                return payload[:size]
+
+        # A retried chunk still being written when the client commits
+        writer = threading.Thread(target=uploads.append_chunk, args=(uid, 0, _SlowStream(), 100))
+        writer.start()
+        try:
+            assert reading.wait(5)
+            assert client.post(f"/api/upload/{uid}/commit", json={}).status_code == 409
+        finally:
+            release.set()
+            writer.join(5)
+        assert client.post(f"/api/upload/{uid}/commit", json={}).status_code == 200
+
+    def test_chunk_past_declared_size(self, client):
+        payload = b"w" * 100
+        uid = _init(client, b"w" * 50)["upload_id"]
+        assert _put(client, uid, payload, 0, 100).status_code == 416
+
+    def test_unknown_and_malformed_ids(self, client):
+        assert client.get("/api/upload/" + "a" * 32).status_code == 404
+        assert client.get("/api/upload/..%2F..%2Fetc").status_code == 404
+
+    def test_oversize_rejected(self, client):
+        import uploads
+        resp = client.post("/api/upload/init",
+                           json={"filename": "big.bin", "size": uploads.UPLOAD_MAX_BYTES + 1})
+        assert resp.status_code == 413
+
+    def test_stale_partials_expired(self, client, tmp_path):
+        import uploads
+        uid = _init(client, b"s" * 10)["upload_id"]
+        uploads.expire_stale_uploads(now=os.path.getmtime(
+            tmp_path / "uploads" / ".partial" / uid) + uploads.UPLOAD_EXPIRY_SECONDS + 1)
+        assert client.get(f"/api/upload/{uid}").status_code == 404
+
+
+# ---------------------------------------------------------------------------
+# 3. Frontend
+# ---------------------------------------------------------------------------
+
+class TestChunkedUploadFrontend:
+
+    def test_drop_uses_chunked_upload_for_other_files(self):
+        static = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+        with open(os.path.join(static, "index.html")) as f:
+            html = f.read()
+        with open(os.path.join(static, "chunked-upload.js")) as f:
+            js = f.read()
+        assert "await loadScript('/static/chunked-upload.js')" in html
+        assert "uploadFileChunked(file" in html
+        assert "PARALLEL_CHUNKS" in js and "X-Chunk-SHA256" in js
+        assert "localStorage.setItem(key, status.upload_id)" in js
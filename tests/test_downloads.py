@@ -0,0 +1,139 @@
+"""Tests for /api/download — files from ~/projects and ~/uploads.
+
+Verifies that:
+- Only regular files inside ~/projects and ~/uploads are served
+- ?inline=1 never displays HTML, SVG or XML on the app's origin
+- Range requests return 206 with the requested bytes; ETags give 304s
+- Text is gzip-compressed on the fly when accepted, never for Range requests
+"""
+
+import gzip
+import os
+from unittest import mock
+
+import pytest
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+@pytest.fixture
+def home(tmp_path):
+    (tmp_path / "projects" / "demo").mkdir(parents=True)
+    (tmp_path / "uploads").mkdir()
+    (tmp_path / "secret.txt").write_text("top secret")
+    with mock.patch.dict(os.environ, {"HOME": str(tmp_path)}):
+        yield tmp_path
+
+
+@pytest.fixture
+def client(home):
+    return _get_app().app.test_client()
+
+
+# ---------------------------------------------------------------------------
+# 1. Path confinement
+# ---------------------------------------------------------------------------
+
+class TestDownloadPaths:
+
+    def test_relative_and_absolute_paths(self, client, home):
+        (home / "projects" / "demo" / "out.bin").write_bytes(b"\x00\x01\x02")
+        for path in ("projects/demo/out.bin", str(home / "projects" / "demo" / "out.bin"),
+                     "~/projects/demo/out.bin"):
+            resp = client.get("/api/download", query_string={"path": path})
+            assert resp.status_code == 200, path
+            assert resp.data == b"\x00\x01\x02"
+            assert "attachment" in resp.headers["Content-Disposition"]
+
+    def test_outside_roots_refused(self, client, home):
+        for path in ("secret.txt", "projects/../secret.txt", "/etc/passwd", "projects/demo", ""):
+            resp = client.get("/api/download", query_string={"path": path})
+            assert resp.status_code == 404, path
+
+    def test_symlink_escape_refused(self, client, home):
+        os.symlink(home / "secret.txt", home / "projects" / "link.txt")
+        resp = client.get("/api/download", query_string={"path": "projects/link.txt"})
+        assert resp.status_code == 404
+
+    def test_upload_served_under_friendly_name(self, client, home):
+        (home / "uploads" / "abcd1234_chart.png").write_bytes(b"png")
+        resp = client.get("/api/download", query_string={"path": "uploads/abcd1234_chart.png"})
+        assert resp.status_code == 200
+        assert "abcd1234_chart.png" in resp.headers["Content-Disposition"]
+
+    def test_inline_display(self, client, home):
+        (home / "projects" / "notes.txt").write_text("hello")
+        resp = client.get("/api/download", query_string={"path": "projects/notes.txt", "inline": "1"})
+        assert resp.status_code == 200
+        assert "attachment" not in resp.headers.get("Content-Disposition", "")
+
+    def test_active_content_never_inline(self, client, home):
+        (home / "projects" / "page.html").write_text("<script>alert(1)</script>")
+        (home / "uploads" / "logo.svg").write_text("<svg><script>alert(1)</script></svg>" * 100)
+        for path, headers in (("projects/page.html", {}),
+                              ("uploads/logo.svg", {"Accept-Encoding": "gzip"})):
+            resp = client.get("/api/download", query_string={"path": path, "inline": "1"},
+                              headers=headers)
+            assert resp.status_code == 200, path
+            assert "attachment" in resp.headers["Content-Disposition"], path
+            assert resp.headers["X-Content-Type-Options"] == "nosniff"
+
+
+# ---------------------------------------------------------------------------
+# 2. Range and conditional requests
+# ---------------------------------------------------------------------------
+
+class TestRangeAndConditional:
+
+    def test_range_request(self, client, home):
+        (home / "projects" / "big.bin").write_bytes(bytes(range(256)) * 4)
+        resp = client.get("/api/download", query_string={"path": "projects/big.bin"},
+                          headers={"Range": "bytes=10-19"})
+        assert resp.status_code == 206
+        assert resp.data == bytes(range(10, 20))
+        assert resp.headers["Content-Range"] == "bytes 10-19/1024"
+
+    def test_etag_revalidation(self, client, home):
+        (home / "projects" / "a.bin").write_bytes(b"abc")
+        first = client.get("/api/download", query_string={"path": "projects/a.bin"})
+        etag = first.headers["ETag"]
+        again = client.get("/api/download", query_string={"path": "projects/a.bin"},
+                           headers={"If-None-Match": etag})
+        assert again.status_code == 304
+
+
+# ---------------------------------------------------------------------------
+# 3. On-the-fly gzip
+# ---------------------------------------------------------------------------
+
+class TestGzip:
+
+    def test_text_gzipped_when_accepted(self, client, home):
+        text = "line of build output\n" * 500
+        (home / "projects" / "build.log").write_text(text)
+        resp = client.get("/api/download", query_string={"path": "projects/build.log"},
+                          headers={"Accept-Encoding": "gzip"})
+        assert resp.status_code == 200
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(resp.data).decode() == text
+
+        again = client.get("/api/download", query_string={"path": "projects/build.log"},
+                           headers={"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]})
+        assert again.status_code == 304
+
+    def test_range_and_binary_not_gzipped(self, client, home):
+        (home / "projects" / "build.log").write_text("x" * 5000)
+        (home / "projects" / "model.bin").write_bytes(b"\x00" * 5000)
+        ranged = client.get("/api/download", query_string={"path": "projects/build.log"},
+                            headers={"Accept-Encoding": "gzip", "Range": "bytes=0-9"})
+        assert ranged.status_code == 206
+        assert "Content-Encoding" not in ranged.headers
+        binary = client.get("/api/download", query_string={"path": "projects/model.bin"},
+                            headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in binary.headers
@@ -0,0 +1,51 @@
+"""Tests for the critical-path split of index.html.
+
+Verifies that:
+- Only xterm.js and the fit addon are loaded with <script src> tags
+- Optional addons, the session picker and PAT setup are loaded on demand
+- Time-to-first-prompt performance marks are recorded
+"""
+
+import os
+import re
+
+import pytest
+
+STATIC = os.path.join(os.path.dirname(__file__), "..", "static")
+
+
+def _read(name):
+    with open(os.path.join(STATIC, name)) as f:
+        return f.read()
+
+
+class TestCriticalPath:
+
+    @pytest.fixture(autouse=True)
+    def _load(self):
+        self.html = _read("index.html")
+
+    def test_only_core_scripts_blocking(self):
+        assert re.findall(r'<script src="([^"]+)"', self.html) == [
+            "/static/lib/xterm.js",
+            "/static/lib/addon-fit.js",
+        ]
+
+    def test_optional_addons_loaded_lazily(self):
+        for addon in ("web-links", "search", "image", "clipboard"):
+            assert f"'/static/lib/addon-{addon}.js'" in self.html
+
+    @pytest.mark.parametrize("module, function", [
+        ("session-picker.js", "showSessionPicker"),
+        ("session-picker.js", "promptExistingSessions"),
+        ("pat-setup.js", "promptForPat"),
+    ])
+    def test_screens_split_out(self, module, function):
+        assert f"function {function}(" in _read(module)
+        assert f"function {function}(" not in self.html
+        assert f"await loadScript('/static/{module}');" in self.html
+
+    def test_first_prompt_marks(self):
+        for mark in ("coda:script-start", "coda:terminal-open", "coda:first-output"):
+            assert f"markOnce('{mark}')" in self.html
+        assert "coda:time-to-first-prompt" in self.html
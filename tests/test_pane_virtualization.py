@@ -0,0 +1,51 @@
+"""Tests for pane virtualization in index.html.
+
+Verifies that:
+- Terminals are built through one helper, shared by createPane and rehydration
+- Switching tabs rebuilds disposed panes and enforces the live-terminal cap
+- Status messages for disposed panes are held instead of written to a dead term
+"""
+
+import os
+import re
+
+import pytest
+
+INDEX_HTML = os.path.join(os.path.dirname(__file__), "..", "static", "index.html")
+
+
+def _function_body(html, name):
+    match = re.search(r"function %s\(.*?\n    }\n" % name, html, re.S)
+    assert match, f"{name}() not found in index.html"
+    return match.group(0)
+
+
+class TestPaneVirtualization:
+
+    @pytest.fixture(autouse=True)
+    def _load_html(self):
+        self.html = open(INDEX_HTML).read()
+
+    def test_single_terminal_constructor(self):
+        assert self.html.count("new Terminal(") == 1
+        assert "buildTerminal(element)" in _function_body(self.html, "createPane")
+        assert "buildTerminal(pane.element)" in _function_body(self.html, "rehydratePane")
+
+    def test_live_terminal_cap(self):
+        assert re.search(r"const MAX_LIVE_TERMINALS = \d+;", self.html)
+        assert re.search(r"const PANE_DISPOSE_GRACE_MS = \d+;", self.html)
+
+    def test_switch_tab_rehydrates_and_sweeps(self):
+        body = _function_body(self.html, "switchTab")
+        assert "rehydratePane" in body
+        assert "sweepHiddenPanes()" in body
+        assert body.index("rehydratePane") < body.index("refitAllPanes")
+
+    def test_dispose_requires_cache_and_session(self):
+        body = _function_body(self.html, "disposePane")
+        assert "!pane.sessionId" in body
+        assert "!cacheAvailable" in body
+
+    def test_status_messages_go_through_pane_write(self):
+        assert "pane.term.write('\\r\\n\\x1b[33mShell process exited." not in self.html
+        assert "paneWrite(pane, '\\r\\n\\x1b[33mShell process exited." in self.html
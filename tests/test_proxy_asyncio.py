@@ -0,0 +1,303 @@
+"""Tests for the content-filter proxy's asyncio serving mode.
+
+Verifies that:
+- Requests and responses go through the same sanitize / fix pipeline as the
+  threaded server (tool-name remapping, finish_reason, SSE passthrough)
+- "Try again" statuses are retried and keep-alive client connections work
+- 60 concurrent streams are served without a thread per stream, where the
+  threaded server needs one each
+- Preparing a large request doesn't stall other streams on the event loop
+"""
+
+import asyncio
+import json
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import content_filter_proxy as proxy  # noqa: E402
+
+STREAM_EVENTS = 10
+EVENT_DELAY = 0.05
+
+
+def _stop_loop(loop, server):
+    """Close *server*, cancel its connection tasks and stop *loop* (from another thread)."""
+    async def shutdown():
+        server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+class _FakeUpstream:
+    """asyncio chat-completions endpoint on its own thread (one thread total)."""
+
+    def __init__(self):
+        self.fail_next = []
+        self.requests = []
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+        self.ready.wait(5)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        _stop_loop(self.loop, self.server)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.decode().split("\r\n"):
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                body = json.loads(await reader.readexactly(length))
+                self.requests.append(body)
+                if self.fail_next:
+                    status = self.fail_next.pop(0)
+                    writer.write(f"HTTP/1.1 {status} Busy\r\nRetry-After: 0\r\nContent-Length: 0\r\n\r\n".encode())
+                elif body.get("stream"):
+                    await self._stream(writer)
+                else:
+                    payload = json.dumps({"choices": [{"finish_reason": "stop", "message": {
+                        "content": None,
+                        "tool_calls": [{"id": "t1", "function": {
+                            "name": "databricks-tool-call",
+                            "arguments": json.dumps({"name": "read", "path": "x"})}}],
+                    }}]}).encode()
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                                 + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def _stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Transfer-Encoding: chunked\r\n\r\n")
+        events = [{"choices": [{"delta": {"content": f"tok{i}"}, "finish_reason": None}]}
+                  for i in range(STREAM_EVENTS)]
+        for event in events:
+            data = f"data: {json.dumps(event)}\n\n".encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+            await asyncio.sleep(EVENT_DELAY)
+        done = b"data: [DONE]\n\n"
+        writer.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+
+
+@pytest.fixture
+def upstream():
+    fake = _FakeUpstream()
+    yield fake
+    fake.stop()
+
+
+def _patches(upstream):
+    return [
+        mock.patch.object(proxy, "UPSTREAM_BASE", f"http://127.0.0.1:{upstream.port}"),
+        mock.patch.object(proxy, "_get_fresh_token", return_value=None),
+        mock.patch.dict(proxy.POOL_STATS, {k: 0 for k in proxy.POOL_STATS}),
+        mock.patch.object(proxy, "_async_client", None),
+    ]
+
+
+@pytest.fixture
+def async_proxy(upstream):
+    """Run the asyncio proxy on a background loop; yields its base URL."""
+    patches = _patches(upstream)
+    for p in patches:
+        p.start()
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    holder = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        holder["server"] = loop.run_until_complete(proxy.start_async_server("127.0.0.1", 0))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait(5)
+    yield f"http://127.0.0.1:{holder['server'].sockets[0].getsockname()[1]}"
+    _stop_loop(loop, holder["server"])
+    for p in reversed(patches):
+        p.stop()
+
+
+@pytest.fixture
+def threaded_proxy(upstream):
+    patches = _patches(upstream) + [mock.patch.dict(proxy._pool, {"session": None, "last_used": 0.0})]
+    for p in patches:
+        p.start()
+    server = proxy.ThreadedHTTPServer(("127.0.0.1", 0), proxy.ProxyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    for p in reversed(patches):
+        p.stop()
+
+
+def _chat_body(stream):
+    return {"stream": stream, "messages": [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": [{"type": "text", "text": "  "}, {"type": "text", "text": "ok"}]},
+    ]}
+
+
+async def _stream_once(client, url):
+    events = []
+    async with client.stream("POST", f"{url}/chat/completions", json=_chat_body(True)) as resp:
+        assert resp.status_code == 200
+        async for line in resp.aiter_lines():
+            if line.startswith("data: "):
+                events.append(line[6:])
+    return events
+
+
+async def _run_streams(url, count):
+    """Run *count* concurrent streams; returns (results, peak thread count)."""
+    peak = threading.active_count()
+    done = asyncio.Event()
+
+    async def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample())
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        results = await asyncio.gather(*[_stream_once(client, url) for _ in range(count)])
+    done.set()
+    await sampler
+    return results, peak
+
+
+# ---------------------------------------------------------------------------
+# 1. Same pipeline as the threaded server
+# ---------------------------------------------------------------------------
+
+class TestAsyncioPipeline:
+
+    def test_non_streaming_response_fixed(self, async_proxy, upstream):
+        resp = httpx.post(f"{async_proxy}/chat/completions", json=_chat_body(False), timeout=10)
+        assert resp.status_code == 200
+        choice = resp.json()["choices"][0]
+        assert choice["finish_reason"] == "tool_calls"
+        assert choice["message"]["tool_calls"][0]["function"]["name"] == "read"
+        # Request side was sanitized: the whitespace-only text block is gone
+        assert upstream.requests[0]["messages"][1]["content"] == [{"type": "text", "text": "ok"}]
+
+    def test_streaming_passthrough(self, async_proxy):
+        events = asyncio.run(_run_streams(async_proxy, 1))[0][0]
+        assert len(events) == STREAM_EVENTS + 1
+        assert events[-1] == "[DONE]"
+        assert json.loads(events[0])["choices"][0]["delta"]["content"] == "tok0"
+
+    def test_unavailable_status_retried(self, async_proxy, upstream):
+        upstream.fail_next = [503]
+        resp = httpx.post(f"{async_proxy}/chat/completions", json=_chat_body(False), timeout=10)
+        assert resp.status_code == 200
+        assert len(upstream.requests) == 2
+
+    def test_gateway_error_not_resent(self, async_proxy, upstream):
+        upstream.fail_next = [502]
+        with mock.patch.object(proxy, "UPSTREAM_ALTERNATE", ""):
+            resp = httpx.post(f"{async_proxy}/chat/completions", json=_chat_body(False), timeout=10)
+        assert resp.status_code == 502
+        assert len(upstream.requests) == 1
+
+    def test_keep_alive_and_health(self, async_proxy):
+        with httpx.Client(timeout=10) as client:
+            for _ in range(3):
+                assert client.post(f"{async_proxy}/chat/completions", json=_chat_body(False)).status_code == 200
+            health = client.get(f"{async_proxy}/health").json()
+        assert health["mode"] == "asyncio"
+        assert health["pool"]["requests"] == 3
+        assert health["pool"]["connects"] == 1
+
+
+# ---------------------------------------------------------------------------
+# 2. Concurrency: threads per stream
+# ---------------------------------------------------------------------------
+
+CONCURRENT_STREAMS = 60
+
+
+class TestConcurrentStreams:
+
+    def test_asyncio_mode_no_thread_per_stream(self, async_proxy):
+        baseline = threading.active_count()
+        started = time.time()
+        results, peak = asyncio.run(_run_streams(async_proxy, CONCURRENT_STREAMS))
+        elapsed = time.time() - started
+        assert all(r[-1] == "[DONE]" and len(r) == STREAM_EVENTS + 1 for r in results)
+        assert peak - baseline <= 4
+        # Streams overlapped rather than running one after another
+        assert elapsed < STREAM_EVENTS * EVENT_DELAY * 4
+
+    def test_threaded_mode_holds_a_thread_per_stream(self, threaded_proxy):
+        baseline = threading.active_count()
+        results, peak = asyncio.run(_run_streams(threaded_proxy, CONCURRENT_STREAMS))
+        assert all(r[-1] == "[DONE]" for r in results)
+        assert peak - baseline >= CONCURRENT_STREAMS * 0.8
+
+
+# ---------------------------------------------------------------------------
+# 3. Request preparation off the event loop
+# ---------------------------------------------------------------------------
+
+class TestPrepareOffLoop:
+
+    def test_stream_flows_while_large_request_prepared(self, async_proxy):
+        real_prepare = proxy.prepare_upstream_request
+
+        def slow_prepare(path, body, headers):
+            if len(body) > 1_000_000:
+                time.sleep(1.0)  # Stands in for parsing a multi-MB conversation
+            return real_prepare(path, body, headers)
+
+        large = _chat_body(False)
+        large["messages"][0]["content"] = "x" * 2_000_000
+
+        async def run():
+            arrivals = []
+            async with httpx.AsyncClient(timeout=30) as client:
+                async def stream():
+                    async with client.stream("POST", f"{async_proxy}/chat/completions",
+                                             json=_chat_body(True)) as resp:
+                        async for line in resp.aiter_lines():
+                            if line.startswith("data: "):
+                                arrivals.append(time.time())
+
+                async def post_large():
+                    await asyncio.sleep(0.1)
+                    return await client.post(f"{async_proxy}/chat/completions", json=large)
+
+                _, resp = await asyncio.gather(stream(), post_large())
+            return arrivals, resp
+
+        with mock.patch.object(proxy, "prepare_upstream_request", side_effect=slow_prepare):
+            arrivals, resp = asyncio.run(run())
+        assert resp.status_code == 200
+        assert len(arrivals) == STREAM_EVENTS + 1
+        # A blocked loop would leave a ~1s hole in the stream
+        assert max(b - a for a, b in zip(arrivals, arrivals[1:])) < 0.5
@@ -0,0 +1,321 @@
+"""Tests for upstream failover, fail-back and hedging in the content-filter proxy.
+
+Verifies that:
+- A 5xx or connection failure on the primary is retried on the alternate,
+  and the primary is skipped while it's marked down
+- The primary is used again once its cooldown passes and it answers
+- A non-streaming request slower than the primary's p95 is hedged to the
+  alternate; streaming requests never are
+- A hedged request that fails unexpectedly still closes the other response
+- /health reports per-upstream health and latency percentiles
+"""
+
+import asyncio
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+
+import pytest
+import requests
+
+import content_filter_proxy as proxy
+
+
+class _ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _fake_upstream(name):
+    """A chat-completions endpoint answering as *name*; tweak .status / .delay."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        status = 200
+        delay = 0.0
+        hits = 0
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            type(self).hits += 1
+            time.sleep(self.delay)
+            if body.get("stream"):
+                payload = f"data: {json.dumps({'upstream': name})}\n\ndata: [DONE]\n\n".encode()
+                content_type = "text/event-stream"
+            else:
+                payload = json.dumps({"upstream": name, "choices": []}).encode()
+                content_type = "application/json"
+            self.send_response(self.status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = _ThreadedServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, Handler, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _closed_port_url():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture
+def upstreams():
+    primary_server, primary, primary_url = _fake_upstream("primary")
+    alternate_server, alternate, alternate_url = _fake_upstream("alternate")
+    with mock.patch.object(proxy, "UPSTREAM_BASE", primary_url), \
+            mock.patch.object(proxy, "UPSTREAM_ALTERNATE", alternate_url), \
+            mock.patch.object(proxy, "UPSTREAM_RETRIES", 0), \
+            mock.patch.object(proxy, "HEDGE", True), \
+            mock.patch.object(proxy, "HEDGE_MIN_DELAY", 0.1), \
+            mock.patch.object(proxy, "_upstreams", {}), \
+            mock.patch.object(proxy, "_get_fresh_token", return_value=None), \
+            mock.patch.dict(proxy.POOL_STATS, {k: 0 for k in proxy.POOL_STATS}), \
+            mock.patch.dict(proxy._pool, {"session": None, "last_used": 0.0}):
+        yield primary, alternate
+    primary_server.shutdown()
+    alternate_server.shutdown()
+
+
+@pytest.fixture
+def proxy_url(upstreams):
+    front = proxy.ThreadedHTTPServer(("127.0.0.1", 0), proxy.ProxyHandler)
+    threading.Thread(target=front.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{front.server_address[1]}"
+    front.shutdown()
+
+
+def _chat(url, stream=False):
+    req = urllib.request.Request(f"{url}/chat/completions", method="POST",
+                                 data=json.dumps({"stream": stream, "messages": []}).encode(),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        body = resp.read().decode()
+    if stream:
+        return json.loads(body.splitlines()[0][6:])["upstream"]
+    return json.loads(body)["upstream"]
+
+
+def _warm_latencies(seconds=0.02, count=proxy.HEDGE_MIN_SAMPLES):
+    for _ in range(count):
+        proxy.record_upstream_result(proxy.UPSTREAM_BASE, True, seconds)
+
+
+# ---------------------------------------------------------------------------
+# 1. Failover and fail-back
+# ---------------------------------------------------------------------------
+
+class TestFailover:
+
+    def test_5xx_fails_over_and_primary_skipped_while_down(self, proxy_url, upstreams):
+        primary, alternate = upstreams
+        primary.status = 500
+        assert _chat(proxy_url) == "alternate"
+        assert _chat(proxy_url) == "alternate"
+        assert primary.hits == 1
+        assert proxy.upstream_bases()[0] == proxy.UPSTREAM_ALTERNATE
+
+    def test_connection_failure_fails_over(self, proxy_url, upstreams):
+        with mock.patch.object(proxy, "UPSTREAM_BASE", _closed_port_url()):
+            assert _chat(proxy_url, stream=True) == "alternate"
+            status = {u["base"]: u for u in proxy.upstream_status()}
+            assert status[proxy.UPSTREAM_BASE]["healthy"] is False
+            assert status[proxy.UPSTREAM_BASE]["failovers"] == 1
+
+    def test_fail_back_after_cooldown(self, proxy_url, upstreams):
+        primary, alternate = upstreams
+        primary.status = 500
+        assert _chat(proxy_url) == "alternate"
+
+        primary.status = 200
+        proxy._upstreams[proxy.UPSTREAM_BASE]["down_until"] = time.time() - 1
+        assert _chat(proxy_url) == "primary"
+        assert proxy.upstream_status()[0]["healthy"] is True
+
+    def test_cooldown_doubles(self, upstreams):
+        base = proxy.UPSTREAM_BASE
+        proxy.record_upstream_result(base, False)
+        first = proxy._upstreams[base]["down_until"] - time.time()
+        proxy.record_upstream_result(base, False)
+        second = proxy._upstreams[base]["down_until"] - time.time()
+        assert first == pytest.approx(proxy.FAILOVER_COOLDOWN, abs=1)
+        assert second == pytest.approx(proxy.FAILOVER_COOLDOWN * 2, abs=1)
+
+    def test_every_upstream_failing_returns_last_error(self, proxy_url, upstreams):
+        for handler in upstreams:
+            handler.status = 503
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            _chat(proxy_url)
+        assert exc.value.code == 503
+
+
+# ---------------------------------------------------------------------------
+# 2. Hedging
+# ---------------------------------------------------------------------------
+
+class TestHedging:
+
+    def test_slow_request_hedged_to_alternate(self, proxy_url, upstreams):
+        primary, alternate = upstreams
+        _warm_latencies()
+        primary.delay = 1.5
+        started = time.time()
+        assert _chat(proxy_url) == "alternate"
+        assert time.time() - started < 1.0
+        status = {u["base"]: u for u in proxy.upstream_status()}
+        assert status[proxy.UPSTREAM_ALTERNATE]["hedges"] == 1
+        assert status[proxy.UPSTREAM_ALTERNATE]["hedge_wins"] == 1
+
+    def test_fast_request_not_hedged(self, proxy_url, upstreams):
+        primary, alternate = upstreams
+        _warm_latencies(seconds=2.0)
+        assert _chat(proxy_url) == "primary"
+        assert alternate.hits == 0
+
+    def test_no_hedging_without_history(self, proxy_url, upstreams):
+        primary, alternate = upstreams
+        _warm_latencies(count=proxy.HEDGE_MIN_SAMPLES - 1)
+        primary.delay = 0.3
+        assert _chat(proxy_url) == "primary"
+        assert alternate.hits == 0
+
+    def test_disabled_still_fails_over(self, proxy_url, upstreams):
+        primary, alternate = upstreams
+        _warm_latencies()
+        primary.delay = 0.5
+        with mock.patch.object(proxy, "HEDGE", False):
+            assert _chat(proxy_url) == "primary"
+            primary.status = 500
+            assert _chat(proxy_url) == "alternate"  # failover still on
+        assert alternate.hits == 1
+
+    def test_streaming_never_hedged(self, proxy_url, upstreams):
+        primary, alternate = upstreams
+        _warm_latencies()
+        primary.delay = 0.5
+        assert _chat(proxy_url, stream=True) == "primary"
+        assert alternate.hits == 0
+
+
+class TestHedgeCleanup:
+
+    def test_pending_hedge_closed_when_primary_raises(self, upstreams):
+        hedge_resp = mock.Mock(status_code=200)
+        closed = threading.Event()
+
+        def post_to(base, *args):
+            if base == proxy.UPSTREAM_BASE:
+                time.sleep(0.2)
+                raise requests.exceptions.ChunkedEncodingError("broken")
+            time.sleep(0.4)
+            return hedge_resp, False
+
+        with mock.patch.object(proxy, "_post_to", side_effect=post_to), \
+                mock.patch.object(proxy, "close_upstream", side_effect=lambda r: closed.set()) as close:
+            with pytest.raises(requests.exceptions.ChunkedEncodingError):
+                proxy._hedged_post("/chat/completions", b"{}", {},
+                                   [proxy.UPSTREAM_BASE, proxy.UPSTREAM_ALTERNATE], 0.05)
+            assert closed.wait(5)
+        close.assert_called_once_with(hedge_resp)
+
+    def test_async_fallback_closed_when_alternate_raises(self, upstreams):
+        pytest.importorskip("httpx")
+        fallback = mock.Mock(status_code=502)
+
+        async def post_to(base, *args):
+            if base == proxy.UPSTREAM_BASE:
+                return fallback, False
+            raise ValueError("bad response")
+
+        async def run():
+            with mock.patch.object(proxy, "_async_post_to", post_to), \
+                    mock.patch.object(proxy, "async_close_upstream", mock.AsyncMock()) as close:
+                with pytest.raises(ValueError):
+                    await proxy._async_hedged_post("/chat/completions", b"{}", {},
+                                                   [proxy.UPSTREAM_BASE, proxy.UPSTREAM_ALTERNATE], 5)
+                await asyncio.sleep(0.05)
+            return close
+
+        asyncio.run(run()).assert_awaited_once_with(fallback)
+
+
+# ---------------------------------------------------------------------------
+# 3. Reporting
+# ---------------------------------------------------------------------------
+
+class TestUpstreamStatus:
+
+    def test_percentiles_reported(self, upstreams):
+        for ms in range(1, 101):
+            proxy.record_upstream_result(proxy.UPSTREAM_BASE, True, ms / 1000)
+        proxy.record_upstream_result(proxy.UPSTREAM_BASE, True, 0.25, stream=True)
+        primary = proxy.health_status()["upstreams"][0]
+        assert primary["base"] == proxy.UPSTREAM_BASE
+        assert primary["latency_p50_ms"] == 51
+        assert primary["latency_p95_ms"] == 96
+        assert primary["ttfb_p50_ms"] == 250
+        assert proxy.health_status()["upstreams"][1]["latency_p50_ms"] is None
+
+
+# ---------------------------------------------------------------------------
+# 4. asyncio mode
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def async_proxy_url(upstreams):
+    pytest.importorskip("httpx")
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    holder = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        holder["server"] = loop.run_until_complete(proxy.start_async_server("127.0.0.1", 0))
+        started.set()
+        loop.run_forever()
+
+    with mock.patch.object(proxy, "_async_client", None):
+        threading.Thread(target=run, daemon=True).start()
+        started.wait(5)
+        yield f"http://127.0.0.1:{holder['server'].sockets[0].getsockname()[1]}"
+
+        async def shutdown():
+            holder["server"].close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+class TestAsyncio:
+
+    def test_failover(self, async_proxy_url, upstreams):
+        primary, alternate = upstreams
+        primary.status = 502
+        assert _chat(async_proxy_url) == "alternate"
+        assert _chat(async_proxy_url, stream=True) == "alternate"
+        assert primary.hits == 1
+
+    def test_hedge(self, async_proxy_url, upstreams):
+        primary, alternate = upstreams
+        _warm_latencies()
+        primary.delay = 1.5
+        started = time.time()
+        assert _chat(async_proxy_url) == "alternate"
+        assert time.time() - started < 1.0
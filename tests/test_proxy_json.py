@@ -0,0 +1,159 @@
+"""Tests for the content-filter proxy's single-parse request pipeline.
+
+Verifies that:
+- A request body is parsed once and serialized once, compactly
+- orjson is optional: the stdlib path gives the same result, and values
+  orjson refuses fall back to the stdlib
+- Non-streaming responses without tool calls are passed through unparsed
+- On a multi-MB prompt the pipeline gives the old parse/dump/parse one's
+  result, and beats it (benchmark, skipped unless PROXY_BENCHMARKS=1)
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from unittest import mock
+
+import pytest
+
+import content_filter_proxy as proxy
+
+
+@pytest.fixture(autouse=True)
+def isolated():
+    with mock.patch.object(proxy, "_get_fresh_token", return_value=None), \
+            mock.patch.object(proxy, "_conversation_memo", OrderedDict()), \
+            mock.patch.object(proxy, "_tool_memo", OrderedDict()), \
+            mock.patch.dict(proxy.MEMO_STATS, {k: 0 for k in proxy.MEMO_STATS}):
+        yield
+
+
+def _big_request(turns=150, result_bytes=20_000, stream=True):
+    messages = [{"role": "system", "content": "You are a coding agent. " * 200}]
+    for i in range(turns):
+        messages.append({"role": "assistant", "content": [
+            {"type": "text", "text": " "},
+            {"type": "tool_use", "id": f"toolu_{i}", "name": "read", "input": {"path": f"f{i}.py"}}]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"toolu_{i}",
+             "content": f"def f{i}():\n    return 'é✓'\n" * (result_bytes // 30)}]})
+    tools = [{"type": "function", "function": {"name": f"tool{i}", "parameters": {
+        "$schema": "x", "type": "object", "additionalProperties": False,
+        "properties": {"a": {"type": "string", "description": "d" * 300}}}}} for i in range(40)]
+    return {"model": "databricks-claude-sonnet-4", "stream": stream, "messages": messages, "tools": tools}
+
+
+def _prepare(data):
+    return proxy.prepare_upstream_request("/chat/completions", json.dumps(data).encode(), [])
+
+
+# ---------------------------------------------------------------------------
+# 1. One parse, one serialize
+# ---------------------------------------------------------------------------
+
+class TestSingleParse:
+
+    def test_parsed_and_serialized_once(self):
+        with mock.patch.object(proxy, "json_loads", wraps=proxy.json_loads) as loads, \
+                mock.patch.object(proxy, "json_dumps", wraps=proxy.json_dumps) as dumps:
+            _, body, headers, is_stream, _ = _prepare(_big_request(turns=3))
+        assert loads.call_count == 1
+        assert dumps.call_count == 1
+        assert is_stream is True
+        assert headers["Content-Length"] == str(len(body))
+
+    def test_compact_output(self):
+        _, body, _, is_stream, _ = _prepare({"stream": False, "messages": [{"role": "user", "content": "hi"}]})
+        assert body == b'{"stream":false,"messages":[{"role":"user","content":"hi"}]}'
+        assert is_stream is False
+
+    def test_stdlib_fallback_matches(self):
+        data = _big_request(turns=5)
+        with_orjson = json.loads(_prepare(data)[1])
+        with mock.patch.object(proxy, "orjson", None):
+            without = json.loads(_prepare(data)[1])
+        assert with_orjson == without
+
+    def test_values_orjson_refuses(self):
+        # NaN and a >64-bit integer aren't orjson-compatible; still forwarded
+        body = b'{"messages": [], "seed": 123456789012345678901234567890, "temperature": NaN}'
+        _, out, _, _, _ = proxy.prepare_upstream_request("/chat/completions", body, [])
+        assert b"123456789012345678901234567890" in out
+
+    def test_unparseable_and_non_object_bodies_forwarded(self):
+        for body in (b"not json", b"[1, 2]"):
+            _, out, _, is_stream, _ = proxy.prepare_upstream_request("/chat/completions", body, [])
+            assert out == body
+            assert is_stream is False
+
+
+# ---------------------------------------------------------------------------
+# 2. Response side
+# ---------------------------------------------------------------------------
+
+class TestResponseBody:
+
+    def test_no_tool_calls_passthrough(self):
+        content = json.dumps({"choices": [{"message": {"content": "x" * 1000}, "finish_reason": "stop"}]}).encode()
+        with mock.patch.object(proxy, "json_loads") as loads:
+            assert proxy.fix_response_body(content) is content
+        loads.assert_not_called()
+
+    def test_tool_calls_fixed(self):
+        content = json.dumps({"choices": [{"finish_reason": "stop", "message": {"tool_calls": [
+            {"id": "t", "function": {"name": "databricks-tool-call",
+                                     "arguments": json.dumps({"name": "bash", "command": "ls"})}}]}}]}).encode()
+        fixed = json.loads(proxy.fix_response_body(content))
+        assert fixed["choices"][0]["finish_reason"] == "tool_calls"
+        assert fixed["choices"][0]["message"]["tool_calls"][0]["function"]["name"] == "bash"
+
+
+# ---------------------------------------------------------------------------
+# 3. Multi-MB prompt: same result as the old pipeline, faster
+# ---------------------------------------------------------------------------
+
+def _old_pipeline(body):
+    """What prepare_upstream_request used to do with the body."""
+    data = json.loads(body)
+    data["messages"] = proxy.sanitize_messages(data["messages"])
+    data = proxy.sanitize_tool_schemas(data)
+    body = json.dumps(data).encode()
+    return body, json.loads(body).get("stream", False)
+
+
+class TestOldPipelineParity:
+
+    def test_multi_mb_prompt_matches_old_pipeline(self):
+        raw = json.dumps(_big_request()).encode()
+        assert len(raw) > 3_000_000
+        old_body, old_stream = _old_pipeline(raw)
+        with mock.patch.object(proxy, "MEMO_CONVERSATIONS", 0):
+            _, body, _, is_stream, _ = proxy.prepare_upstream_request("/chat/completions", raw, [])
+        assert is_stream is old_stream is True
+        assert json.loads(body) == json.loads(old_body)
+
+
+# Timing assertions flake on loaded runners; opt in with PROXY_BENCHMARKS=1
+benchmark = pytest.mark.skipif(not os.environ.get("PROXY_BENCHMARKS"),
+                               reason="timing benchmark; set PROXY_BENCHMARKS=1 to run")
+
+
+@benchmark
+class TestBenchmark:
+
+    def test_multi_mb_prompt(self):
+        raw = json.dumps(_big_request()).encode()
+
+        def best(fn):
+            times = []
+            for _ in range(3):
+                started = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - started)
+            return min(times)
+
+        t_old = best(lambda: _old_pipeline(raw))
+        with mock.patch.object(proxy, "MEMO_CONVERSATIONS", 0):
+            t_new = best(lambda: proxy.prepare_upstream_request("/chat/completions", raw, []))
+        assert t_new < t_old
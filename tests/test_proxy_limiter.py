@@ -0,0 +1,385 @@
+"""Tests for the content-filter proxy's adaptive concurrency limiter.
+
+Verifies that:
+- A 429 halves the (upstream, model) limit once per window; successes
+  grow it back by 1/limit up to PROXY_CONCURRENCY_MAX
+- Requests over the limit wait in arrival order; retries go to the front
+- 429s are retried after Retry-After, a bounded number of times
+- A slot is held until the response is closed, streams included
+- A burst against a rate-limited upstream completes without a single 429
+  reaching the client, in both server modes
+"""
+
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+
+import pytest
+import requests
+
+import content_filter_proxy as proxy
+
+KEY = ("http://upstream", "databricks-claude-sonnet-4-6")
+
+
+class _ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RateLimitedUpstream(BaseHTTPRequestHandler):
+    """Accepts ``capacity`` concurrent requests and answers 429 beyond that."""
+    protocol_version = "HTTP/1.1"
+    capacity = 4
+    delay = 0.05
+    retry_after = "0"
+    reject_next = 0     # 429s to return regardless of load
+    in_flight = 0
+    accepted = 0
+    rejected = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        with cls.lock:
+            reject = cls.reject_next > 0 or cls.in_flight >= cls.capacity
+            if reject:
+                cls.reject_next = max(cls.reject_next - 1, 0)
+                cls.rejected += 1
+            else:
+                cls.in_flight += 1
+                cls.accepted += 1
+        if reject:
+            self.send_response(429)
+            self.send_header("Retry-After", self.retry_after)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            if body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for data in (b'data: {"choices": []}\n\n', b"data: [DONE]\n\n"):
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                    time.sleep(self.delay)
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                time.sleep(self.delay)
+                payload = json.dumps({"choices": [{"message": {"content": "hi"}, "finish_reason": "stop"}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def limiter():
+    with mock.patch.object(proxy, "CONCURRENCY_MAX", 16), \
+            mock.patch.object(proxy, "RATE_LIMIT_RETRIES", 3), \
+            mock.patch.object(proxy, "_limiters", {}):
+        yield
+
+
+@pytest.fixture
+def upstream(limiter):
+    _RateLimitedUpstream.capacity = 4
+    _RateLimitedUpstream.delay = 0.05
+    _RateLimitedUpstream.retry_after = "0"
+    _RateLimitedUpstream.reject_next = 0
+    _RateLimitedUpstream.in_flight = _RateLimitedUpstream.accepted = _RateLimitedUpstream.rejected = 0
+    server = _serve(_ThreadedServer(("127.0.0.1", 0), _RateLimitedUpstream))
+    server.request_queue_size = 128
+    with mock.patch.object(proxy, "UPSTREAM_BASE", f"http://127.0.0.1:{server.server_address[1]}"), \
+            mock.patch.object(proxy, "UPSTREAM_ALTERNATE", ""), \
+            mock.patch.object(proxy, "_upstreams", {}), \
+            mock.patch.object(proxy, "_get_fresh_token", return_value=None), \
+            mock.patch.dict(proxy.POOL_STATS, {k: 0 for k in proxy.POOL_STATS}), \
+            mock.patch.dict(proxy._pool, {"session": None, "last_used": 0.0}):
+        yield _RateLimitedUpstream
+    server.shutdown()
+
+
+@pytest.fixture
+def proxy_url(upstream):
+    front = _serve(proxy.ThreadedHTTPServer(("127.0.0.1", 0), proxy.ProxyHandler))
+    yield f"http://127.0.0.1:{front.server_address[1]}"
+    front.shutdown()
+
+
+def _chat(url, stream=False, model="databricks-claude-sonnet-4-6"):
+    """POST a completion; returns the HTTP status the client saw."""
+    req = urllib.request.Request(f"{url}/chat/completions", method="POST",
+                                 data=json.dumps({"model": model, "stream": stream, "messages": []}).encode(),
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def _state(key=KEY):
+    return proxy._limiter_state(key)
+
+
+def _settled():
+    """Limiter status once every handler has closed its response."""
+    deadline = time.time() + 5
+    while any(s["in_flight"] for s in proxy.limiter_status()) and time.time() < deadline:
+        time.sleep(0.01)
+    return proxy.limiter_status()
+
+
+# ---------------------------------------------------------------------------
+# 1. AIMD
+# ---------------------------------------------------------------------------
+
+class TestAIMD:
+
+    def test_starts_at_max(self, limiter):
+        assert _state()["limit"] == 16
+
+    def test_429_halves_once_per_window(self, limiter):
+        sent = time.time()
+        for _ in range(5):
+            proxy.record_limit_result(KEY, 429, sent)
+        # The burst was sent before the first decrease: one halving
+        assert _state()["limit"] == 8
+        assert _state()["throttled"] == 5
+
+        proxy.record_limit_result(KEY, 429, time.time() + 1)
+        assert _state()["limit"] == 4
+
+    def test_never_below_one(self, limiter):
+        for i in range(10):
+            proxy.record_limit_result(KEY, 429, time.time() + i)
+        assert _state()["limit"] == 1
+
+    def test_additive_increase_capped(self, limiter):
+        proxy.record_limit_result(KEY, 429, time.time())
+        for _ in range(8):
+            proxy.record_limit_result(KEY, 200, time.time())
+        # About +1 per limit's worth of successes
+        assert 8.9 < _state()["limit"] < 9
+        for _ in range(1000):
+            proxy.record_limit_result(KEY, 200, time.time())
+        assert _state()["limit"] == 16
+
+    def test_errors_neither_grow_nor_shrink(self, limiter):
+        proxy.record_limit_result(KEY, 429, time.time())
+        for status in (400, 404, 500, 503):
+            proxy.record_limit_result(KEY, status, time.time())
+        assert _state()["limit"] == 8
+
+
+# ---------------------------------------------------------------------------
+# 2. Fair queue
+# ---------------------------------------------------------------------------
+
+def _queue_up(order, name, front=False):
+    thread = threading.Thread(target=lambda: (proxy.acquire_slot(KEY, front=front), order.append(name)))
+    waiting = len(_state()["waiters"])
+    thread.start()
+    while len(_state()["waiters"]) == waiting:
+        time.sleep(0.001)
+    return thread
+
+
+class TestQueue:
+
+    def test_waiters_served_in_order_retries_first(self, limiter):
+        _state()["limit"] = 1.0
+        proxy.acquire_slot(KEY)
+        order = []
+        threads = [_queue_up(order, "a"), _queue_up(order, "b"), _queue_up(order, "retry", front=True)]
+        for served in range(1, len(threads) + 1):
+            proxy.release_slot(KEY)
+            while len(order) < served:
+                time.sleep(0.001)
+        assert order == ["retry", "a", "b"]
+        assert _state()["queued"] == 3
+
+    def test_no_barging_past_waiters(self, limiter):
+        _state()["limit"] = 1.0
+        proxy.acquire_slot(KEY)
+        order = []
+        waiter = _queue_up(order, "waiter")
+        # A slot freed by a growing limit goes to the queue, not a newcomer
+        _state()["limit"] = 2.0
+        proxy.record_limit_result(KEY, 200, time.time())
+        waiter.join(1)
+        assert order == ["waiter"]
+        assert _state()["in_flight"] == 2
+
+    def test_queue_timeout(self, limiter):
+        _state()["limit"] = 1.0
+        proxy.acquire_slot(KEY)
+        with mock.patch.object(proxy, "QUEUE_TIMEOUT", 0.05):
+            with pytest.raises(requests.exceptions.Timeout):
+                proxy.acquire_slot(KEY)
+        assert not _state()["waiters"]
+        assert _state()["in_flight"] == 1
+
+    def test_disabled(self, limiter):
+        with mock.patch.object(proxy, "CONCURRENCY_MAX", 0):
+            for _ in range(100):
+                proxy.acquire_slot(KEY)
+        assert proxy.limiter_status() == []
+
+
+# ---------------------------------------------------------------------------
+# 3. Retries and slot lifetime (threaded server)
+# ---------------------------------------------------------------------------
+
+class TestRetries:
+
+    def test_retry_after_honored(self, proxy_url, upstream):
+        upstream.reject_next = 1
+        upstream.retry_after = "0.3"
+        started = time.time()
+        assert _chat(proxy_url) == 200
+        assert time.time() - started >= 0.3
+        status = proxy.health_status()["concurrency"][0]
+        assert status["retries"] == 1
+        assert status["throttled"] == 1
+
+    def test_retries_bounded(self, proxy_url, upstream):
+        upstream.reject_next = 100
+        assert _chat(proxy_url) == 429
+        assert upstream.rejected == proxy.RATE_LIMIT_RETRIES + 1
+
+    def test_slot_held_for_whole_stream(self, proxy_url, upstream):
+        upstream.delay = 0.3
+        thread = threading.Thread(target=_chat, args=(proxy_url, True))
+        thread.start()
+        time.sleep(0.15)
+        assert proxy.limiter_status()[0]["in_flight"] == 1
+        thread.join()
+        assert _settled()[0]["in_flight"] == 0
+
+    def test_models_limited_separately(self, proxy_url, upstream):
+        _chat(proxy_url, model="a")
+        _chat(proxy_url, model="b")
+        assert sorted(s["model"] for s in proxy.limiter_status()) == ["a", "b"]
+
+    def test_closed_slot_released_once(self, limiter):
+        resp = mock.Mock()
+        proxy.acquire_slot(KEY)
+        proxy._hold_slot(resp, KEY)
+        proxy.close_upstream(resp)
+        proxy.close_upstream(resp)
+        assert _state()["in_flight"] == 0
+
+    def test_concurrent_closes_release_each_slot_once(self, limiter):
+        responses = [mock.Mock() for _ in range(16)]
+        for resp in responses:
+            proxy.acquire_slot(KEY)
+            proxy._hold_slot(resp, KEY)
+        # Each response closed from two threads at once, as a hedge loser and
+        # a handler's finally can
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(proxy.close_upstream, responses + responses))
+        assert _state()["in_flight"] == 0
+
+    def test_unclosed_slot_released_on_collection(self, limiter):
+        resp = mock.Mock()
+        proxy.acquire_slot(KEY)
+        proxy._hold_slot(resp, KEY)
+        del resp
+        assert _state()["in_flight"] == 0
+
+
+# ---------------------------------------------------------------------------
+# 4. Burst against a rate-limited upstream
+# ---------------------------------------------------------------------------
+
+def _burst(url, count=32, stream=False):
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(lambda _: _chat(url, stream), range(count)))
+
+
+class TestBurst:
+
+    def test_no_429_reaches_client(self, proxy_url, upstream):
+        statuses = _burst(proxy_url)
+        status = _settled()[0]
+        print(f"\nburst of 32 at capacity 4: upstream 429s={upstream.rejected} final limit={status['limit']}")
+        assert statuses == [200] * 32
+        assert 1 <= status["limit"] <= 8
+        assert status["in_flight"] == 0
+
+    def test_without_limiter_429s_reach_client(self, proxy_url, upstream):
+        with mock.patch.object(proxy, "CONCURRENCY_MAX", 0), \
+                mock.patch.object(proxy, "RATE_LIMIT_RETRIES", 0):
+            statuses = _burst(proxy_url)
+        assert statuses.count(429) > 0
+
+
+# ---------------------------------------------------------------------------
+# 5. asyncio mode
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def async_proxy_url(upstream):
+    pytest.importorskip("httpx")
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    holder = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        holder["server"] = loop.run_until_complete(proxy.start_async_server("127.0.0.1", 0))
+        started.set()
+        loop.run_forever()
+
+    with mock.patch.object(proxy, "_async_client", None):
+        threading.Thread(target=run, daemon=True).start()
+        started.wait(5)
+        yield f"http://127.0.0.1:{holder['server'].sockets[0].getsockname()[1]}"
+
+        async def shutdown():
+            holder["server"].close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+class TestAsyncio:
+
+    def test_burst(self, async_proxy_url, upstream):
+        assert _burst(async_proxy_url, stream=True) == [200] * 32
+        status = _settled()[0]
+        assert status["throttled"] > 0
+        assert status["in_flight"] == 0
+
+    def test_retries_bounded(self, async_proxy_url, upstream):
+        upstream.reject_next = 100
+        assert _chat(async_proxy_url) == 429
+        assert upstream.rejected == proxy.RATE_LIMIT_RETRIES + 1
@@ -0,0 +1,163 @@
+"""Tests for the content-filter proxy's cross-request memoization.
+
+Verifies that:
+- A follow-up turn reuses the sanitized conversation prefix and only sweeps
+  the new tail, with results identical to a full sanitize
+- Edited history falls back to the shared prefix; cached results are never
+  aliased into what the caller gets back
+- Tool schemas are stripped once and re-stripped only when they change
+- Hit rates and time saved are reported on /health
+"""
+
+import json
+import random
+from collections import OrderedDict
+from unittest import mock
+
+import pytest
+
+import content_filter_proxy as proxy
+
+
+@pytest.fixture(autouse=True)
+def fresh_memo():
+    with mock.patch.object(proxy, "_conversation_memo", OrderedDict()), \
+            mock.patch.object(proxy, "_tool_memo", OrderedDict()), \
+            mock.patch.dict(proxy._memo_cost, {"per_message": 0.0}), \
+            mock.patch.dict(proxy.MEMO_STATS, {k: 0 for k in proxy.MEMO_STATS}):
+        yield
+
+
+def _agent_history(n):
+    """User turn, tool call with an empty text block, tool results (one stale)."""
+    messages = [{"role": "system", "content": "You are a coding agent."}]
+    for i in range(n // 4):
+        messages.append({"role": "user", "content": [{"type": "text", "text": f"step {i}"}]})
+        messages.append({"role": "assistant", "content": [
+            {"type": "text", "text": ""},
+            {"type": "tool_use", "id": f"toolu_{i}", "name": "read", "input": {"path": "x"}}]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"toolu_{i}", "content": "file body"},
+            {"type": "tool_result", "tool_use_id": f"toolu_{i - 1}", "content": "stale"}]})
+        messages.append({"role": "assistant", "content": "done" if i % 7 else "  "})
+    return messages
+
+
+def _random_message(rng):
+    role = rng.choice(["user", "assistant", "tool"])
+    ref = rng.choice(["a", "b", "c", None])
+    if role == "tool":
+        return {"role": role, "tool_call_id": ref, "content": rng.choice(["", "ok"])}
+    if role == "assistant" and rng.random() < 0.5:
+        return {"role": role, "content": None, "tool_calls": [{"id": ref}]}
+    return {"role": role, "content": rng.choice([
+        "", "hi", None,
+        [{"type": "text", "text": rng.choice(["", "x"])}],
+        [{"type": "tool_result", "tool_use_id": ref}],
+        [{"type": "tool_use", "id": ref}],
+    ])}
+
+
+def _random_conversation(rng, length):
+    return [_random_message(rng) for _ in range(length)]
+
+
+def _tool(name, extra=None):
+    params = {"$schema": "http://json-schema.org/draft-07/schema#", "type": "object",
+              "additionalProperties": False,
+              "properties": {"path": {"type": "string", "additionalProperties": False}}}
+    params.update(extra or {})
+    return {"type": "function", "function": {"name": name, "parameters": params}}
+
+
+# ---------------------------------------------------------------------------
+# 1. Conversation prefixes
+# ---------------------------------------------------------------------------
+
+class TestConversationMemo:
+
+    def test_follow_up_turn_sweeps_only_the_tail(self):
+        history = _agent_history(400)
+        first = proxy.sanitize_messages_cached(json.loads(json.dumps(history[:300])))
+        second = proxy.sanitize_messages_cached(json.loads(json.dumps(history)))
+
+        assert first == proxy.sanitize_messages(history[:300])
+        assert second == proxy.sanitize_messages(history)
+        stats = proxy.memo_stats()
+        assert stats["conversation_hits"] == 1 and stats["conversation_misses"] == 1
+        assert stats["messages_reused"] == 300
+        assert stats["messages_sanitized"] == len(history)  # 300 cold + the 101-message tail
+
+    def test_growing_random_conversations_match_full_sanitize(self):
+        rng = random.Random(44)
+        for _ in range(200):
+            messages = _random_conversation(rng, rng.randint(2, 30))
+            for turn in range(4):
+                if turn and rng.random() < 0.3 and len(messages) > 2:
+                    # History rewrite (e.g. compaction) somewhere after the opening
+                    messages[rng.randint(2, len(messages) - 1)] = {"role": "user", "content": "edited"}
+                messages = messages + _random_conversation(rng, rng.randint(0, 5))
+                assert proxy.sanitize_messages_cached(list(messages)) == proxy.sanitize_messages(messages)
+
+    def test_edited_history_reuses_only_shared_prefix(self):
+        history = _agent_history(100)
+        proxy.sanitize_messages_cached(history)
+        edited = history[:50] + [{"role": "user", "content": "summary"}] + history[51:]
+        assert proxy.sanitize_messages_cached(edited) == proxy.sanitize_messages(edited)
+        assert proxy.MEMO_STATS["messages_reused"] == 50
+
+    def test_result_not_aliased_with_cache(self):
+        history = _agent_history(40)
+        result = proxy.sanitize_messages_cached(history)
+        result.append({"role": "user", "content": "appended by caller"})
+        result.pop(0)
+        assert proxy.sanitize_messages_cached(history) == proxy.sanitize_messages(history)
+
+    def test_lru_bounded(self):
+        with mock.patch.object(proxy, "MEMO_CONVERSATIONS", 2):
+            for i in range(5):
+                proxy.sanitize_messages_cached([{"role": "system", "content": f"agent {i}"},
+                                                {"role": "user", "content": "go"}])
+        assert len(proxy._conversation_memo) == 2
+
+
+# ---------------------------------------------------------------------------
+# 2. Tool schemas
+# ---------------------------------------------------------------------------
+
+class TestToolSchemaMemo:
+
+    def test_unchanged_tools_reused_changed_tool_restripped(self):
+        first = proxy.sanitize_tool_schemas({"tools": [_tool("read"), _tool("bash")]})
+        second = proxy.sanitize_tool_schemas(
+            {"tools": [_tool("read"), _tool("bash", {"required": ["path"]})]})
+
+        assert first["tools"][0]["function"]["parameters"] is second["tools"][0]["function"]["parameters"]
+        changed = second["tools"][1]["function"]["parameters"]
+        assert changed == {"type": "object", "properties": {"path": {"type": "string"}},
+                           "required": ["path"]}
+        assert proxy.MEMO_STATS["tool_hits"] == 1
+        assert proxy.MEMO_STATS["tool_misses"] == 3
+
+
+# ---------------------------------------------------------------------------
+# 3. Reporting
+# ---------------------------------------------------------------------------
+
+class TestMemoReporting:
+
+    def test_health_reports_hit_rates(self):
+        body = {"model": "m", "tools": [_tool("read")], "messages": _agent_history(200)}
+        with mock.patch.object(proxy, "_get_fresh_token", return_value=None):
+            for _ in range(3):
+                proxy.prepare_upstream_request("/chat/completions", json.dumps(body).encode(), [])
+        memo = proxy.health_status()["memo"]
+        assert memo["conversation_hit_rate"] == pytest.approx(2 / 3, abs=0.001)
+        assert memo["tool_hit_rate"] == pytest.approx(2 / 3, abs=0.001)
+        assert memo["conversations_cached"] == 1
+        assert memo["saved_ms"] >= 0
+
+    def test_empty_stats(self):
+        memo = proxy.memo_stats()
+        assert memo["conversation_hit_rate"] is None
+        assert memo["tool_hit_rate"] is None
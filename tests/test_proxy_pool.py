@@ -0,0 +1,128 @@
+"""Tests for the content-filter proxy's pooled upstream connections.
+
+Verifies that:
+- Consecutive requests reuse one keep-alive upstream connection
+- The pool is replaced after PROXY_POOL_IDLE_TIMEOUT of disuse
+- "Try again" (503) statuses are retried, 502/504 are not; /health reports connect/reuse counts
+"""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+
+import pytest
+
+import content_filter_proxy as proxy
+
+
+class _ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _FakeUpstream(BaseHTTPRequestHandler):
+    """Minimal keep-alive chat-completions endpoint."""
+    protocol_version = "HTTP/1.1"
+    fail_next = []      # status codes to return before succeeding
+    seen = []           # (path, body) of every request
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        _FakeUpstream.seen.append((self.path, body))
+        if _FakeUpstream.fail_next:
+            status = _FakeUpstream.fail_next.pop(0)
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        payload = json.dumps({"choices": [{"message": {"content": "hi"}, "finish_reason": "stop"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def proxy_url():
+    _FakeUpstream.fail_next = []
+    _FakeUpstream.seen = []
+    upstream = _serve(_ThreadedServer(("127.0.0.1", 0), _FakeUpstream))
+    front = _serve(proxy.ThreadedHTTPServer(("127.0.0.1", 0), proxy.ProxyHandler))
+    base = f"http://127.0.0.1:{upstream.server_address[1]}"
+    with mock.patch.object(proxy, "UPSTREAM_BASE", base), \
+         mock.patch.object(proxy, "_get_fresh_token", return_value=None), \
+         mock.patch.dict(proxy.POOL_STATS, {k: 0 for k in proxy.POOL_STATS}), \
+         mock.patch.dict(proxy._pool, {"session": None, "last_used": 0.0}):
+        yield f"http://127.0.0.1:{front.server_address[1]}"
+    front.shutdown()
+    upstream.shutdown()
+
+
+def _chat(url):
+    req = urllib.request.Request(f"{url}/chat/completions", method="POST",
+                                 data=json.dumps({"messages": [{"role": "user", "content": "x"}]}).encode(),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return resp.status, json.loads(resp.read())
+
+
+def _health(url):
+    with urllib.request.urlopen(f"{url}/health", timeout=5) as resp:
+        return json.loads(resp.read())
+
+
+class TestUpstreamPool:
+
+    def test_connection_reused_across_requests(self, proxy_url):
+        for _ in range(3):
+            status, body = _chat(proxy_url)
+            assert status == 200
+            assert body["choices"][0]["message"]["content"] == "hi"
+        pool = _health(proxy_url)["pool"]
+        assert pool["requests"] == 3
+        assert pool["connects"] == 1
+        assert pool["reuses"] == 2
+
+    def test_idle_pool_replaced(self, proxy_url):
+        with mock.patch.object(proxy, "POOL_IDLE_TIMEOUT", -1):
+            _chat(proxy_url)
+            _chat(proxy_url)
+        pool = _health(proxy_url)["pool"]
+        assert pool["connects"] == 2
+        assert pool["idle_resets"] == 1
+
+    def test_unavailable_status_retried(self, proxy_url):
+        _FakeUpstream.fail_next = [503]
+        status, _ = _chat(proxy_url)
+        assert status == 200
+        assert len(_FakeUpstream.seen) == 2
+
+    def test_gateway_errors_not_resent(self, proxy_url):
+        # The model may already be generating behind a 502/504
+        _FakeUpstream.fail_next = [502, 504]
+        with mock.patch.object(proxy, "UPSTREAM_ALTERNATE", ""):
+            for code in (502, 504):
+                with pytest.raises(urllib.error.HTTPError) as exc:
+                    _chat(proxy_url)
+                assert exc.value.code == code
+        assert len(_FakeUpstream.seen) == 2
+
+    def test_pool_sized_from_config(self):
+        with mock.patch.object(proxy, "POOL_SIZE", 7):
+            session = proxy._new_upstream_session()
+        adapter = session.get_adapter("https://example.com")
+        assert adapter._pool_maxsize == 7
+        assert adapter.max_retries.read == 0
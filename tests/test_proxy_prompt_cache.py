@@ -0,0 +1,135 @@
+"""Tests for prompt-cache breakpoint injection in the content-filter proxy.
+
+Verifies that:
+- Nothing changes unless PROXY_PROMPT_CACHE is on and the model matches
+- The system prompt is marked on every request; once a conversation is
+  seen growing, the end of the shared prefix and of the request are too
+- Breakpoints go on copies — the conversation memo is never mutated
+- Requests with their own cache_control are left alone
+"""
+
+import json
+from collections import OrderedDict
+from unittest import mock
+
+import pytest
+
+import content_filter_proxy as proxy
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+@pytest.fixture(autouse=True)
+def enabled():
+    with mock.patch.object(proxy, "PROMPT_CACHE", True), \
+            mock.patch.object(proxy, "_get_fresh_token", return_value=None), \
+            mock.patch.object(proxy, "_conversation_memo", OrderedDict()), \
+            mock.patch.object(proxy, "_tool_memo", OrderedDict()), \
+            mock.patch.dict(proxy.MEMO_STATS, {k: 0 for k in proxy.MEMO_STATS}), \
+            mock.patch.dict(proxy.PROMPT_CACHE_STATS, {k: 0 for k in proxy.PROMPT_CACHE_STATS}):
+        yield
+
+
+def _conversation(turns):
+    messages = [{"role": "system", "content": "You are a coding agent."},
+                {"role": "user", "content": "fix the tests"}]
+    for i in range(turns):
+        messages.append({"role": "assistant", "content": None, "tool_calls": [
+            {"id": f"c{i}", "type": "function", "function": {"name": "bash", "arguments": "{}"}}]})
+        messages.append({"role": "tool", "tool_call_id": f"c{i}", "content": f"output {i}"})
+    return messages
+
+
+def _send(messages, model="databricks-claude-sonnet-4-6"):
+    body = json.dumps({"model": model, "messages": messages}).encode()
+    _, out, _, _, _ = proxy.prepare_upstream_request("/chat/completions", body, [])
+    return json.loads(out)["messages"]
+
+
+def _marked(messages):
+    marked = []
+    for i, msg in enumerate(messages):
+        content = msg.get("content")
+        if isinstance(content, list) and any(isinstance(b, dict) and b.get("cache_control") for b in content):
+            marked.append(i)
+    return marked
+
+
+# ---------------------------------------------------------------------------
+# 1. Placement
+# ---------------------------------------------------------------------------
+
+class TestBreakpoints:
+
+    def test_first_turn_marks_system_prompt(self):
+        sent = _send(_conversation(1))
+        assert _marked(sent) == [0]
+        assert sent[0]["content"] == [{"type": "text", "text": "You are a coding agent.",
+                                       "cache_control": EPHEMERAL}]
+
+    def test_growing_conversation_marks_shared_prefix_and_tail(self):
+        _send(_conversation(1))
+        sent = _send(_conversation(3))
+        # 0: system, 3: last message of the previous request, 7: end of this one
+        assert _marked(sent) == [0, 3, 7]
+        assert sent[7]["content"] == [{"type": "text", "text": "output 2", "cache_control": EPHEMERAL}]
+        assert proxy.PROMPT_CACHE_STATS == {"requests": 2, "breakpoints": 4}
+
+    def test_walks_back_past_messages_without_content(self):
+        _send(_conversation(1))
+        messages = _conversation(1) + [{"role": "assistant", "content": None, "tool_calls": [
+            {"id": "c9", "type": "function", "function": {"name": "bash", "arguments": "{}"}}]}]
+        sent = _send(messages)
+        # The trailing tool-call message has no content; the breakpoint lands on
+        # the last message before it, which is also the shared prefix's end
+        assert _marked(sent) == [0, 3]
+
+    def test_at_most_three_added(self):
+        _send(_conversation(2))
+        for turns in range(3, 6):
+            assert len(_marked(_send(_conversation(turns)))) <= 3
+
+
+# ---------------------------------------------------------------------------
+# 2. When not to touch a request
+# ---------------------------------------------------------------------------
+
+class TestSkipped:
+
+    def test_disabled_by_default_setting(self):
+        with mock.patch.object(proxy, "PROMPT_CACHE", False):
+            _send(_conversation(1))
+            assert _marked(_send(_conversation(2))) == []
+
+    def test_other_models_untouched(self):
+        _send(_conversation(1), model="databricks-gemini-2-5-pro")
+        assert _marked(_send(_conversation(2), model="databricks-gemini-2-5-pro")) == []
+
+    def test_client_breakpoints_respected(self):
+        messages = _conversation(1)
+        messages[1] = {"role": "user", "content": [{"type": "text", "text": "hi", "cache_control": EPHEMERAL}]}
+        assert _marked(_send(messages)) == [1]
+
+
+# ---------------------------------------------------------------------------
+# 3. Shared state stays clean
+# ---------------------------------------------------------------------------
+
+class TestNoMutation:
+
+    def test_memo_and_input_not_marked(self):
+        messages = _conversation(2)
+        _send(messages)
+        data = {"model": "databricks-claude-opus-4-6", "messages": _conversation(3)}
+        data["messages"], stable = proxy.sanitize_conversation(data["messages"])
+        proxy.add_cache_breakpoints(data, stable)
+
+        for entry in proxy._conversation_memo.values():
+            assert _marked(entry["cleaned"]) == []
+            assert _marked(entry["messages"]) == []
+        # A later turn still sees the untouched prefix as shared
+        assert _marked(_send(_conversation(4))) == [0, 7, 9]
+
+    def test_health_reports_counts(self):
+        _send(_conversation(1))
+        assert proxy.health_status()["prompt_cache"] == {"enabled": True, "requests": 1, "breakpoints": 1}
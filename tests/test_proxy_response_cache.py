@@ -0,0 +1,265 @@
+"""Tests for the content-filter proxy's response cache.
+
+Verifies that:
+- Only deterministic non-streaming calls are cacheable: temperature 0, an
+  allowlisted path or an allowlisted model — and only when enabled
+- The key ignores key order but not content, path or parameters
+- Entries expire after the TTL and the least recently used are evicted
+- Repeated calls are answered without an upstream round trip in both
+  server modes, and /health reports hits and misses
+"""
+
+import asyncio
+import json
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+
+import pytest
+
+import content_filter_proxy as proxy
+
+
+@pytest.fixture(autouse=True)
+def enabled():
+    with mock.patch.object(proxy, "RESPONSE_CACHE", True), \
+            mock.patch.object(proxy, "RESPONSE_CACHE_PATHS", set()), \
+            mock.patch.object(proxy, "RESPONSE_CACHE_MODELS", []), \
+            mock.patch.object(proxy, "_response_cache", OrderedDict()), \
+            mock.patch.dict(proxy.RESPONSE_CACHE_STATS, {k: 0 for k in proxy.RESPONSE_CACHE_STATS}), \
+            mock.patch.object(proxy, "_get_fresh_token", return_value=None):
+        yield
+
+
+def _title_request(**overrides):
+    return {"model": "databricks-claude-haiku-4-5", "temperature": 0, "max_tokens": 32,
+            "messages": [{"role": "system", "content": "Generate a short title."},
+                         {"role": "user", "content": "fix the flaky proxy tests"}], **overrides}
+
+
+def _key(data, path="/chat/completions"):
+    return proxy.response_cache_key(path, data)
+
+
+# ---------------------------------------------------------------------------
+# 1. What is cacheable
+# ---------------------------------------------------------------------------
+
+class TestCacheable:
+
+    def test_temperature_zero(self):
+        assert _key(_title_request()) is not None
+        assert _key(_title_request(temperature=0.0)) is not None
+
+    def test_sampled_or_streaming_not_cached(self):
+        assert _key(_title_request(temperature=0.7)) is None
+        assert _key({k: v for k, v in _title_request().items() if k != "temperature"}) is None
+        assert _key(_title_request(stream=True)) is None
+
+    def test_non_numeric_temperature_not_cached(self):
+        for temperature in (False, "0", None, [0]):
+            assert _key(_title_request(temperature=temperature)) is None, temperature
+
+    def test_disabled(self):
+        with mock.patch.object(proxy, "RESPONSE_CACHE", False):
+            assert _key(_title_request()) is None
+
+    def test_allowlisted_path(self):
+        with mock.patch.object(proxy, "RESPONSE_CACHE_PATHS", {"/embeddings"}):
+            assert _key({"model": "m", "input": "x"}, "/embeddings") is not None
+            assert _key({"model": "m", "input": "x"}, "/chat/completions") is None
+
+    def test_allowlisted_model(self):
+        with mock.patch.object(proxy, "RESPONSE_CACHE_MODELS", ["haiku"]):
+            assert _key(_title_request(temperature=1)) is not None
+            assert _key(_title_request(temperature=1, model="databricks-claude-opus-4-6")) is None
+
+
+# ---------------------------------------------------------------------------
+# 2. Key normalization
+# ---------------------------------------------------------------------------
+
+class TestKey:
+
+    def test_key_order_ignored(self):
+        data = _title_request()
+        assert _key(data) == _key(dict(reversed(list(data.items()))))
+
+    def test_content_path_and_parameters_matter(self):
+        base = _key(_title_request())
+        assert _key(_title_request(max_tokens=64)) != base
+        assert _key(_title_request(model="databricks-gpt-5")) != base
+        assert _key(_title_request(), "/v1/chat/completions") != base
+        other = _title_request()
+        other["messages"][1]["content"] = "something else"
+        assert _key(other) != base
+
+    def test_sanitized_request_keyed(self):
+        # An empty text block the sanitizer strips doesn't split the cache
+        noisy = _title_request()
+        noisy["messages"][1]["content"] = [{"type": "text", "text": " "},
+                                           {"type": "text", "text": "fix the flaky proxy tests"}]
+        clean = _title_request()
+        clean["messages"][1]["content"] = [{"type": "text", "text": "fix the flaky proxy tests"}]
+        keys = [proxy.prepare_upstream_request("/chat/completions", json.dumps(d).encode(), [])[4]
+                for d in (noisy, clean)]
+        assert keys[0] == keys[1] is not None
+
+
+# ---------------------------------------------------------------------------
+# 3. TTL and LRU
+# ---------------------------------------------------------------------------
+
+class TestStore:
+
+    def test_get_put(self):
+        assert proxy.response_cache_get("k") is None
+        proxy.response_cache_put("k", 200, [("Content-Type", "application/json")], b"{}")
+        assert proxy.response_cache_get("k") == ([("Content-Type", "application/json")], b"{}")
+        assert proxy.response_cache_stats()["hits"] == 1
+        assert proxy.response_cache_stats()["misses"] == 1
+
+    def test_errors_not_stored(self):
+        for status in (400, 429, 500):
+            proxy.response_cache_put("k", status, [], b"")
+        assert proxy.response_cache_stats()["entries"] == 0
+
+    def test_expiry(self):
+        with mock.patch.object(proxy, "RESPONSE_CACHE_TTL", 0.05):
+            proxy.response_cache_put("k", 200, [], b"{}")
+            time.sleep(0.1)
+        assert proxy.response_cache_get("k") is None
+        assert proxy.response_cache_stats()["expired"] == 1
+        assert proxy.response_cache_stats()["entries"] == 0
+
+    def test_lru_eviction(self):
+        with mock.patch.object(proxy, "RESPONSE_CACHE_SIZE", 2):
+            proxy.response_cache_put("a", 200, [], b"a")
+            proxy.response_cache_put("b", 200, [], b"b")
+            proxy.response_cache_get("a")
+            proxy.response_cache_put("c", 200, [], b"c")
+        assert proxy.response_cache_get("b") is None
+        assert proxy.response_cache_get("a") is not None
+        assert proxy.response_cache_stats()["evictions"] == 1
+
+
+# ---------------------------------------------------------------------------
+# 4. End to end
+# ---------------------------------------------------------------------------
+
+class _ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _CountingUpstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    hits = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        _CountingUpstream.hits += 1
+        payload = json.dumps({"choices": [{"message": {"content": f"title {_CountingUpstream.hits}"},
+                                           "finish_reason": "stop"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def upstream():
+    _CountingUpstream.hits = 0
+    server = _serve(_ThreadedServer(("127.0.0.1", 0), _CountingUpstream))
+    with mock.patch.object(proxy, "UPSTREAM_BASE", f"http://127.0.0.1:{server.server_address[1]}"), \
+            mock.patch.object(proxy, "UPSTREAM_ALTERNATE", ""), \
+            mock.patch.object(proxy, "_upstreams", {}), \
+            mock.patch.object(proxy, "_limiters", {}), \
+            mock.patch.dict(proxy.POOL_STATS, {k: 0 for k in proxy.POOL_STATS}), \
+            mock.patch.dict(proxy._pool, {"session": None, "last_used": 0.0}):
+        yield _CountingUpstream
+    server.shutdown()
+
+
+@pytest.fixture
+def proxy_url(upstream):
+    front = _serve(proxy.ThreadedHTTPServer(("127.0.0.1", 0), proxy.ProxyHandler))
+    yield f"http://127.0.0.1:{front.server_address[1]}"
+    front.shutdown()
+
+
+def _chat(url, data):
+    req = urllib.request.Request(f"{url}/chat/completions", method="POST", data=json.dumps(data).encode(),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return resp.headers["Content-Type"], json.loads(resp.read())["choices"][0]["message"]["content"]
+
+
+def _health(url):
+    with urllib.request.urlopen(f"{url}/health", timeout=10) as resp:
+        return json.loads(resp.read())["response_cache"]
+
+
+class TestThreaded:
+
+    def test_repeat_served_from_cache(self, proxy_url, upstream):
+        first = _chat(proxy_url, _title_request())
+        assert _chat(proxy_url, _title_request()) == first == ("application/json", "title 1")
+        assert upstream.hits == 1
+        health = _health(proxy_url)
+        assert (health["hits"], health["misses"], health["entries"]) == (1, 1, 1)
+
+    def test_sampled_calls_always_upstream(self, proxy_url, upstream):
+        _chat(proxy_url, _title_request(temperature=0.7))
+        assert _chat(proxy_url, _title_request(temperature=0.7)) == ("application/json", "title 2")
+        assert _health(proxy_url)["misses"] == 0
+
+
+@pytest.fixture
+def async_proxy_url(upstream):
+    pytest.importorskip("httpx")
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    holder = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        holder["server"] = loop.run_until_complete(proxy.start_async_server("127.0.0.1", 0))
+        started.set()
+        loop.run_forever()
+
+    with mock.patch.object(proxy, "_async_client", None):
+        threading.Thread(target=run, daemon=True).start()
+        started.wait(5)
+        yield f"http://127.0.0.1:{holder['server'].sockets[0].getsockname()[1]}"
+
+        async def shutdown():
+            holder["server"].close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+class TestAsyncio:
+
+    def test_repeat_served_from_cache(self, async_proxy_url, upstream):
+        first = _chat(async_proxy_url, _title_request())
+        assert _chat(async_proxy_url, _title_request()) == first == ("application/json", "title 1")
+        assert upstream.hits == 1
+        assert _health(async_proxy_url)["hits"] == 1
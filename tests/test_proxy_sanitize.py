@@ -0,0 +1,253 @@
+"""Tests for the content-filter proxy's single-pass sanitize_messages.
+
+Verifies that:
+- The single-pass sanitizer gives exactly the result of the original
+  multi-pass algorithm (kept below as a reference) on thousands of
+  randomly generated conversations, Anthropic and OpenAI formats mixed
+- Cascading orphans are resolved in one sweep
+- Nothing is logged per message at INFO
+- 1k and 10k message histories sanitize in linear time (benchmark, skipped
+  unless PROXY_BENCHMARKS=1)
+"""
+
+import logging
+import os
+import random
+import time
+
+import pytest
+
+import content_filter_proxy as proxy
+
+
+# ---------------------------------------------------------------------------
+# Reference: the original multi-pass implementation (logging removed)
+# ---------------------------------------------------------------------------
+
+def _reference_single_pass(messages):
+    cleaned = []
+    for msg in messages:
+        role = msg.get("role", "")
+        content = msg.get("content")
+
+        prev_tool_ids = set()
+        for j in range(len(cleaned) - 1, -1, -1):
+            if cleaned[j].get("role") == "assistant":
+                prev_tool_ids = proxy._extract_tool_ids_from_message(cleaned[j])
+                break
+
+        if isinstance(content, list):
+            filtered = []
+            for block in content:
+                if not isinstance(block, dict):
+                    filtered.append(block)
+                    continue
+                if block.get("type") == "text" and block.get("text", "").strip() == "":
+                    continue
+                if block.get("type") == "tool_result":
+                    tool_use_id = block.get("tool_use_id")
+                    if tool_use_id and tool_use_id not in prev_tool_ids:
+                        continue
+                filtered.append(block)
+            if not filtered:
+                if role == "assistant":
+                    msg = {**msg, "content": filtered}
+                else:
+                    continue
+            else:
+                msg = {**msg, "content": filtered}
+        elif role == "tool":
+            tool_call_id = msg.get("tool_call_id")
+            if tool_call_id and tool_call_id not in prev_tool_ids:
+                continue
+        elif content is None and role == "assistant" and not msg.get("tool_calls"):
+            msg = {**msg, "content": "."}
+        elif isinstance(content, str) and content.strip() == "":
+            if role == "assistant":
+                msg = {**msg, "content": "."}
+            else:
+                continue
+        cleaned.append(msg)
+    return cleaned
+
+
+def _reference_sanitize(messages):
+    if not isinstance(messages, list):
+        return messages
+    prev_len = -1
+    pass_num = 0
+    result = list(messages)
+    while len(result) != prev_len and pass_num < 5:
+        prev_len = len(result)
+        pass_num += 1
+        result = _reference_single_pass(result)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Random conversations
+# ---------------------------------------------------------------------------
+
+_TEXTS = ["", " ", "\n\t", "hello", "ok", "  done  "]
+
+
+def _random_block(rng, ids):
+    kind = rng.random()
+    if kind < 0.35:
+        return {"type": "text", "text": rng.choice(_TEXTS)}
+    if kind < 0.6:
+        return {"type": "tool_result", "tool_use_id": rng.choice(ids + [None, ""]),
+                "content": "result"}
+    if kind < 0.8:
+        return {"type": "tool_use", "id": rng.choice(ids), "name": "read", "input": {}}
+    if kind < 0.9:
+        return {"type": "image", "source": {}}
+    return "raw string block"
+
+
+def _random_message(rng, ids):
+    role = rng.choice(["user", "assistant", "assistant", "tool", "system"])
+    msg = {"role": role}
+    shape = rng.random()
+    if shape < 0.5:
+        msg["content"] = [_random_block(rng, ids) for _ in range(rng.randint(0, 4))]
+    elif shape < 0.8:
+        msg["content"] = rng.choice(_TEXTS)
+    elif shape < 0.9:
+        msg["content"] = None
+    if role == "assistant" and rng.random() < 0.4:
+        msg["tool_calls"] = [{"id": rng.choice(ids + [None]), "type": "function",
+                              "function": {"name": "bash", "arguments": "{}"}}
+                             for _ in range(rng.randint(0, 3))]
+    if role == "tool" and rng.random() < 0.9:
+        msg["tool_call_id"] = rng.choice(ids + [None, ""])
+    return msg
+
+
+def _random_conversation(rng, length):
+    ids = [f"call_{i}" for i in range(rng.randint(1, 8))]
+    return [_random_message(rng, ids) for _ in range(length)]
+
+
+def _agent_history(n):
+    """A realistic agent transcript: user turn, tool calls, tool results."""
+    messages = [{"role": "system", "content": "You are a coding agent."}]
+    for i in range(n // 4):
+        messages.append({"role": "user", "content": [{"type": "text", "text": f"step {i}"}]})
+        messages.append({"role": "assistant", "content": [
+            {"type": "text", "text": ""},
+            {"type": "tool_use", "id": f"toolu_{i}", "name": "read", "input": {"path": "x"}}]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"toolu_{i}", "content": "file body"},
+            {"type": "tool_result", "tool_use_id": f"toolu_{i - 1}", "content": "stale"}]})
+        messages.append({"role": "assistant", "content": "done" if i % 7 else "  "})
+    return messages
+
+
+def _long_tool_run(n):
+    """One assistant turn followed by *n* tool results."""
+    ids = [f"call_{i}" for i in range(n)]
+    messages = [{"role": "assistant", "content": None,
+                 "tool_calls": [{"id": i} for i in ids]}]
+    return messages + [{"role": "tool", "tool_call_id": i, "content": "ok"} for i in ids]
+
+
+# ---------------------------------------------------------------------------
+# 1. Equivalence with the multi-pass algorithm
+# ---------------------------------------------------------------------------
+
+class TestEquivalence:
+
+    def test_random_conversations_match_reference(self):
+        rng = random.Random(20240611)
+        for case in range(3000):
+            messages = _random_conversation(rng, rng.randint(0, 25))
+            assert proxy.sanitize_messages(messages) == _reference_sanitize(messages), case
+
+    def test_agent_history_matches_reference(self):
+        messages = _agent_history(400)
+        assert proxy.sanitize_messages(messages) == _reference_sanitize(messages)
+
+    def test_long_tool_run_matches_reference(self):
+        messages = _long_tool_run(2000)
+        assert proxy.sanitize_messages(messages) == _reference_sanitize(messages)
+
+    def test_input_not_mutated(self):
+        rng = random.Random(7)
+        messages = _random_conversation(rng, 50)
+        snapshot = repr(messages)
+        proxy.sanitize_messages(messages)
+        assert repr(messages) == snapshot
+
+    def test_non_list_passthrough(self):
+        assert proxy.sanitize_messages(None) is None
+        assert proxy.sanitize_messages("text") == "text"
+
+
+# ---------------------------------------------------------------------------
+# 2. Cascading orphans in one sweep
+# ---------------------------------------------------------------------------
+
+class TestCascade:
+
+    def test_results_checked_against_last_kept_assistant(self):
+        messages = [
+            {"role": "assistant", "content": None, "tool_calls": [{"id": "a"}]},
+            {"role": "tool", "tool_call_id": "a", "content": "ok"},
+            {"role": "assistant", "content": [{"type": "tool_use", "id": "b"}]},
+            {"role": "tool", "tool_call_id": "a", "content": "orphan"},
+            {"role": "user", "content": [{"type": "tool_result", "tool_use_id": "a"},
+                                         {"type": "text", "text": " "}]},
+            {"role": "user", "content": [{"type": "tool_result", "tool_use_id": "b"}]},
+        ]
+        result = proxy.sanitize_messages(messages)
+        assert [m["role"] for m in result] == ["assistant", "tool", "assistant", "user"]
+        assert result[-1]["content"] == [{"type": "tool_result", "tool_use_id": "b"}]
+
+    def test_no_per_message_info_logging(self, caplog):
+        with caplog.at_level(logging.INFO, logger=proxy.log.name):
+            proxy.sanitize_messages(_agent_history(200))
+        info = [r for r in caplog.records if r.levelno >= logging.INFO]
+        assert len(info) == 1
+        assert "Sanitized 201 messages" in info[0].getMessage()
+
+    def test_clean_history_logs_nothing(self, caplog):
+        messages = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+        with caplog.at_level(logging.INFO, logger=proxy.log.name):
+            assert proxy.sanitize_messages(messages) == messages
+        assert not caplog.records
+
+
+# ---------------------------------------------------------------------------
+# 3. Benchmark: 1k / 10k messages (timing; opt in with PROXY_BENCHMARKS=1)
+# ---------------------------------------------------------------------------
+
+benchmark = pytest.mark.skipif(not os.environ.get("PROXY_BENCHMARKS"),
+                               reason="timing benchmark; set PROXY_BENCHMARKS=1 to run")
+
+
+def _best_of(fn, arg, runs=3):
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+@benchmark
+class TestBenchmark:
+
+    def test_linear_scaling(self):
+        small, large = _agent_history(1000), _agent_history(10000)
+        t_small = _best_of(proxy.sanitize_messages, small)
+        t_large = _best_of(proxy.sanitize_messages, large)
+        # 10x the messages: well under the 100x a quadratic pass would take
+        assert t_large < t_small * 30
+
+    def test_long_tool_run_not_quadratic(self):
+        # The reference scans back through every kept message for each tool message
+        messages = _long_tool_run(2000)
+        t_new = _best_of(proxy.sanitize_messages, messages, runs=1)
+        t_ref = _best_of(_reference_sanitize, messages, runs=1)
+        assert t_new * 20 < t_ref
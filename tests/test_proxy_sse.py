@@ -0,0 +1,262 @@
+"""Tests for the content-filter proxy's SSE passthrough fast path.
+
+Verifies that:
+- Plain token events are forwarded byte-for-byte without a JSON parse
+- Lines split across upstream reads are reassembled before processing
+- databricks-tool-call streams and finish_reason are still rewritten
+- The threaded server writes one chunk per upstream read, keeps non-ASCII
+  tokens intact and streams bodies that aren't chunk-encoded
+- An upstream error to a streaming request reaches the client with its body,
+  in both server modes
+"""
+
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+
+import pytest
+
+import content_filter_proxy as proxy
+
+
+def _event(delta, finish_reason=None):
+    return f"data: {json.dumps({'choices': [{'delta': delta, 'finish_reason': finish_reason}]})}\n\n".encode()
+
+
+def _token(text):
+    return _event({"content": text})
+
+
+def _tool_call_stream(name="read", args=None):
+    args = json.dumps({"name": name, **(args or {"path": "x"})})
+    return [
+        _event({"tool_calls": [{"index": 0, "id": "c1", "function": {
+            "name": "databricks-tool-call", "arguments": ""}}]}),
+        _event({"tool_calls": [{"index": 0, "function": {"arguments": args[:10]}}]}),
+        _event({"tool_calls": [{"index": 0, "function": {"arguments": args[10:]}}]}),
+        _event({}, "stop"),
+        b"data: [DONE]\n\n",
+    ]
+
+
+def _events(raw):
+    return [json.loads(line[6:]) for line in raw.decode().splitlines()
+            if line.startswith("data: ") and line != "data: [DONE]"]
+
+
+# ---------------------------------------------------------------------------
+# 1. SSEProcessor byte path
+# ---------------------------------------------------------------------------
+
+class TestFastPath:
+
+    def test_tokens_forwarded_unparsed(self):
+        processor = proxy.SSEProcessor()
+        stream = [_token(f"tok{i}") for i in range(20)] + [_event({}, "stop"), b"data: [DONE]\n\n"]
+        with mock.patch.object(proxy.json, "loads", wraps=json.loads) as loads:
+            out = b"".join(processor.feed(chunk) for chunk in stream) + processor.finish()
+        assert out == b"".join(stream)
+        assert loads.call_count == 0
+
+    def test_partial_lines_held_until_complete(self):
+        processor = proxy.SSEProcessor()
+        raw = _token("héllo") + _token("wörld")
+        out = b""
+        for i in range(len(raw)):
+            out += processor.feed(raw[i:i + 1])
+            # Never emits a line without its newline
+            assert out.endswith(b"\n") or not out
+        assert out + processor.finish() == raw
+
+    def test_unterminated_final_line_flushed(self):
+        processor = proxy.SSEProcessor()
+        assert processor.feed(b"data: [DONE]") == b""
+        assert processor.finish() == b"data: [DONE]"
+
+
+class TestRewritePath:
+
+    def test_tool_call_remapped_across_reads(self):
+        processor = proxy.SSEProcessor()
+        raw = b"".join(_tool_call_stream())
+        # Split into arbitrary reads that cut through events
+        reads = [raw[i:i + 37] for i in range(0, len(raw), 37)]
+        out = b"".join(processor.feed(r) for r in reads) + processor.finish()
+
+        events = _events(out)
+        names = [tc["function"].get("name") for e in events
+                 for tc in e["choices"][0]["delta"].get("tool_calls", [])]
+        args = "".join(tc["function"].get("arguments", "") for e in events
+                       for tc in e["choices"][0]["delta"].get("tool_calls", []))
+        assert "read" in names and "databricks-tool-call" not in names
+        assert json.loads(args) == {"path": "x"}
+        assert events[-1]["choices"][0]["finish_reason"] == "tool_calls"
+        assert out.rstrip().endswith(b"data: [DONE]")
+
+    def test_stop_untouched_without_tool_calls(self):
+        processor = proxy.SSEProcessor()
+        raw = _token("a") + _event({}, "stop")
+        assert processor.feed(raw) == raw
+
+
+# ---------------------------------------------------------------------------
+# 2. Threaded server end to end
+# ---------------------------------------------------------------------------
+
+class _ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StreamingUpstream(BaseHTTPRequestHandler):
+    """Streams ``reads`` (a list of byte strings), one write per entry."""
+    protocol_version = "HTTP/1.1"
+    reads = []
+    chunked = True
+    status = 200
+    content_type = "text/event-stream"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(self.status)
+        self.send_header("Content-Type", self.content_type)
+        if self.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        for data in self.reads:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n" if self.chunked else data)
+            self.wfile.flush()
+            time.sleep(0.02)
+        if self.chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def proxy_url():
+    _StreamingUpstream.reads = []
+    _StreamingUpstream.chunked = True
+    _StreamingUpstream.status = 200
+    _StreamingUpstream.content_type = "text/event-stream"
+    upstream = _serve(_ThreadedServer(("127.0.0.1", 0), _StreamingUpstream))
+    front = _serve(proxy.ThreadedHTTPServer(("127.0.0.1", 0), proxy.ProxyHandler))
+    base = f"http://127.0.0.1:{upstream.server_address[1]}"
+    with mock.patch.object(proxy, "UPSTREAM_BASE", base), \
+         mock.patch.object(proxy, "_get_fresh_token", return_value=None), \
+         mock.patch.dict(proxy.POOL_STATS, {k: 0 for k in proxy.POOL_STATS}), \
+         mock.patch.dict(proxy._pool, {"session": None, "last_used": 0.0}):
+        yield f"http://127.0.0.1:{front.server_address[1]}"
+    front.shutdown()
+    upstream.shutdown()
+
+
+ERROR_BODY = b'{"error":{"message":"bad request: context too long"}}'
+
+
+def _stream(url):
+    req = urllib.request.Request(f"{url}/chat/completions", method="POST",
+                                 data=json.dumps({"stream": True, "messages": []}).encode(),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return resp.read()
+
+
+class TestThreadedStreaming:
+
+    def test_one_chunk_per_upstream_read(self, proxy_url):
+        _StreamingUpstream.reads = [_token("a") + _token("b") + _token("c"), b"data: [DONE]\n\n"]
+        with mock.patch.object(proxy.ProxyHandler, "_send_chunk", autospec=True,
+                               side_effect=proxy.ProxyHandler._send_chunk) as send:
+            body = _stream(proxy_url)
+        assert body == b"".join(_StreamingUpstream.reads)
+        # Two upstream reads + the terminating zero-length chunk
+        assert send.call_count == 3
+
+    def test_non_ascii_tokens_intact(self, proxy_url):
+        _StreamingUpstream.reads = [_token("héllo ✓"), b"data: [DONE]\n\n"]
+        events = _events(_stream(proxy_url))
+        assert events[0]["choices"][0]["delta"]["content"] == "héllo ✓"
+
+    def test_tool_calls_rewritten(self, proxy_url):
+        _StreamingUpstream.reads = _tool_call_stream("bash", {"command": "ls"})
+        events = _events(_stream(proxy_url))
+        assert events[0]["choices"][0]["delta"]["tool_calls"][0]["function"]["name"] == "bash"
+        assert events[-1]["choices"][0]["finish_reason"] == "tool_calls"
+
+    def test_identity_body_streamed(self, proxy_url):
+        _StreamingUpstream.chunked = False
+        _StreamingUpstream.reads = [_token("x"), _token("y"), b"data: [DONE]\n\n"]
+        assert _stream(proxy_url) == b"".join(_StreamingUpstream.reads)
+
+    def test_error_body_reaches_client(self, proxy_url):
+        _StreamingUpstream.status = 400
+        _StreamingUpstream.content_type = "application/json"
+        _StreamingUpstream.reads = [ERROR_BODY]
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            _stream(proxy_url)
+        assert exc.value.code == 400
+        assert exc.value.read() == ERROR_BODY
+
+
+# ---------------------------------------------------------------------------
+# 3. asyncio server end to end
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def async_proxy_url(proxy_url):
+    pytest.importorskip("httpx")
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    holder = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        holder["server"] = loop.run_until_complete(proxy.start_async_server("127.0.0.1", 0))
+        started.set()
+        loop.run_forever()
+
+    with mock.patch.object(proxy, "_async_client", None):
+        threading.Thread(target=run, daemon=True).start()
+        started.wait(5)
+        yield f"http://127.0.0.1:{holder['server'].sockets[0].getsockname()[1]}"
+
+        async def shutdown():
+            holder["server"].close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+class TestAsyncioStreaming:
+
+    def test_tokens_streamed(self, async_proxy_url):
+        _StreamingUpstream.reads = [_token("héllo ✓"), b"data: [DONE]\n\n"]
+        assert _stream(async_proxy_url) == b"".join(_StreamingUpstream.reads)
+
+    def test_error_body_reaches_client(self, async_proxy_url):
+        _StreamingUpstream.status = 400
+        _StreamingUpstream.content_type = "application/json"
+        _StreamingUpstream.reads = [ERROR_BODY]
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            _stream(async_proxy_url)
+        assert exc.value.code == 400
+        assert exc.value.read() == ERROR_BODY
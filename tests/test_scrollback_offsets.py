@@ -0,0 +1,133 @@
+"""Tests for server-side output offsets used by the client scrollback cache.
+
+Verifies that:
+- _record_output() advances the offset and bounds the history ring
+- _history_since() returns the delta, or None once it has aged out
+- /api/session/attach with ``since`` returns only the delta
+- Poll responses report the offset their output ends at
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from unittest import mock
+
+import pytest
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+def _make_session():
+    return {
+        "pid": os.getpid(), "master_fd": 0,
+        "output_buffer": deque(maxlen=1000),
+        "output_offset": 0,
+        "history": deque(),
+        "history_chars": 0,
+        "lock": threading.Lock(),
+        "last_poll_time": time.time(), "created_at": time.time(),
+    }
+
+
+# ---------------------------------------------------------------------------
+# 1. Offsets and history
+# ---------------------------------------------------------------------------
+
+class TestHistory:
+
+    def test_offset_counts_all_output(self):
+        app_module = _get_app()
+        session = _make_session()
+        assert app_module._record_output(session, "hello ") == 6
+        assert app_module._record_output(session, "world") == 11
+        assert session["output_offset"] == 11
+        assert list(session["output_buffer"]) == ["hello ", "world"]
+
+    def test_delta_since_offset(self):
+        app_module = _get_app()
+        session = _make_session()
+        for chunk in ("abc", "def", "ghi"):
+            app_module._record_output(session, chunk)
+        assert app_module._history_since(session, 9) == ""
+        assert app_module._history_since(session, 3) == "defghi"
+        assert app_module._history_since(session, 4) == "efghi"
+        assert app_module._history_since(session, 0) == "abcdefghi"
+
+    def test_history_bounded_and_gap_detected(self):
+        app_module = _get_app()
+        session = _make_session()
+        with mock.patch.object(app_module, "OUTPUT_HISTORY_CHARS", 10):
+            for chunk in ("aaaa", "bbbb", "cccc", "dddd"):
+                app_module._record_output(session, chunk)
+        assert session["history_chars"] == 12
+        assert [c for _, c in session["history"]] == ["bbbb", "cccc", "dddd"]
+        assert app_module._history_since(session, 2) is None
+        assert app_module._history_since(session, 4) == "bbbbccccdddd"
+
+    def test_offset_from_the_future_is_a_gap(self):
+        app_module = _get_app()
+        session = _make_session()
+        app_module._record_output(session, "abc")
+        assert app_module._history_since(session, 99) is None
+
+
+# ---------------------------------------------------------------------------
+# 2. Endpoints
+# ---------------------------------------------------------------------------
+
+class TestEndpoints:
+
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        app_module = _get_app()
+        app_module.app_owner = "test@example.com"
+        self.session = _make_session()
+        for chunk in ("one\r\n", "two\r\n", "three\r\n"):
+            app_module._record_output(self.session, chunk)
+        with app_module.sessions_lock:
+            app_module.sessions["off-1"] = self.session
+        self.app_module = app_module
+        self.client = app_module.app.test_client()
+        yield
+        with app_module.sessions_lock:
+            app_module.sessions.clear()
+
+    def test_attach_with_since_returns_delta(self):
+        resp = self.client.post("/api/session/attach", json={"session_id": "off-1", "since": 5})
+        data = resp.get_json()
+        assert data["delta"] == "two\r\nthree\r\n"
+        assert data["output_offset"] == 17
+        # Delivered via the delta, so the next poll mustn't repeat it
+        assert len(self.session["output_buffer"]) == 0
+
+    def test_attach_gap_returns_null_delta(self):
+        with mock.patch.object(self.app_module, "OUTPUT_HISTORY_CHARS", 1):
+            self.app_module._record_output(self.session, "four\r\n")
+        resp = self.client.post("/api/session/attach", json={"session_id": "off-1", "since": 5})
+        data = resp.get_json()
+        assert data["delta"] is None
+        assert data["output_offset"] == 23
+        assert len(self.session["output_buffer"]) == 4
+
+    def test_attach_without_since_unchanged(self):
+        resp = self.client.post("/api/session/attach", json={"session_id": "off-1"})
+        data = resp.get_json()
+        assert data["delta"] is None
+        assert data["output"] == ["one\r\n", "two\r\n", "three\r\n"]
+
+    def test_output_batch_reports_offset(self):
+        resp = self.client.post("/api/output-batch", json={"session_ids": ["off-1"]})
+        out = resp.get_json()["outputs"]["off-1"]
+        assert out["output"] == "one\r\ntwo\r\nthree\r\n"
+        assert out["offset"] == 17
+
+    def test_output_reports_offset(self):
+        resp = self.client.post("/api/output", json={"session_id": "off-1"})
+        assert resp.get_json()["offset"] == 17
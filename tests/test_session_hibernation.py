@@ -0,0 +1,295 @@
+"""Tests for idle session hibernation.
+
+Verifies that:
+- hibernate_tree()/resume_tree() stop and continue the whole process tree
+- Hibernating spills the output buffer to disk and waking restores it
+- Polling or attaching resumes a hibernated session
+- The hibernation timer skips sessions that are still using CPU
+- The PTY reader blocks while hibernated and picks up output after wake
+"""
+
+import os
+import pty
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+import session_resources
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+def _states(pids):
+    states = []
+    for pid in pids:
+        try:
+            states.append(session_resources._read_stat_fields(pid)[0])
+        except OSError:
+            pass
+    return states
+
+
+def _make_session(pid, chunks=()):
+    return {
+        "pid": pid, "master_fd": 0,
+        "output_buffer": deque(chunks, maxlen=1000),
+        "lock": threading.Lock(),
+        "last_poll_time": time.time(), "created_at": time.time(),
+        "last_output_time": time.time(),
+        "hibernation": None,
+        "wake": threading.Event(),
+    }
+
+
+@pytest.fixture
+def shell_tree():
+    proc = subprocess.Popen(
+        ["bash", "-c", "sleep 30 & sleep 30; wait"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        preexec_fn=os.setsid,
+    )
+    time.sleep(0.5)
+    yield proc
+    os.killpg(proc.pid, 9)
+    proc.wait()
+
+
+@pytest.fixture
+def app_module(tmp_path):
+    app_module = _get_app()
+    with mock.patch.object(app_module, "HIBERNATE_DIR", str(tmp_path)):
+        yield app_module
+    with app_module.sessions_lock:
+        app_module.sessions.clear()
+
+
+# ---------------------------------------------------------------------------
+# 1. Freezing the process tree
+# ---------------------------------------------------------------------------
+
+class TestHibernateTree:
+
+    def test_sigstop_and_resume_whole_tree(self, shell_tree):
+        with mock.patch.object(session_resources, "HIBERNATE_MODE", "stop"):
+            mechanism = session_resources.hibernate_tree(shell_tree.pid, None)
+        assert mechanism == "sigstop"
+        time.sleep(0.2)  # Signal delivery is asynchronous
+        pids = session_resources.session_pids(shell_tree.pid)
+        assert set(_states(pids)) == {"T"}
+
+        session_resources.resume_tree(shell_tree.pid, None, mechanism)
+        time.sleep(0.1)
+        assert "T" not in _states(pids)
+
+    def test_freeze_used_when_cgroup_supports_it(self, tmp_path):
+        (tmp_path / "cgroup.freeze").write_text("0")
+        with mock.patch.object(session_resources, "HIBERNATE_MODE", "stop"):
+            mechanism = session_resources.hibernate_tree(os.getpid(), str(tmp_path))
+        assert mechanism == "freeze"
+        assert (tmp_path / "cgroup.freeze").read_text() == "1"
+        session_resources.resume_tree(os.getpid(), str(tmp_path), mechanism)
+        assert (tmp_path / "cgroup.freeze").read_text() == "0"
+
+    def test_dead_session_not_stopped(self):
+        with mock.patch.object(session_resources, "HIBERNATE_MODE", "stop"):
+            assert session_resources.hibernate_tree(999999999, None) is None
+
+
+# ---------------------------------------------------------------------------
+# 2. Buffer spill and restore
+# ---------------------------------------------------------------------------
+
+class TestSpill:
+
+    def test_hibernate_spills_and_wake_restores(self, app_module, tmp_path):
+        session = _make_session(999999999, ["line1\r\n", "line2\r\n"])
+        app_module._hibernate_session("sp-1", session)
+
+        assert session["hibernation"]["spilled"] is True
+        assert len(session["output_buffer"]) == 0
+        assert (tmp_path / "sp-1.out").read_bytes() == b"line1\r\nline2\r\n"
+        assert not session["wake"].is_set()
+
+        app_module._wake_session("sp-1", session)
+        assert session["hibernation"] is None
+        assert list(session["output_buffer"]) == ["line1\r\nline2\r\n"]
+        assert not (tmp_path / "sp-1.out").exists()
+        assert session["wake"].is_set()
+
+    def test_compacted_buffer_kept_when_spill_fails(self, app_module):
+        session = _make_session(999999999, ["a", "b"])
+        with mock.patch.object(app_module, "HIBERNATE_DIR", "/proc/forbidden"):
+            app_module._hibernate_session("sp-2", session)
+            assert session["hibernation"]["buffer"] == "ab"
+            app_module._wake_session("sp-2", session)
+        assert list(session["output_buffer"]) == ["ab"]
+
+    def test_output_poll_wakes_session(self, app_module):
+        session = _make_session(999999999, ["hello"])
+        with app_module.sessions_lock:
+            app_module.sessions["sp-3"] = session
+        app_module._hibernate_session("sp-3", session)
+
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module, "check_authorization", return_value=(True, None)):
+            resp = client.post("/api/output", json={"session_id": "sp-3"})
+        assert resp.get_json()["output"] == "hello"
+        assert session["hibernation"] is None
+
+    def test_sessions_list_reports_hibernated(self, app_module):
+        session = _make_session(os.getsid(0))
+        session["hibernation"] = {"since": time.time(), "mechanism": None,
+                                  "spilled": False, "buffer": ""}
+        with app_module.sessions_lock:
+            app_module.sessions["sp-4"] = session
+        client = app_module.app.test_client()
+        with mock.patch.object(app_module, "check_authorization", return_value=(True, None)):
+            data = client.get("/api/sessions").get_json()
+        assert data[0]["hibernated"] is True
+        # Listing sessions must not wake them
+        assert session["hibernation"] is not None
+
+
+# ---------------------------------------------------------------------------
+# 3. Idle checker
+# ---------------------------------------------------------------------------
+
+class TestHibernateDeadline:
+
+    def _fire(self, app_module, session_id, usage):
+        with mock.patch.object(session_resources, "HIBERNATE_AFTER_SECONDS", 60), \
+             mock.patch.object(session_resources, "sessions_usage", side_effect=usage), \
+             mock.patch.object(app_module, "_hibernate_session") as mock_hibernate, \
+             mock.patch.object(app_module.session_scheduler, "schedule") as mock_schedule:
+            for _ in usage:
+                app_module._on_hibernate_deadline(session_id)
+        return mock_hibernate, mock_schedule
+
+    def test_idle_quiet_session_hibernated(self, app_module):
+        session = _make_session(4242)
+        session["last_poll_time"] = session["last_output_time"] = time.time() - 600
+        with app_module.sessions_lock:
+            app_module.sessions["idle-1"] = session
+        usage = [{4242: {"cpu_seconds": 1.0}}] * 2
+        mock_hibernate, _ = self._fire(app_module, "idle-1", usage)
+        mock_hibernate.assert_called_once_with("idle-1", session)
+
+    def test_session_using_cpu_rechecked_later(self, app_module):
+        session = _make_session(4242)
+        session["last_poll_time"] = session["last_output_time"] = time.time() - 600
+        with app_module.sessions_lock:
+            app_module.sessions["idle-2"] = session
+        usage = [{4242: {"cpu_seconds": 1.0}}, {4242: {"cpu_seconds": 5.0}}]
+        mock_hibernate, mock_schedule = self._fire(app_module, "idle-2", usage)
+        mock_hibernate.assert_not_called()
+        key, deadline, _ = mock_schedule.call_args[0]
+        assert key == ("hibernate", "idle-2")
+        assert deadline > time.time()
+
+    def test_cpu_mark_updated_under_session_lock(self, app_module):
+        unlocked_writes = []
+
+        class _Session(dict):
+            def __setitem__(self, key, value):
+                if key == "hibernate_cpu_mark" and not self["lock"].locked():
+                    unlocked_writes.append(value)
+                super().__setitem__(key, value)
+
+        session = _Session(_make_session(4242))
+        session["last_poll_time"] = session["last_output_time"] = time.time() - 600
+        with app_module.sessions_lock:
+            app_module.sessions["idle-5"] = session
+        usage = [{4242: {"cpu_seconds": 1.0}}, {4242: {"cpu_seconds": 2.0}}]
+        self._fire(app_module, "idle-5", usage)
+        assert session["hibernate_cpu_mark"] == 2.0
+        assert unlocked_writes == []
+
+    def test_timer_only_enqueues(self, app_module):
+        session = _make_session(4242)
+        with app_module.sessions_lock:
+            app_module.sessions["idle-4"] = session
+        worker = ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        try:
+            with mock.patch.object(session_resources, "HIBERNATE_AFTER_SECONDS", 60), \
+                 mock.patch.object(app_module, "session_worker", worker), \
+                 mock.patch.object(app_module.session_scheduler, "schedule") as mock_schedule, \
+                 mock.patch.object(app_module, "_on_hibernate_deadline",
+                                   side_effect=lambda sid: release.wait(5)) as mock_check:
+                app_module._arm_hibernate_timer("idle-4", session)
+                callback = mock_schedule.call_args[0][2]
+                started = time.time()
+                callback()
+                # The slow check runs on the worker; the scheduler thread is free
+                assert time.time() - started < 0.5
+                release.set()
+                worker.shutdown(wait=True)
+            mock_check.assert_called_once_with("idle-4")
+        finally:
+            release.set()
+
+    def test_recent_activity_moves_deadline(self, app_module):
+        session = _make_session(4242)
+        with app_module.sessions_lock:
+            app_module.sessions["idle-3"] = session
+        mock_hibernate, mock_schedule = self._fire(app_module, "idle-3", [{}])
+        mock_hibernate.assert_not_called()
+        _, deadline, _ = mock_schedule.call_args[0]
+        assert deadline == pytest.approx(session["last_poll_time"] + 60)
+
+
+# ---------------------------------------------------------------------------
+# 4. Reader thread
+# ---------------------------------------------------------------------------
+
+class TestReaderWhileHibernated:
+
+    def test_reader_resumes_after_wake(self, app_module):
+        master_fd, slave_fd = pty.openpty()
+        proc = subprocess.Popen(
+            ["bash", "--norc", "--noprofile"],
+            stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+            preexec_fn=os.setsid,
+        )
+        os.close(slave_fd)
+        session = _make_session(proc.pid)
+        session["master_fd"] = master_fd
+        with app_module.sessions_lock:
+            app_module.sessions["rd-1"] = session
+        reader = threading.Thread(target=app_module.read_pty_output,
+                                  args=("rd-1", master_fd), daemon=True)
+        reader.start()
+        try:
+            time.sleep(0.5)
+            with mock.patch.object(session_resources, "HIBERNATE_MODE", "stop"):
+                app_module._hibernate_session("rd-1", session)
+            assert session["hibernation"]["mechanism"] == "sigstop"
+
+            os.write(master_fd, b"echo hibernate-$((40+2))\n")
+            time.sleep(0.5)
+            assert "hibernate-42" not in "".join(session["output_buffer"])
+
+            app_module._wake_session("rd-1", session)
+            deadline = time.time() + 5
+            while time.time() < deadline and "hibernate-42" not in "".join(session["output_buffer"]):
+                time.sleep(0.05)
+            assert "hibernate-42" in "".join(session["output_buffer"])
+        finally:
+            with app_module.sessions_lock:
+                app_module.sessions.pop("rd-1", None)
+            session["wake"].set()
+            os.killpg(proc.pid, 9)
+            proc.wait()
+            # The reader's exit path terminates the session and closes master_fd
+            reader.join(timeout=5)
@@ -0,0 +1,235 @@
+"""Tests for foreground-pane priority scheduling.
+
+Verifies that:
+- session_pids() finds every process in a setsid shell's session
+- apply_priority() renices background sessions and restores focused ones
+- Input and focused heartbeats move focus between sessions
+- /api/sessions reports the policy and current priorities
+"""
+
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+import session_resources
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+def _add_session(app_module, session_id, pid=12345):
+    session = {
+        "master_fd": 999,
+        "pid": pid,
+        "output_buffer": deque(maxlen=1000),
+        "lock": threading.Lock(),
+        "last_poll_time": time.time(),
+        "created_at": time.time(),
+        "label": session_id,
+    }
+    with app_module.sessions_lock:
+        app_module.sessions[session_id] = session
+    return session
+
+
+def _cleanup(app_module, *session_ids):
+    with app_module.sessions_lock:
+        for sid in session_ids:
+            app_module.sessions.pop(sid, None)
+    app_module.focused_session_id = None
+
+
+@pytest.fixture
+def priority_worker():
+    """A fresh worker per test: the shared one is never started for real if
+    another test created a session while threading.Thread was mocked."""
+    app_module = _get_app()
+    worker = ThreadPoolExecutor(max_workers=1)
+    with mock.patch.object(app_module, "priority_worker", worker):
+        yield worker
+    worker.shutdown(wait=True)
+
+
+@pytest.fixture
+def shell_session():
+    """A setsid bash with a background job in its own process group."""
+    proc = subprocess.Popen(
+        ["bash", "-c", "set -m; sleep 30 & sleep 30; wait"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=os.setsid,
+    )
+    time.sleep(0.5)
+    yield proc
+    os.killpg(proc.pid, 9)
+    proc.wait()
+
+
+# ---------------------------------------------------------------------------
+# 1. Process-tree enumeration
+# ---------------------------------------------------------------------------
+
+class TestSessionPids:
+
+    def test_includes_shell_and_all_jobs(self, shell_session):
+        pids = session_resources.session_pids(shell_session.pid)
+        assert shell_session.pid in pids
+        # bash + two sleeps (one of them in a separate job process group)
+        assert len(pids) >= 3
+
+    def test_invalid_sid_returns_empty(self):
+        assert session_resources.session_pids(0) == []
+        assert session_resources.session_pids("abc") == []
+
+
+# ---------------------------------------------------------------------------
+# 2. Applying priorities
+# ---------------------------------------------------------------------------
+
+class TestApplyPriority:
+
+    def test_background_raises_nice_for_whole_tree(self, shell_session):
+        state = session_resources.apply_priority(shell_session.pid, focused=False)
+        assert state["focused"] is False
+        if not session_resources.NICE_ENABLED:
+            pytest.skip("renice back to 0 not permitted in this container")
+        assert state["nice"] == session_resources.BACKGROUND_NICE
+        for pid in session_resources.session_pids(shell_session.pid):
+            assert os.getpriority(os.PRIO_PROCESS, pid) == session_resources.BACKGROUND_NICE
+
+    def test_focus_restores_foreground_nice(self, shell_session):
+        if not session_resources.NICE_ENABLED:
+            pytest.skip("renice back to 0 not permitted in this container")
+        session_resources.apply_priority(shell_session.pid, focused=False)
+        state = session_resources.apply_priority(shell_session.pid, focused=True)
+        assert state["nice"] == session_resources.FOREGROUND_NICE
+        for pid in session_resources.session_pids(shell_session.pid):
+            assert os.getpriority(os.PRIO_PROCESS, pid) == session_resources.FOREGROUND_NICE
+
+    def test_nice_skipped_when_not_restorable(self, shell_session):
+        with mock.patch.object(session_resources, "NICE_ENABLED", False):
+            state = session_resources.apply_priority(shell_session.pid, focused=False)
+        assert state["nice"] is None
+        assert os.getpriority(os.PRIO_PROCESS, shell_session.pid) == 0
+
+    def test_cgroup_weight_written_when_available(self, tmp_path):
+        (tmp_path / "cpu.weight").write_text("100")
+        assert session_resources.set_cgroup_weight(str(tmp_path), 50) is True
+        assert (tmp_path / "cpu.weight").read_text() == "50"
+
+    def test_cgroup_weight_noop_without_cgroup(self):
+        assert session_resources.set_cgroup_weight(None, 50) is False
+
+
+# ---------------------------------------------------------------------------
+# 3. Focus tracking
+# ---------------------------------------------------------------------------
+
+class TestFocusTracking:
+
+    def test_input_moves_focus(self, priority_worker):
+        app_module = _get_app()
+        _add_session(app_module, "focus-a")
+        _add_session(app_module, "focus-b")
+        try:
+            client = app_module.app.test_client()
+            with mock.patch.object(app_module, "check_authorization", return_value=(True, None)), \
+                 mock.patch.object(app_module, "_apply_focus_priorities") as mock_apply, \
+                 mock.patch("os.write"):
+                client.post("/api/input", json={"session_id": "focus-a", "input": "x"})
+                client.post("/api/input", json={"session_id": "focus-b", "input": "y"})
+                # Repeated input to the same session doesn't re-prioritize
+                client.post("/api/input", json={"session_id": "focus-b", "input": "z"})
+                priority_worker.submit(lambda: None).result(5)
+            assert app_module.focused_session_id == "focus-b"
+            assert mock_apply.call_count == 2
+            mock_apply.assert_called_with("focus-a", "focus-b")
+        finally:
+            _cleanup(app_module, "focus-a", "focus-b")
+
+    def test_focused_heartbeat_moves_focus(self):
+        app_module = _get_app()
+        _add_session(app_module, "focus-hb")
+        try:
+            client = app_module.app.test_client()
+            with mock.patch.object(app_module, "check_authorization", return_value=(True, None)), \
+                 mock.patch.object(app_module, "_apply_focus_priorities"):
+                client.post("/api/heartbeat", json={"session_id": "focus-hb"})
+                assert app_module.focused_session_id is None
+                client.post("/api/heartbeat", json={"session_id": "focus-hb", "focused": True})
+            assert app_module.focused_session_id == "focus-hb"
+        finally:
+            _cleanup(app_module, "focus-hb")
+
+    def test_rapid_switches_end_on_current_focus(self, priority_worker):
+        app_module = _get_app()
+        _add_session(app_module, "focus-x", pid=111)
+        _add_session(app_module, "focus-y", pid=222)
+        applied = {}
+        calls = []
+
+        def slow_apply(pid, focused, cgroup=None):
+            calls.append(pid)
+            # The x->y move's demotion of x stalls, as if its /proc scan did
+            if len(calls) == 2:
+                time.sleep(0.2)
+            applied[pid] = focused
+            return {"focused": focused}
+
+        try:
+            with mock.patch.object(session_resources, "apply_priority", side_effect=slow_apply):
+                for sid in ("focus-x", "focus-y", "focus-x"):
+                    app_module._set_focused_session(sid)
+                priority_worker.submit(lambda: None).result(5)
+            assert applied == {111: True, 222: False}
+        finally:
+            _cleanup(app_module, "focus-x", "focus-y")
+
+    def test_policy_off_ignores_focus(self):
+        app_module = _get_app()
+        _add_session(app_module, "focus-off")
+        try:
+            with mock.patch.object(session_resources, "PRIORITY_POLICY", "off"):
+                app_module._set_focused_session("focus-off")
+            assert app_module.focused_session_id is None
+        finally:
+            _cleanup(app_module, "focus-off")
+
+
+# ---------------------------------------------------------------------------
+# 4. /api/sessions exposes priorities
+# ---------------------------------------------------------------------------
+
+class TestSessionsEndpoint:
+
+    def test_priority_reported(self):
+        app_module = _get_app()
+        sess = _add_session(app_module, "prio-1", pid=os.getpid())
+        sess["priority"] = {"focused": False, "nice": 10, "ionice": 7, "cgroup_weight": None}
+        try:
+            client = app_module.app.test_client()
+            with mock.patch.object(app_module, "check_authorization", return_value=(True, None)):
+                resp = client.get("/api/sessions")
+            entry = next(s for s in resp.get_json() if s["session_id"] == "prio-1")
+            assert entry["priority"]["policy"] == session_resources.PRIORITY_POLICY
+            assert entry["priority"]["nice"] == 10
+            assert entry["priority"]["ionice"] == 7
+            assert entry["priority"]["focused"] is False
+        finally:
+            _cleanup(app_module, "prio-1")
@@ -0,0 +1,190 @@
+"""Tests for per-session resource limits and accounting.
+
+Verifies that:
+- Limits go on the session cgroup (whose controllers are enabled) when
+  possible; process and CPU limits fall back to rlimits, memory never does
+- spawn_preexec() applies rlimits and a new session in the child
+- sessions_usage() aggregates CPU, RSS and process count over the tree
+- /api/sessions and /api/metrics expose usage and limits
+"""
+
+import os
+import resource
+import subprocess
+import threading
+import time
+from collections import deque
+from unittest import mock
+
+import pytest
+
+import session_resources
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+# ---------------------------------------------------------------------------
+# 1. Limit placement
+# ---------------------------------------------------------------------------
+
+class TestApplySessionLimits:
+
+    def test_no_limits_by_default(self):
+        with mock.patch.object(session_resources, "MEMORY_LIMIT_MB", 0), \
+             mock.patch.object(session_resources, "PIDS_LIMIT", 0), \
+             mock.patch.object(session_resources, "CPU_LIMIT_SECONDS", 0):
+            limits, rlimits = session_resources.apply_session_limits(None)
+        assert limits == {}
+        assert rlimits == []
+
+    def test_cgroup_preferred_when_writable(self, tmp_path):
+        (tmp_path / "memory.max").write_text("max")
+        (tmp_path / "pids.max").write_text("max")
+        with mock.patch.object(session_resources, "MEMORY_LIMIT_MB", 512), \
+             mock.patch.object(session_resources, "PIDS_LIMIT", 64), \
+             mock.patch.object(session_resources, "CPU_LIMIT_SECONDS", 0):
+            limits, rlimits = session_resources.apply_session_limits(str(tmp_path))
+        assert (tmp_path / "memory.max").read_text() == str(512 * 1024 * 1024)
+        assert (tmp_path / "pids.max").read_text() == "64"
+        assert limits["memory_bytes"]["via"] == "cgroup"
+        assert limits["processes"]["via"] == "cgroup"
+        assert rlimits == []
+
+    def test_rlimit_fallback_without_cgroup(self, caplog):
+        with mock.patch.object(session_resources, "MEMORY_LIMIT_MB", 512), \
+             mock.patch.object(session_resources, "PIDS_LIMIT", 64), \
+             mock.patch.object(session_resources, "CPU_LIMIT_SECONDS", 30), \
+             mock.patch.object(session_resources, "_warned", set()):
+            limits, rlimits = session_resources.apply_session_limits(None)
+        assert limits["processes"]["via"] == "rlimit"
+        assert limits["cpu_seconds"] == {"limit": 30, "via": "rlimit"}
+        assert (resource.RLIMIT_NPROC, 64) in rlimits
+        assert (resource.RLIMIT_CPU, 30) in rlimits
+        # Never RLIMIT_AS: V8-based agents reserve more address space than that
+        assert "memory_bytes" not in limits
+        assert not [r for r in rlimits if r[0] == resource.RLIMIT_AS]
+        assert "without a memory cap" in caplog.text
+
+    def test_memory_controller_missing_from_cgroup(self, tmp_path):
+        (tmp_path / "pids.max").write_text("max")
+        with mock.patch.object(session_resources, "MEMORY_LIMIT_MB", 512), \
+             mock.patch.object(session_resources, "PIDS_LIMIT", 64), \
+             mock.patch.object(session_resources, "CPU_LIMIT_SECONDS", 0):
+            limits, rlimits = session_resources.apply_session_limits(str(tmp_path))
+        assert limits == {"processes": {"limit": 64, "via": "cgroup"}}
+        assert rlimits == []
+
+    def test_controllers_enabled_for_session_cgroups(self, tmp_path):
+        (tmp_path / "cgroup.controllers").write_text("cpu memory pids\n")
+        (tmp_path / "cgroup.subtree_control").write_text("cpu\n")
+        with mock.patch.dict(session_resources._cgroup_base_cache, {"resolved": True, "path": str(tmp_path)}), \
+             mock.patch.object(session_resources, "_controllers_enabled", set()), \
+             mock.patch.object(session_resources, "_write_knob", return_value=True) as write:
+            path = session_resources.create_session_cgroup("ctl-1")
+            session_resources.create_session_cgroup("ctl-2")
+        assert path == str(tmp_path / "coda-ctl-1")
+        # Only what's available and not yet enabled, and only once per base
+        assert write.call_args_list == [
+            mock.call(str(tmp_path), "cgroup.subtree_control", "+memory"),
+            mock.call(str(tmp_path), "cgroup.subtree_control", "+pids"),
+        ]
+
+
+# ---------------------------------------------------------------------------
+# 2. Spawning with limits
+# ---------------------------------------------------------------------------
+
+class TestSpawnPreexec:
+
+    def test_child_gets_rlimits_and_new_session(self):
+        preexec = session_resources.spawn_preexec(None, [(resource.RLIMIT_CPU, 42)])
+        out = subprocess.run(
+            ["bash", "-c", "ulimit -t; ps -o sid= -p $$"],
+            capture_output=True, text=True, preexec_fn=preexec, timeout=10,
+        )
+        cpu_limit, sid = out.stdout.split()
+        assert cpu_limit == "42"
+        assert sid != str(os.getsid(0))
+
+    def test_missing_cgroup_does_not_block_spawn(self, tmp_path):
+        preexec = session_resources.spawn_preexec(str(tmp_path / "gone"), [])
+        out = subprocess.run(["true"], preexec_fn=preexec, timeout=10)
+        assert out.returncode == 0
+
+
+# ---------------------------------------------------------------------------
+# 3. Accounting
+# ---------------------------------------------------------------------------
+
+class TestSessionUsage:
+
+    def test_aggregates_over_process_tree(self):
+        proc = subprocess.Popen(
+            ["bash", "-c", "sleep 30 & sleep 30 & wait"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            preexec_fn=os.setsid,
+        )
+        time.sleep(0.5)
+        try:
+            usage = session_resources.session_usage(proc.pid)
+            assert usage["processes"] == 3
+            assert usage["rss_bytes"] > 0
+            assert usage["cpu_seconds"] >= 0
+            assert {"read_bytes", "write_bytes"} <= set(usage)
+        finally:
+            os.killpg(proc.pid, 9)
+            proc.wait()
+
+    def test_dead_session_reports_zero(self):
+        usage = session_resources.session_usage(999999999)
+        assert usage["processes"] == 0
+        assert usage["rss_bytes"] == 0
+
+
+# ---------------------------------------------------------------------------
+# 4. Endpoints
+# ---------------------------------------------------------------------------
+
+class TestEndpoints:
+
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        app_module = _get_app()
+        with app_module.sessions_lock:
+            app_module.sessions.clear()
+            # Our own session leader, so the /proc scan finds live processes
+            app_module.sessions["res-1"] = {
+                "pid": os.getsid(0), "master_fd": 0,
+                "output_buffer": deque(maxlen=1000),
+                "lock": threading.Lock(),
+                "last_poll_time": time.time(), "created_at": time.time(),
+                "label": "claude",
+                "limits": {"memory_bytes": {"limit": 1024, "via": "rlimit"}},
+            }
+        self.app_module = app_module
+        self.client = app_module.app.test_client()
+        yield
+        with app_module.sessions_lock:
+            app_module.sessions.clear()
+
+    def test_sessions_include_usage_and_limits(self):
+        with mock.patch.object(self.app_module, "check_authorization", return_value=(True, None)):
+            data = self.client.get("/api/sessions").get_json()
+        assert data[0]["limits"]["memory_bytes"]["limit"] == 1024
+        assert data[0]["usage"]["processes"] >= 1
+
+    def test_metrics_totals(self):
+        with mock.patch.object(self.app_module, "check_authorization", return_value=(True, None)):
+            resp = self.client.get("/api/metrics")
+        assert resp.status_code == 200
+        data = resp.get_json()
+        assert data["sessions"]["res-1"]["label"] == "claude"
+        assert data["totals"]["processes"] == data["sessions"]["res-1"]["usage"]["processes"]
+        assert data["totals"]["rss_bytes"] > 0
+        assert set(data["configured_limits"]) == {"memory_mb", "processes", "cpu_seconds"}
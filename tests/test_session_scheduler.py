@@ -0,0 +1,235 @@
+"""Tests for the deadline scheduler and the session timers built on it.
+
+Verifies that:
+- DeadlineScheduler fires callbacks in deadline order, on time
+- Rescheduling a key replaces its deadline; cancel drops it
+- Idle timers re-arm after activity, warn at 80% and reap at 100%
+- terminate_session returns immediately and escalates to SIGKILL later
+- A second terminate_session (the reader's, after a close) is a no-op
+"""
+
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from scheduler import DeadlineScheduler
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+def _add_session(app_module, session_id, idle_seconds, pid=12345):
+    session = {
+        "master_fd": 999,
+        "pid": pid,
+        "output_buffer": deque(maxlen=1000),
+        "lock": threading.Lock(),
+        "last_poll_time": time.time() - idle_seconds,
+        "created_at": time.time() - idle_seconds - 60,
+    }
+    with app_module.sessions_lock:
+        app_module.sessions[session_id] = session
+    return session
+
+
+def _cleanup(app_module, *session_ids):
+    with app_module.sessions_lock:
+        for sid in session_ids:
+            app_module.sessions.pop(sid, None)
+    for sid in session_ids:
+        for kind in ("idle", "hibernate", "kill"):
+            app_module.session_scheduler.cancel((kind, sid))
+
+
+# ---------------------------------------------------------------------------
+# 1. DeadlineScheduler
+# ---------------------------------------------------------------------------
+
+class TestDeadlineScheduler:
+
+    def test_fires_in_deadline_order(self):
+        sched = DeadlineScheduler(name="test-order")
+        fired = []
+        done = threading.Event()
+        now = time.time()
+        sched.schedule("c", now + 0.15, lambda: (fired.append("c"), done.set()))
+        sched.schedule("a", now + 0.05, lambda: fired.append("a"))
+        sched.schedule("b", now + 0.10, lambda: fired.append("b"))
+        assert done.wait(2)
+        assert fired == ["a", "b", "c"]
+        assert len(sched) == 0
+
+    def test_fires_on_time(self):
+        sched = DeadlineScheduler(name="test-timing")
+        fired_at = []
+        done = threading.Event()
+        deadline = time.time() + 0.2
+        sched.schedule("t", deadline, lambda: (fired_at.append(time.time()), done.set()))
+        assert done.wait(2)
+        assert deadline <= fired_at[0] < deadline + 0.1
+
+    def test_reschedule_replaces_deadline(self):
+        sched = DeadlineScheduler(name="test-replace")
+        fired = []
+        sched.schedule("k", time.time() + 0.05, lambda: fired.append("early"))
+        sched.schedule("k", time.time() + 0.15, lambda: fired.append("late"))
+        time.sleep(0.3)
+        assert fired == ["late"]
+
+    def test_cancel(self):
+        sched = DeadlineScheduler(name="test-cancel")
+        fired = []
+        sched.schedule("k", time.time() + 0.05, lambda: fired.append("k"))
+        assert sched.deadline("k") is not None
+        assert sched.cancel("k") is True
+        assert sched.cancel("k") is False
+        time.sleep(0.15)
+        assert fired == []
+
+    def test_failing_callback_does_not_stop_scheduler(self):
+        sched = DeadlineScheduler(name="test-errors")
+        done = threading.Event()
+        sched.schedule("bad", time.time(), lambda: 1 / 0)
+        sched.schedule("good", time.time() + 0.05, done.set)
+        assert done.wait(2)
+
+    def test_stale_entries_compacted(self):
+        sched = DeadlineScheduler(name="test-compact")
+        far = time.time() + 3600
+        for i in range(1000):
+            sched.schedule("same", far + i, lambda: None)
+        assert len(sched) == 1
+        assert len(sched._heap) <= 130
+
+
+# ---------------------------------------------------------------------------
+# 2. Idle timers
+# ---------------------------------------------------------------------------
+
+class TestIdleTimers:
+
+    def test_armed_at_warning_threshold(self):
+        app_module = _get_app()
+        session = _add_session(app_module, "arm-1", idle_seconds=0)
+        try:
+            app_module._arm_idle_timer("arm-1", session)
+            deadline = app_module.session_scheduler.deadline(("idle", "arm-1"))
+            expected = session["last_poll_time"] + app_module.SESSION_TIMEOUT_SECONDS * 0.8
+            assert deadline == pytest.approx(expected)
+        finally:
+            _cleanup(app_module, "arm-1")
+
+    def test_active_session_rearmed(self):
+        app_module = _get_app()
+        session = _add_session(app_module, "active-1", idle_seconds=60)
+        try:
+            app_module._on_idle_deadline("active-1")
+            assert "timeout_warning" not in session
+            deadline = app_module.session_scheduler.deadline(("idle", "active-1"))
+            assert deadline > time.time() + app_module.SESSION_TIMEOUT_SECONDS * 0.7
+        finally:
+            _cleanup(app_module, "active-1")
+
+    def test_warning_then_reap_scheduled(self):
+        app_module = _get_app()
+        session = _add_session(app_module, "warn-1", idle_seconds=72000)
+        try:
+            app_module._on_idle_deadline("warn-1")
+            assert session["timeout_warning"] is True
+            deadline = app_module.session_scheduler.deadline(("idle", "warn-1"))
+            assert deadline == pytest.approx(
+                session["last_poll_time"] + app_module.SESSION_TIMEOUT_SECONDS + 1)
+        finally:
+            _cleanup(app_module, "warn-1")
+
+    def test_stale_session_reaped(self):
+        app_module = _get_app()
+        _add_session(app_module, "stale-1", idle_seconds=90000)
+        worker = ThreadPoolExecutor(max_workers=1)
+        try:
+            with mock.patch.object(app_module, "terminate_session") as mock_terminate, \
+                 mock.patch.object(app_module, "session_worker", worker):
+                app_module._on_idle_deadline("stale-1")
+                worker.shutdown(wait=True)
+            mock_terminate.assert_called_once_with("stale-1", 12345, 999)
+        finally:
+            _cleanup(app_module, "stale-1")
+
+    def test_backstop_rearms_missing_timer(self):
+        app_module = _get_app()
+        _add_session(app_module, "lost-1", idle_seconds=0)
+        try:
+            with mock.patch("app.time.sleep", side_effect=[None, KeyboardInterrupt()]):
+                with pytest.raises(KeyboardInterrupt):
+                    app_module.cleanup_stale_sessions()
+            assert app_module.session_scheduler.deadline(("idle", "lost-1")) is not None
+        finally:
+            _cleanup(app_module, "lost-1")
+
+
+# ---------------------------------------------------------------------------
+# 3. Termination escalation
+# ---------------------------------------------------------------------------
+
+class TestTerminationEscalation:
+
+    def test_terminate_returns_immediately_and_kills_later(self):
+        app_module = _get_app()
+        # Ignores SIGHUP, so only the scheduled SIGKILL can end it
+        proc = subprocess.Popen(["bash", "-c", "trap '' HUP; sleep 30"], preexec_fn=os.setsid)
+        time.sleep(0.3)  # Let the trap install before SIGHUP arrives
+        r, w = os.pipe()
+        os.close(w)
+        _add_session(app_module, "kill-1", idle_seconds=0, pid=proc.pid)
+        try:
+            with mock.patch.object(app_module, "GRACEFUL_SHUTDOWN_WAIT", 0.2):
+                started = time.time()
+                app_module.terminate_session("kill-1", proc.pid, r)
+                assert time.time() - started < 0.5
+            assert app_module._get_session("kill-1") is None
+            proc.wait(timeout=5)
+            assert proc.returncode == -9
+            time.sleep(0.1)
+            with pytest.raises(OSError):
+                os.fstat(r)
+        finally:
+            _cleanup(app_module, "kill-1")
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+    def test_reader_exit_after_close_keeps_escalation(self):
+        app_module = _get_app()
+        proc = subprocess.Popen(["true"])
+        proc.wait()
+        r, w = os.pipe()
+        session = _add_session(app_module, "close-1", idle_seconds=0, pid=proc.pid)
+        session["cgroup"] = "/sys/fs/cgroup/coda/close-1"
+        reader = threading.Thread(target=app_module.read_pty_output, args=("close-1", r))
+        try:
+            with mock.patch.object(app_module, "GRACEFUL_SHUTDOWN_WAIT", 0.2), \
+                 mock.patch.object(app_module.socketio, "emit") as mock_emit, \
+                 mock.patch.object(app_module.session_resources, "remove_session_cgroup") as mock_remove:
+                reader.start()
+                time.sleep(0.1)
+                # HTTP close, then the reader notices and runs its epilogue
+                app_module.terminate_session("close-1", proc.pid, r)
+                reader.join(timeout=5)
+                time.sleep(0.4)
+            mock_remove.assert_called_once_with("/sys/fs/cgroup/coda/close-1")
+            closed = [c for c in mock_emit.call_args_list if c[0][0] == "session_closed"]
+            assert len(closed) == 1
+        finally:
+            _cleanup(app_module, "close-1")
+            os.close(w)
@@ -0,0 +1,124 @@
+"""Tests for static asset serving (static_assets.py).
+
+Verifies that:
+- References between static files are rewritten to content-hashed URLs
+- A change to a dependency changes the hash of everything that references it
+- Text assets are precompressed and served according to Accept-Encoding
+- Hashed URLs are immutable; index.html revalidates with ETag/304
+"""
+
+import gzip
+import os
+from unittest import mock
+
+import pytest
+
+import static_assets
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "dep.js").write_text("console.log('dep');\n" * 100)
+    (tmp_path / "worker.js").write_text('importScripts("/static/lib/dep.js");\n')
+    (tmp_path / "index.html").write_text(
+        '<script src="/static/lib/dep.js"></script>'
+        "<script>new Worker('/static/worker.js'); fetch('/static/missing.js');</script>"
+    )
+    return tmp_path
+
+
+# ---------------------------------------------------------------------------
+# 1. Manifest
+# ---------------------------------------------------------------------------
+
+class TestManifest:
+
+    def test_references_rewritten_to_hashed_urls(self, static_dir):
+        manifest = static_assets.build_manifest(str(static_dir))
+        dep_hash = manifest["lib/dep.js"]["hash"]
+        worker_hash = manifest["worker.js"]["hash"]
+        index = manifest["index.html"]["body"].decode()
+        assert f"/static/lib/dep.js?v={dep_hash}" in index
+        assert f"/static/worker.js?v={worker_hash}" in index
+        assert f"/static/lib/dep.js?v={dep_hash}" in manifest["worker.js"]["body"].decode()
+        # Unknown files are left alone
+        assert "/static/missing.js'" in index
+
+    def test_dependency_change_propagates(self, static_dir):
+        before = static_assets.build_manifest(str(static_dir))
+        (static_dir / "lib" / "dep.js").write_text("console.log('changed');\n" * 100)
+        after = static_assets.build_manifest(str(static_dir))
+        for rel in ("lib/dep.js", "worker.js", "index.html"):
+            assert before[rel]["hash"] != after[rel]["hash"], rel
+
+    def test_large_text_precompressed(self, static_dir):
+        manifest = static_assets.build_manifest(str(static_dir))
+        dep = manifest["lib/dep.js"]
+        assert gzip.decompress(dep["encodings"]["gzip"]) == dep["body"]
+        # Too small to be worth it
+        assert manifest["worker.js"]["encodings"] == {}
+
+
+# ---------------------------------------------------------------------------
+# 2. Serving
+# ---------------------------------------------------------------------------
+
+class TestServing:
+
+    @pytest.fixture(autouse=True)
+    def setup_app(self):
+        app_module = _get_app()
+        with mock.patch.object(app_module, "check_authorization", return_value=(True, None)):
+            self.client = app_module.app.test_client()
+            yield
+
+    def test_index_revalidates_with_etag(self):
+        resp = self.client.get("/")
+        assert resp.status_code == 200
+        assert resp.headers["Cache-Control"] == "no-cache"
+        etag = resp.headers["ETag"]
+        resp = self.client.get("/", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.data == b""
+
+    def test_index_links_hashed_assets(self):
+        html = self.client.get("/").get_data(as_text=True)
+        assert "/static/lib/xterm.js?v=" in html
+        assert "/static/poll-worker.js?v=" in html
+
+    def test_gzip_negotiated(self):
+        plain = self.client.get("/static/lib/xterm.js")
+        resp = self.client.get("/static/lib/xterm.js", headers={"Accept-Encoding": "gzip, deflate"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.headers["Vary"] == "Accept-Encoding"
+        assert len(resp.data) < len(plain.data) / 2
+        assert gzip.decompress(resp.data) == plain.data
+        assert resp.headers["ETag"] != plain.headers["ETag"]
+
+    def test_refused_encoding_not_used(self):
+        resp = self.client.get("/static/lib/xterm.js", headers={"Accept-Encoding": "gzip;q=0"})
+        assert "Content-Encoding" not in resp.headers
+
+    def test_hashed_url_is_immutable(self):
+        asset = static_assets.get_manifest()["lib/xterm.js"]
+        resp = self.client.get(f"/static/lib/xterm.js?v={asset['hash']}")
+        assert resp.headers["Cache-Control"] == static_assets.IMMUTABLE_CACHE_CONTROL
+        assert "javascript" in resp.headers["Content-Type"]
+
+    def test_stale_hash_not_cached_forever(self):
+        resp = self.client.get("/static/lib/xterm.js?v=0000")
+        assert resp.status_code == 200
+        assert resp.headers["Cache-Control"] == "no-cache"
+
+    def test_unknown_and_traversal_paths_404(self):
+        assert self.client.get("/static/nope.js").status_code == 404
+        assert self.client.get("/static/../app.py").status_code == 404
@@ -0,0 +1,51 @@
+"""Tests for the transport worker (static/poll-worker.js).
+
+Verifies that:
+- Socket.IO and the scrollback cache are loaded in the worker, not the page
+- Output reaches the main thread as transferred Uint8Arrays
+- Output already delivered (by offset) is not delivered twice
+- The main thread forwards input, resize and focus instead of doing I/O
+"""
+
+import os
+import re
+
+import pytest
+
+STATIC = os.path.join(os.path.dirname(__file__), "..", "static")
+
+
+def _read(name):
+    with open(os.path.join(STATIC, name)) as f:
+        return f.read()
+
+
+class TestTransportWorker:
+
+    @pytest.fixture(autouse=True)
+    def _load(self):
+        self.worker = _read("poll-worker.js")
+        self.html = _read("index.html")
+
+    def test_socketio_runs_in_worker(self):
+        assert 'importScripts("/static/lib/socket.io.min.js", "/static/scrollback-cache.js")' in self.worker
+        assert "socket.io.min.js" not in self.html
+        assert "scrollback-cache.js\"></script>" not in self.html
+        assert "io(" not in re.sub(r"//.*", "", self.html)
+
+    def test_output_transferred_as_bytes(self):
+        assert "encoder.encode(output)" in self.worker
+        assert "[bytes.buffer]" in self.worker
+
+    def test_duplicate_output_dropped_by_offset(self):
+        deliver = re.search(r"function deliver\(.*?\n}\n", self.worker, re.S).group(0)
+        assert "if (offset <= seen) return;" in deliver
+        assert "seenOffsets.set(sessionId, offset)" in deliver
+
+    def test_attach_reports_seen_offset(self):
+        assert "type: 'seen'" in self.html
+
+    def test_main_thread_does_no_network_io_for_terminals(self):
+        for endpoint in ("/api/input", "/api/resize", "/api/output-batch"):
+            assert endpoint not in self.html
+            assert endpoint in self.worker
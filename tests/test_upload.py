@@ -143,7 +143,8 @@ class TestHomeFallback:
         """When HOME='/', should use /app/python/source_code."""
         with mock.patch.dict(os.environ, {"HOME": "/"}), \
              mock.patch("os.makedirs") as mock_mkdirs, \
-             mock.patch("werkzeug.datastructures.file_storage.FileStorage.save"):
+             mock.patch("werkzeug.datastructures.file_storage.FileStorage.save"), \
+             mock.patch("uploads.store_file", return_value=("/x/test.png", "0" * 64, False)):
             client, _ = _get_test_client()
             data = {"file": (io.BytesIO(b"data"), "test.png")}
             resp = client.post("/api/upload", data=data, content_type="multipart/form-data")
@@ -152,3 +153,48 @@ class TestHomeFallback:
         call_args = mock_mkdirs.call_args_list
         upload_dir = call_args[-1][0][0] if call_args else ""
         assert "/app/python/source_code/uploads" in upload_dir
+
+
+# ---------------------------------------------------------------------------
+# 5. Client-side image processing
+# ---------------------------------------------------------------------------
+
+class TestProcessedImageSizes:
+    """The browser shrinks images before upload and reports the original size."""
+
+    def test_reports_original_and_processed_size(self, tmp_path):
+        with mock.patch.dict(os.environ, {"HOME": str(tmp_path)}):
+            client, _ = _get_test_client()
+            data = {
+                "file": (io.BytesIO(b"small webp"), "clipboard.webp"),
+                "original_size": "4000000",
+                "original_width": "3840",
+                "original_height": "2160",
+            }
+            resp = client.post("/api/upload", data=data, content_type="multipart/form-data")
+
+        body = resp.get_json()
+        assert body["size"] == len(b"small webp")
+        assert body["original_size"] == 4000000
+
+    def test_original_size_defaults_to_saved_size(self, tmp_path):
+        with mock.patch.dict(os.environ, {"HOME": str(tmp_path)}):
+            client, _ = _get_test_client()
+            data = {"file": (io.BytesIO(b"raw png"), "test.png"), "original_size": "junk"}
+            resp = client.post("/api/upload", data=data, content_type="multipart/form-data")
+
+        body = resp.get_json()
+        assert body["size"] == body["original_size"] == len(b"raw png")
+
+    def test_frontend_shrinks_images_in_worker(self):
+        static = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+        with open(os.path.join(static, "index.html")) as f:
+            html = f.read()
+        with open(os.path.join(static, "image-worker.js")) as f:
+            worker = f.read()
+        assert "new Worker('/static/image-worker.js')" in html
+        assert html.count("await prepareImageUpload(") == 2
+        assert "upload-max-dimension" in html
+        assert "OffscreenCanvas" in worker
+        assert "image/webp" in worker and "image/jpeg" in worker
+        assert "blob.size >= file.size" in worker
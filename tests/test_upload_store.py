@@ -0,0 +1,166 @@
+"""Tests for the content-addressed upload store (uploads.py).
+
+Verifies that:
+- Identical content uploaded twice is stored once; names are hardlinks to it
+- Uploads are read-only; replacing a name leaves the shared object intact
+- /api/upload/check finds stored content so the transfer can be skipped
+- The store is trimmed least-recently-used first, names included
+"""
+
+import hashlib
+import io
+import os
+import time
+from unittest import mock
+
+import pytest
+
+
+def _get_app():
+    """Import app with initialize_app mocked out."""
+    with mock.patch("app.initialize_app"):
+        import app as app_module
+        app_module.app.config["TESTING"] = True
+        return app_module
+
+
+@pytest.fixture
+def client(tmp_path):
+    app_module = _get_app()
+    with mock.patch.dict(os.environ, {"HOME": str(tmp_path)}):
+        yield app_module.app.test_client()
+
+
+def _upload(client, content, name):
+    data = {"file": (io.BytesIO(content), name)}
+    resp = client.post("/api/upload", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def _objects(tmp_path):
+    root = tmp_path / "uploads" / ".objects"
+    return sorted(p.name for p in root.rglob("*") if p.is_file())
+
+
+# ---------------------------------------------------------------------------
+# 1. Deduplication
+# ---------------------------------------------------------------------------
+
+class TestDeduplication:
+
+    def test_same_content_stored_once(self, client, tmp_path):
+        content = b"same screenshot"
+        first = _upload(client, content, "a.png")
+        second = _upload(client, content, "b.png")
+
+        assert first["deduplicated"] is False
+        assert second["deduplicated"] is True
+        assert first["sha256"] == second["sha256"] == hashlib.sha256(content).hexdigest()
+        assert _objects(tmp_path) == [first["sha256"]]
+        assert os.path.samefile(first["path"], second["path"])
+        assert os.path.basename(second["path"]) == f"{first['sha256'][:8]}_b.png"
+
+    def test_same_name_and_content_reuses_path(self, client):
+        first = _upload(client, b"data", "x.csv")
+        second = _upload(client, b"data", "x.csv")
+        assert first["path"] == second["path"]
+
+    def test_uploads_read_only(self, client):
+        stored = _upload(client, b"shared", "a.txt")
+        # Checked on the mode bits: the suite may run as root
+        assert os.stat(stored["path"]).st_mode & 0o222 == 0
+
+    def test_replacing_a_name_leaves_store_intact(self, client, tmp_path):
+        first = _upload(client, b"shared", "a.txt")
+        second = _upload(client, b"shared", "b.txt")
+        # What sed -i and an editor save do: write a new file, rename it over
+        edited = tmp_path / "uploads" / ".edit"
+        edited.write_bytes(b"edited")
+        os.replace(edited, first["path"])
+        with open(second["path"], "rb") as f:
+            assert f.read() == b"shared"
+        object_path = tmp_path / "uploads" / ".objects" / first["sha256"][:2] / first["sha256"]
+        assert hashlib.sha256(object_path.read_bytes()).hexdigest() == first["sha256"]
+
+    def test_chunked_commit_joins_store(self, client, tmp_path):
+        content = b"chunked" * 50
+        _upload(client, content, "small.bin")
+        uid = client.post("/api/upload/init",
+                          json={"filename": "big.bin", "size": len(content)}).get_json()["upload_id"]
+        client.put(f"/api/upload/{uid}?offset=0", data=content,
+                   content_type="application/octet-stream")
+        result = client.post(f"/api/upload/{uid}/commit", json={}).get_json()
+        assert result["deduplicated"] is True
+        assert len(_objects(tmp_path)) == 1
+
+
+# ---------------------------------------------------------------------------
+# 2. Pre-hash check
+# ---------------------------------------------------------------------------
+
+class TestPreHashCheck:
+
+    def test_known_content_linked_under_new_name(self, client):
+        stored = _upload(client, b"known", "orig.txt")
+        resp = client.post("/api/upload/check",
+                           json={"sha256": stored["sha256"], "filename": "again.txt"})
+        body = resp.get_json()
+        assert body["exists"] is True
+        assert body["path"].endswith("_again.txt")
+        with open(body["path"], "rb") as f:
+            assert f.read() == b"known"
+
+    def test_unknown_content(self, client):
+        resp = client.post("/api/upload/check", json={"sha256": "a" * 64, "filename": "x"})
+        assert resp.get_json() == {"exists": False}
+
+    def test_invalid_hash_rejected(self, client):
+        resp = client.post("/api/upload/check", json={"sha256": "../etc", "filename": "x"})
+        assert resp.status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# 3. Eviction
+# ---------------------------------------------------------------------------
+
+class TestEviction:
+
+    def test_least_recently_used_evicted_with_names(self, client, tmp_path):
+        import uploads
+        old = _upload(client, b"o" * 100, "old.bin")
+        used = _upload(client, b"u" * 100, "used.bin")
+        past = time.time() - 3600
+        for sha in (old["sha256"], used["sha256"]):
+            os.utime(uploads._object_path(sha), (past, past))
+        # Re-checking "used" makes it the most recently used
+        client.post("/api/upload/check", json={"sha256": used["sha256"], "filename": "used.bin"})
+
+        with mock.patch.object(uploads, "UPLOAD_STORE_MAX_BYTES", 250):
+            new = _upload(client, b"n" * 100, "new.bin")
+
+        assert _objects(tmp_path) == sorted([used["sha256"], new["sha256"]])
+        assert not os.path.exists(old["path"])
+        assert os.path.exists(used["path"]) and os.path.exists(new["path"])
+
+    def test_newest_upload_survives_even_over_cap(self, client, tmp_path):
+        import uploads
+        with mock.patch.object(uploads, "UPLOAD_STORE_MAX_BYTES", 10):
+            result = _upload(client, b"big" * 100, "big.bin")
+        assert os.path.exists(result["path"])
+
+
+# ---------------------------------------------------------------------------
+# 4. Frontend
+# ---------------------------------------------------------------------------
+
+class TestStoreFrontend:
+
+    def test_clients_check_before_uploading(self):
+        static = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+        with open(os.path.join(static, "index.html")) as f:
+            html = f.read()
+        with open(os.path.join(static, "chunked-upload.js")) as f:
+            js = f.read()
+        assert html.count("await findUploaded(formData.get('file'))") == 2
+        assert "/api/upload/check" in html and "/api/upload/check" in js
@@ -0,0 +1,46 @@
+"""Tests for the shared terminal write scheduler in index.html.
+
+Verifies that:
+- All panes share one requestAnimationFrame loop instead of one each
+- The focused pane is flushed before the per-frame budget applies
+- Background panes are bounded by a time and byte budget per frame
+"""
+
+import os
+import re
+
+import pytest
+
+INDEX_HTML = os.path.join(os.path.dirname(__file__), "..", "static", "index.html")
+
+
+def _function_body(html, name):
+    match = re.search(r"function %s\(.*?\n    }\n" % name, html, re.S)
+    assert match, f"{name}() not found in index.html"
+    return match.group(0)
+
+
+class TestWriteScheduler:
+
+    @pytest.fixture(autouse=True)
+    def _load_html(self):
+        self.html = open(INDEX_HTML).read()
+
+    def test_single_animation_frame_loop(self):
+        assert "requestAnimationFrame(flushWriteQueue)" in self.html
+        assert "requestAnimationFrame" not in _function_body(self.html, "createWriteBatcher")
+
+    def test_focused_pane_flushed_first(self):
+        body = _function_body(self.html, "flushWriteQueue")
+        assert body.index("getActivePane()") < body.index("for (const writer")
+
+    def test_background_panes_budgeted(self):
+        body = _function_body(self.html, "flushWriteQueue")
+        assert "WRITE_FRAME_BUDGET_MS" in body
+        assert "BACKGROUND_WRITE_BYTES_PER_FRAME" in body
+        # Anything left over gets another frame
+        assert "if (writeQueue.size) scheduleWriteFlush();" in body
+
+    def test_alt_screen_exit_still_handled(self):
+        # The worker flags alternate-screen exits; the batcher acts on the flag
+        assert "queued.altExit" in _function_body(self.html, "createWriteBatcher")
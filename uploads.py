@@ -0,0 +1,468 @@
+"""Content-addressed upload store and resumable chunked uploads for ``~/uploads``.
+
+Uploaded bytes are stored once, by SHA-256, under ``~/uploads/.objects/``;
+what the agent sees is a friendly ``~/uploads/<hash8>_<name>`` hardlink (a
+symlink where hardlinks aren't possible) to that object. Uploading the same
+screenshot from three panes therefore costs one copy, and a client that
+already knows the hash can ask ``lookup`` first and skip the transfer. The
+store is capped at ``UPLOAD_STORE_MAX_MB``: each use touches an object's
+mtime, and the least recently used objects — with their friendly names — are
+evicted once the cap is exceeded.
+
+Objects are read-only, and a hardlinked friendly name shares their mode, so
+uploads show up read-only in the terminal: an in-place write would change
+every name for that content and the object under its hash. Tools that
+replace the file instead (``sed -i``, most editors' saves) just turn the
+name into a separate file; ``cp`` gives an editable copy.
+
+``/api/upload`` parses a multipart body and saves it in one go, which is fine
+for a pasted screenshot but not for a dataset or model artifact: the whole
+body is spooled before anything is written, and a dropped connection loses
+all of it. Chunked uploads work in three steps:
+
+  init    — declare filename, size and (optionally) the SHA-256 of the whole
+            file; a ``.partial/<id>`` file of that size is preallocated
+  append  — PUT a byte range at an offset; the body is streamed straight
+            into the partial file and its own SHA-256 checked, so chunks can
+            arrive in any order and in parallel
+  commit  — once every byte is received, hash the file, compare with the
+            declared checksum and move it into place
+
+Which ranges have arrived is kept in a ``.partial/<id>.json`` sidecar, so a
+client that lost its connection (or a restarted server) can ask for the
+upload's status and send only the missing chunks. Partial uploads untouched
+for ``UPLOAD_EXPIRY_SECONDS`` are removed the next time an upload starts.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_HOME = "/app/python/source_code"
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024      # Suggested to clients; must fit MAX_CONTENT_LENGTH
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_MB", "4096")) * 1024 * 1024
+UPLOAD_EXPIRY_SECONDS = 24 * 3600
+UPLOAD_STORE_MAX_BYTES = int(os.environ.get("UPLOAD_STORE_MAX_MB", "2048")) * 1024 * 1024
+FRIENDLY_HASH_CHARS = 8
+_STREAM_BLOCK = 1024 * 1024
+_HASH_BLOCK = 4 * 1024 * 1024
+
+_uploads = {}            # upload_id -> state dict (see _new_state)
+_uploads_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """A chunked-upload request that can't be honoured; ``status`` is the HTTP code."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def home_dir():
+    """Return ``$HOME``, falling back when it is unset or ``/``."""
+    home = os.environ.get("HOME", FALLBACK_HOME)
+    if not home or home == "/":
+        home = FALLBACK_HOME
+    return home
+
+
+def upload_dir():
+    """Return ``$HOME/uploads``, created if needed."""
+    path = os.path.join(home_dir(), "uploads")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _partial_dir():
+    path = os.path.join(upload_dir(), ".partial")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _objects_dir():
+    path = os.path.join(upload_dir(), ".objects")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _valid_sha256(sha256):
+    return isinstance(sha256, str) and len(sha256) == 64 and all(
+        c in "0123456789abcdef" for c in sha256.lower())
+
+
+def _object_path(sha256):
+    return os.path.join(_objects_dir(), sha256[:2], sha256)
+
+
+def _friendly_path(sha256, filename):
+    return os.path.join(upload_dir(), f"{sha256[:FRIENDLY_HASH_CHARS]}_{secure_filename(filename) or 'upload'}")
+
+
+def _link(object_path, friendly_path):
+    """Point *friendly_path* at *object_path*: hardlink, else symlink, else copy."""
+    try:
+        if os.path.samefile(object_path, friendly_path):
+            return
+    except OSError:
+        pass
+    try:
+        os.unlink(friendly_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(object_path, friendly_path)
+    except OSError:
+        try:
+            os.symlink(object_path, friendly_path)
+        except OSError:
+            shutil.copyfile(object_path, friendly_path)
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_file(src_path, filename, sha256=None):
+    """Move *src_path* into the content store and return its friendly path.
+
+    Returns ``(path, sha256, deduplicated)``; when the content is already
+    stored, *src_path* is deleted and the existing object reused.
+    """
+    sha256 = (sha256 or hash_file(src_path)).lower()
+    object_path = _object_path(sha256)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    deduplicated = os.path.exists(object_path)
+    if deduplicated:
+        os.unlink(src_path)
+        _touch(object_path)
+    else:
+        os.replace(src_path, object_path)
+        # Read-only, so editing a friendly name can't corrupt a shared object
+        os.chmod(object_path, 0o444)
+    friendly = _friendly_path(sha256, filename)
+    _link(object_path, friendly)
+    if not deduplicated:
+        evict_uploads(keep=object_path)
+    return friendly, sha256, deduplicated
+
+
+def lookup(sha256, filename):
+    """Return the friendly path for already-stored content, or None.
+
+    Lets a client that hashed a file locally skip uploading it again.
+    """
+    if not _valid_sha256(sha256):
+        raise UploadError("Invalid sha256")
+    sha256 = sha256.lower()
+    object_path = _object_path(sha256)
+    if not os.path.exists(object_path):
+        return None
+    _touch(object_path)
+    friendly = _friendly_path(sha256, filename or "upload")
+    _link(object_path, friendly)
+    return friendly
+
+
+def _friendly_names(upload_root):
+    """Map object inode -> friendly hardlinks, and object path -> friendly symlinks."""
+    by_inode, by_target = {}, {}
+    for entry in os.scandir(upload_root):
+        if entry.name.startswith("."):
+            continue
+        try:
+            if entry.is_symlink():
+                by_target.setdefault(os.path.realpath(entry.path), []).append(entry.path)
+            elif entry.is_file():
+                by_inode.setdefault(entry.inode(), []).append(entry.path)
+        except OSError:
+            continue
+    return by_inode, by_target
+
+
+def evict_uploads(max_bytes=None, keep=None):
+    """Drop least recently used objects (and their names) until the store fits.
+
+    *keep* — the object just stored — is never evicted, even on its own over the cap.
+    """
+    max_bytes = UPLOAD_STORE_MAX_BYTES if max_bytes is None else max_bytes
+    objects = []
+    for root, _dirs, files in os.walk(_objects_dir()):
+        for name in files:
+            path = os.path.join(root, name)
+            if path == keep:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            objects.append((st.st_mtime, st.st_size, st.st_ino, path))
+    total = sum(size for _mtime, size, _ino, _path in objects)
+    if keep and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    if total <= max_bytes:
+        return 0
+
+    by_inode, by_target = _friendly_names(upload_dir())
+    evicted = 0
+    for _mtime, size, ino, path in sorted(objects):
+        if total <= max_bytes:
+            break
+        for name in by_inode.get(ino, []) + by_target.get(os.path.realpath(path), []):
+            try:
+                os.unlink(name)
+            except OSError:
+                pass
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    logger.info(f"Evicted {evicted} upload(s) to keep the store under {max_bytes} bytes")
+    return evicted
+
+
+def _valid_id(upload_id):
+    return isinstance(upload_id, str) and len(upload_id) == 32 and all(
+        c in "0123456789abcdef" for c in upload_id)
+
+
+def _add_range(ranges, start, end):
+    """Insert [start, end) into a sorted list of disjoint ranges, merging neighbours."""
+    merged = []
+    for lo, hi in sorted(ranges + [[start, end]]):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+
+def _received(state):
+    return sum(hi - lo for lo, hi in state["ranges"])
+
+
+def _status(state):
+    return {
+        "upload_id": state["id"],
+        "filename": state["filename"],
+        "size": state["size"],
+        "received": _received(state),
+        "ranges": [list(r) for r in state["ranges"]],
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "complete": _received(state) == state["size"],
+    }
+
+
+def _save_meta(state):
+    meta = {k: state[k] for k in ("id", "filename", "size", "sha256", "ranges", "created_at")}
+    tmp = state["meta_path"] + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, state["meta_path"])
+
+
+def _new_state(meta, partial_dir):
+    upload_id = meta["id"]
+    return dict(meta,
+                part_path=os.path.join(partial_dir, upload_id),
+                meta_path=os.path.join(partial_dir, f"{upload_id}.json"),
+                lock=threading.Lock(),
+                updated_at=time.time(),
+                committed=False,
+                in_flight=0)  # chunks being written; commit waits them out
+
+
+def _get(upload_id):
+    """Return the state for *upload_id*, reloading it from its sidecar after a restart."""
+    if not _valid_id(upload_id):
+        raise UploadError("Unknown upload", 404)
+    with _uploads_lock:
+        state = _uploads.get(upload_id)
+        if state is not None:
+            return state
+        partial_dir = _partial_dir()
+        try:
+            with open(os.path.join(partial_dir, f"{upload_id}.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError("Unknown upload", 404)
+        state = _new_state(meta, partial_dir)
+        if not os.path.exists(state["part_path"]):
+            raise UploadError("Unknown upload", 404)
+        _uploads[upload_id] = state
+        return state
+
+
+def _discard(state):
+    with _uploads_lock:
+        _uploads.pop(state["id"], None)
+    for path in (state["part_path"], state["meta_path"]):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def expire_stale_uploads(now=None):
+    """Remove partial uploads nobody has touched for UPLOAD_EXPIRY_SECONDS."""
+    now = now or time.time()
+    partial_dir = _partial_dir()
+    expired = 0
+    for name in os.listdir(partial_dir):
+        path = os.path.join(partial_dir, name)
+        try:
+            if now - os.stat(path).st_mtime < UPLOAD_EXPIRY_SECONDS:
+                continue
+            os.unlink(path)
+        except OSError:
+            continue
+        upload_id = name.split(".")[0]
+        with _uploads_lock:
+            _uploads.pop(upload_id, None)
+        expired += 1
+    if expired:
+        logger.info(f"Expired {expired} stale partial upload file(s)")
+
+
+def init_upload(filename, size, sha256=None):
+    """Start a chunked upload and return its status."""
+    if not filename or not secure_filename(str(filename)):
+        raise UploadError("Empty filename")
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        raise UploadError("Invalid size")
+    if size > UPLOAD_MAX_BYTES:
+        raise UploadError(f"File exceeds {UPLOAD_MAX_BYTES // (1024 * 1024)} MB limit", 413)
+    if sha256 is not None and not _valid_sha256(sha256):
+        raise UploadError("Invalid sha256")
+
+    expire_stale_uploads()
+    partial_dir = _partial_dir()
+    meta = {
+        "id": uuid.uuid4().hex,
+        "filename": secure_filename(str(filename)),
+        "size": size,
+        "sha256": sha256.lower() if sha256 else None,
+        "ranges": [],
+        "created_at": time.time(),
+    }
+    state = _new_state(meta, partial_dir)
+    with open(state["part_path"], "wb") as f:
+        f.truncate(size)
+    _save_meta(state)
+    with _uploads_lock:
+        _uploads[state["id"]] = state
+    logger.info(f"Chunked upload {state['id']} started: {state['filename']} ({size} bytes)")
+    return _status(state)
+
+
+def upload_status(upload_id):
+    state = _get(upload_id)
+    with state["lock"]:
+        return _status(state)
+
+
+def append_chunk(upload_id, offset, stream, length, chunk_sha256=None):
+    """Write *length* bytes from *stream* at *offset*; return the upload's status.
+
+    The range only counts as received once all of it has been written (and
+    matches *chunk_sha256*, when given) — a chunk cut off mid-stream is simply
+    sent again.
+    """
+    state = _get(upload_id)
+    if length is None:
+        raise UploadError("Content-Length required", 411)
+    if offset < 0 or length < 0 or offset + length > state["size"]:
+        raise UploadError("Chunk outside declared size", 416)
+    # Counted under the lock, so commit can't hash or move the partial file
+    # while this chunk is still being written into it
+    with state["lock"]:
+        if state["committed"]:
+            raise UploadError("Upload already committed", 409)
+        state["in_flight"] += 1
+
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        fd = os.open(state["part_path"], os.O_WRONLY)
+        try:
+            while written < length:
+                block = stream.read(min(_STREAM_BLOCK, length - written))
+                if not block:
+                    break
+                os.pwrite(fd, block, offset + written)
+                digest.update(block)
+                written += len(block)
+        finally:
+            os.close(fd)
+    finally:
+        with state["lock"]:
+            state["in_flight"] -= 1
+
+    if written != length:
+        raise UploadError(f"Chunk truncated ({written} of {length} bytes)")
+    if chunk_sha256 and digest.hexdigest() != chunk_sha256.lower():
+        raise UploadError("Chunk checksum mismatch", 422)
+
+    with state["lock"]:
+        if state["committed"]:
+            raise UploadError("Upload already committed", 409)
+        state["ranges"] = _add_range(state["ranges"], offset, offset + length)
+        state["updated_at"] = time.time()
+        _save_meta(state)
+        return _status(state)
+
+
+def commit_upload(upload_id, sha256=None):
+    """Verify a fully received upload and move it into the content store.
+
+    Returns ``{"path", "size", "sha256", "deduplicated"}``.
+    """
+    state = _get(upload_id)
+    with state["lock"]:
+        if state["committed"]:
+            raise UploadError("Upload already committed", 409)
+        if state["in_flight"]:
+            raise UploadError("Chunk upload still in progress", 409)
+        if _received(state) != state["size"]:
+            raise UploadError(f"Upload incomplete ({_received(state)} of {state['size']} bytes)", 409)
+        state["committed"] = True
+
+    actual = hash_file(state["part_path"])
+    expected = (sha256 or state["sha256"] or "").lower()
+    if expected and actual != expected:
+        _discard(state)
+        logger.warning(f"Chunked upload {upload_id} checksum mismatch: expected {expected}, got {actual}")
+        raise UploadError("Checksum mismatch", 422)
+
+    file_path, _, deduplicated = store_file(state["part_path"], state["filename"], actual)
+    _discard(state)
+    logger.info(f"Chunked upload {upload_id} committed: {file_path} ({state['size']} bytes"
+                f"{', deduplicated' if deduplicated else ''})")
+    return {"path": file_path, "size": state["size"], "sha256": actual, "deduplicated": deduplicated}
+
+
+def abort_upload(upload_id):
+    _discard(_get(upload_id))